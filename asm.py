@@ -1,32 +1,34 @@
 from abc import ABC
-from ast_exprs import Application, Assignment, AstirExpr, Identifier, InlineASM, Lambda, LambdaDefinition, Literal, Reference, ShuntingYardAlgorithmResults, Symbol, SymbolTable  # type: ignore
-from common import Cursor, PrimitiveTypes
+from ast_exprs import Application, Assignment, AstirExpr, BinaryOperation, Identifier, InlineASM, Lambda, LambdaDefinition, Literal, Parenthesized, PrimitiveType, Reference, ScopeArena, Symbol  # type: ignore
+from common import Cursor, PrimitiveTypes, Rule, run_stacked
+from regalloc import MAX_IMMEDIATE, Code, load_immediate
+import regalloc
+
+# Literals the lexer hands us as plain integers (floats already
+# as their IEEE-754 bit pattern) that can go straight into a register.
+IMMEDIATE_TYPES = [PrimitiveTypes.INT, PrimitiveTypes.FLOAT, PrimitiveTypes.FLOAT64]
+ARITHMETIC_INSTRUCTIONS = {"+": "add", "-": "sub"}
 
 
 class ASMFunction:
     def __init__(
-        self, param_to_reg: dict[int, int], name_to_param: dict[str, int]
+        self, param_to_reg: dict[int, int], name_to_param: dict[int, int]
     ) -> None:
         self.param_to_reg = param_to_reg
+        # Keyed on interned name IDs
         self.name_to_param = name_to_param
-        # The next usable register is calculated by getting
-        # the last inserted item in the self.param_to_reg
-        # and by adding 1 to get us to the next x register
-        self.next_usable_reg = (
-            next(reversed(param_to_reg)) + 1 if len(param_to_reg) > 0 else 0
-        )
 
 
 class ASM(Cursor):
     def __init__(
-        self, input: list[AstirExpr], symbol_tables: dict[int, SymbolTable]
+        self, input: list[AstirExpr], symbol_tables: ScopeArena
     ) -> None:
         super().__init__(input)
         self.lines: list[str] = [
             ".global _start",
             ".p2align 3",
         ]
-        self.symbol_tables: dict[int, SymbolTable] = symbol_tables
+        self.symbol_tables = symbol_tables
         # All tables related to registers most likely
         # have keys that map to a Symbol's id.
         # The inner dictionary holds the parameter index -> register
@@ -34,6 +36,8 @@ class ASM(Cursor):
         # register sizes for a64 (rn)
         self.fn_register_store: dict[int, ASMFunction] = {}
         self.inside_fn: int | None = None
+        # Values the register allocator had to keep on the stack.
+        self.spills = 0
         # # Format (ref_id, register)
         # self.ref_id_and_register: list[tuple[int, int]] = []
         # self.fn_register_man: dict[int, list[tuple[int, int]]] = {}
@@ -57,13 +61,7 @@ class ASM(Cursor):
             self.advance()
 
     def lookup_symbol(self, symbol_table: int, symbol_id: int) -> Symbol | None:
-        if symbol_table not in self.symbol_tables:
-            return None
-        _symbol_table: SymbolTable | None = self.symbol_tables[symbol_table]
-        if _symbol_table is None:
-            return None
-        symbol = _symbol_table.lookup_by_id(symbol_id)
-        return symbol
+        return self.symbol_tables.symbol(symbol_table, symbol_id)
 
     def generate(self, expr: AstirExpr | None = None) -> list[str]:
         c_expr = self.current() if expr is None else expr
@@ -72,61 +70,22 @@ class ASM(Cursor):
             to_add.extend(c_expr.lines)
         elif isinstance(c_expr, Assignment):
             if isinstance(c_expr.right, Lambda) and isinstance(c_expr.left, Identifier):
-                symbols = c_expr.right.definition.parameters.symbols
-                last_used_register = 0
-                lambda_param_to_register: dict[int, int] = {}
-                param_name_to_idx: dict[str, int] = {}
-                for symbol_idx in symbols:
-                    symbol = symbols[symbol_idx]
-                    if symbol.name == "ret":
-                        # We break instead of continue because "ret"
-                        # should always be the last item in the dict
-                        break
-                    lambda_param_to_register[symbol_idx] = last_used_register
-                    param_name_to_idx[symbol.name] = symbol_idx
-                    last_used_register += 1
-
-                asm_function = ASMFunction(lambda_param_to_register, param_name_to_idx)
-                self.fn_register_store[c_expr.right.symbol_id] = asm_function
+                self.fn_register_store[c_expr.right.symbol_id] = self.function_registers(
+                    c_expr.right
+                )
                 # This is so we can parse and get the correct arguments
                 self.inside_fn = c_expr.right.symbol_id
                 to_add.append(
                     f"{c_expr.left.value}: // Symbol ID: {c_expr.right.symbol_id}"
                 )
-                # to_add.append(f"// {asm_function.next_usable_reg}")
-                to_add.extend(self.generate(c_expr.right.body))
+                to_add.extend(self.generate_result(c_expr.right.body))
                 #to_add.append("ret")
                 self.inside_fn = None
-        elif isinstance(c_expr, ShuntingYardAlgorithmResults):
+        elif isinstance(c_expr, BinaryOperation):
             inside_fn = self.current_fn()
             if inside_fn is None:
-                raise Exception("Out of place sya...")
-            if len(c_expr.oeprators) > 0:
-                raise Exception("Invalid shunting yard algorithm")
-            stack: list[str] = []
-            c_expr.results.reverse()
-            while len(c_expr.results) > 0 and (term := c_expr.results.pop()):
-                # TODO: make some like class method or something
-                # to make this cleaner??
-                if isinstance(term, Reference):
-                    stack.extend(self.generate(term))
-                elif isinstance(term, Literal):
-                    if term.ty != PrimitiveTypes.INT:
-                        raise Exception("Unexpected type.")
-                    stack.append(str(term.val))
-                elif isinstance(term, str):
-                    if term == "+":
-                        stack.reverse()
-                        (item1, item2) = (stack.pop(), stack.pop())
-                        if not item1.startswith("x"):
-                            register = inside_fn.next_usable_reg
-                            to_add.append(f"mov x{register}, {item1}")
-                            item1 = f"x{register}"
-                            inside_fn.next_usable_reg += 1
-                        print(
-                            f"Adding last two items on stack: {item1}, {item2} = {item1 + item2}"
-                        )
-                        to_add.append(f"add x0, {item1}, {item2}")
+                raise Exception("Out of place binary operation...")
+            to_add.extend(self.generate_result(c_expr))
         elif isinstance(c_expr, Reference):
             symbol_in_ref: Symbol | None = self.lookup_symbol(
                 c_expr.belongs_to, c_expr.symbol_id
@@ -136,40 +95,129 @@ class ASM(Cursor):
             if (
                 (c_fn := self.current_fn())
                 and c_fn is not None
-                and c_expr.name in c_fn.name_to_param
-                and c_fn.name_to_param[c_expr.name] in c_fn.param_to_reg
+                and c_expr.name_id in c_fn.name_to_param
+                and c_fn.name_to_param[c_expr.name_id] in c_fn.param_to_reg
             ):
-                register = c_fn.param_to_reg[c_fn.name_to_param[c_expr.name]]
+                register = c_fn.param_to_reg[c_fn.name_to_param[c_expr.name_id]]
                 to_add.append(f"x{register}")
         elif isinstance(c_expr, Application):
-            fn_parameters = self.fn_register_store[c_expr.lambda_ref.symbol_id]
-            if fn_parameters is None:
-                raise Exception("Failed to get reserved registers for fn")
-            elif len(list(fn_parameters.param_to_reg.keys())) != len(c_expr.parameters):
+            application_symbol, fn_parameters = self.callee(c_expr.lambda_ref)
+            if len(list(fn_parameters.param_to_reg.keys())) != len(c_expr.parameters):
                 raise Exception("More parameters than reserved registers...")
-            application_symbol: Symbol | None = self.lookup_symbol(
-                c_expr.lambda_ref.belongs_to, c_expr.lambda_ref.symbol_id
-            )
-            if application_symbol is None:
-                raise Exception(f"failed to find symbol {c_expr.lambda_ref.symbol_id}")
-            elif (
-                not isinstance(application_symbol.val, Lambda)
-                or c_expr.lambda_ref.symbol_id not in self.fn_register_store
-            ):
-                raise Exception(
-                    "Expected this symbol to come back to a lambda definition"
-                )
 
-            function_parameters = application_symbol.val.definition.parameters.symbols
             for idx, param in enumerate(c_expr.parameters):
                 if not (0 <= idx < len(list(fn_parameters.param_to_reg.keys()))):
                     raise Exception(
                         "Invalid Application...More parameters than reserved registers"
                     )
                 reserved_register = fn_parameters.param_to_reg[idx]
-                if not isinstance(param, Literal) or param.ty != PrimitiveTypes.INT:
+                if (
+                    not isinstance(param, Literal)
+                    or not isinstance(param.ty, PrimitiveType)
+                    or param.ty.val not in IMMEDIATE_TYPES
+                ):
                     raise Exception("TODO: HANDLE MORE THAN JUST LITERALS")
-                to_add.append(f"mov x{reserved_register}, {param.val}")
+                to_add.extend(load_immediate(reserved_register, param.val))
             to_add.append(f"bl {application_symbol.name}")
 
         return to_add
+
+    # Code that computes a lambda's body and returns it in x0. Bodies
+    # that are an expression go through the register allocator (see
+    # regalloc.py), anything else is generated as is.
+    def generate_result(self, body: AstirExpr) -> list[str]:
+        fn = self.current_fn()
+        if fn is None or not isinstance(
+            body, (BinaryOperation, Literal, Reference, Application, Parenthesized)
+        ):
+            return self.generate(body)
+        code = Code()
+        # Parameter index -> its virtual register
+        params = {
+            idx: code.add("param", value=register)
+            for idx, register in fn.param_to_reg.items()
+        }
+        result = run_stacked(self.lower_rule(body, fn, code, params))
+        code.add("ret", [result], dest=False)
+        lines, allocation = regalloc.generate(str(self.inside_fn), code)
+        self.spills += allocation.spills
+        return lines
+
+    # The Symbol of the lambda `ref` points to and where its parameters go.
+    def callee(self, ref: Reference) -> tuple[Symbol, ASMFunction]:
+        symbol: Symbol | None = self.lookup_symbol(ref.belongs_to, ref.symbol_id)
+        if symbol is None:
+            raise Exception(f"failed to find symbol {ref.symbol_id}")
+        elif not isinstance(symbol.val, Lambda):
+            raise Exception("Expected this symbol to come back to a lambda definition")
+        fn_parameters = self.fn_register_store.get(ref.symbol_id)
+        if fn_parameters is None:
+            # Defined in another file (see build.py), its registers
+            # follow from its parameters all the same.
+            fn_parameters = self.function_registers(symbol.val)
+            self.fn_register_store[ref.symbol_id] = fn_parameters
+        return (symbol, fn_parameters)
+
+    # Adds the instructions for `expr` to `code`, giving back the virtual
+    # register its value ends up in.
+    def lower_rule(
+        self, expr: AstirExpr, fn: ASMFunction, code: Code, params: dict[int, int]
+    ) -> Rule[int]:
+        if isinstance(expr, Parenthesized) and expr.inner is not None:
+            return (yield self.lower_rule(expr.inner, fn, code, params))
+        elif (
+            isinstance(expr, Literal)
+            and isinstance(expr.ty, PrimitiveType)
+            and expr.ty.val in IMMEDIATE_TYPES
+        ):
+            return code.add("imm", value=expr.val)
+        elif isinstance(expr, Reference) and expr.name_id in fn.name_to_param:
+            return params[fn.name_to_param[expr.name_id]]
+        elif isinstance(expr, Reference) and expr.copy_val:
+            symbol, _ = self.callee(expr)
+            return code.add("call", [], value=symbol.name)
+        elif isinstance(expr, BinaryOperation):
+            instruction = ARITHMETIC_INSTRUCTIONS.get(expr.operator)
+            if instruction is None:
+                raise Exception(f'No instruction for operator "{expr.operator}"')
+            left = yield self.lower_rule(expr.left, fn, code, params)
+            right = expr.right
+            if (
+                isinstance(right, Literal)
+                and isinstance(right.ty, PrimitiveType)
+                and right.ty.val == PrimitiveTypes.INT
+                and 0 <= right.val <= MAX_IMMEDIATE
+            ):
+                return code.add(instruction, [left], value=right.val)
+            right_register = yield self.lower_rule(right, fn, code, params)
+            return code.add(instruction, [left, right_register])
+        elif isinstance(expr, Application):
+            symbol, fn_parameters = self.callee(expr.lambda_ref)
+            if len(fn_parameters.param_to_reg) != len(expr.parameters):
+                raise Exception(
+                    f"{symbol.name} takes {len(fn_parameters.param_to_reg)} arguments"
+                )
+            args: list[int] = []
+            for parameter in expr.parameters:
+                args.append((yield self.lower_rule(parameter, fn, code, params)))
+            return code.add("call", args, value=symbol.name)
+        elif isinstance(expr, Reference):
+            raise Exception(f'"{expr.name}" is not a parameter')
+        raise Exception(f"Unexpected operand {expr}")
+
+    # Parameters go in x0, x1, ... in the order they're declared.
+    def function_registers(self, fn: Lambda) -> ASMFunction:
+        symbols = fn.definition.parameters.symbols
+        last_used_register = 0
+        lambda_param_to_register: dict[int, int] = {}
+        param_name_to_idx: dict[int, int] = {}
+        for symbol_idx in symbols:
+            symbol = symbols[symbol_idx]
+            if symbol.name == "ret":
+                # We break instead of continue because "ret"
+                # should always be the last item in the dict
+                break
+            lambda_param_to_register[symbol_idx] = last_used_register
+            param_name_to_idx[symbol.name_id] = symbol_idx
+            last_used_register += 1
+        return ASMFunction(lambda_param_to_register, param_name_to_idx)
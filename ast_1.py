@@ -1,21 +1,44 @@
+import os
 from abc import ABC
 from ast import Expr
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+from pickle import HIGHEST_PROTOCOL, PicklingError, dumps
 from typing import Generic, Callable, TypeVar
 
-from common import SYMBOLS, TT, Cursor, PrimitiveTypes, bcolors, operators
+from common import (
+    CLOSING_BRACKETS,
+    OPENING_BRACKETS,
+    SYMBOLS,
+    TT,
+    Cursor,
+    Diagnostic,
+    PrimitiveTypes,
+    Rule,
+    bcolors,
+    default_fixity,
+    names,
+    operators,
+    run_nested,
+    run_stacked,
+)
+from lexer import SINGLE_CHAR_TOKENS, OperatorTrie, Token
+from numeric import parse_numeric
+import tracing
 from ast_exprs import (
     ADT,
     AstirExpr,
+    BinaryOperation,
     Dummy,
     InlineASM,
     LambdaDefinition,
-    ShuntingYardAlgorithmResults,
     Identifier,
     Literal,
     PrimitiveType,
     Reference,
     AstirTuple,
-    SymbolTable,
+    ScopeArena,
     Parameter,
     Symbol,
     Parenthesized,
@@ -26,30 +49,11 @@ from ast_exprs import (
     TypeClass,
     TypeInstance,
     check_is_allowed,
+    load_interned,
+    primitive_type,
 )
 
 
-class Token:
-    def __init__(self, ty: TT, prim_ty: PrimitiveTypes | None = None, val=None) -> None:
-        self.ty = ty
-        self.val = val
-        self.prim_ty = prim_ty
-
-    def __repr__(self) -> str:
-        return f"{self.ty} ({self.val})"
-
-
-def get_op(possible_op: Token | None) -> tuple[str, dict[str, int]] | None:
-    if (
-        possible_op is None
-        or possible_op.ty is None
-        or possible_op.ty not in [TT.PLUS, TT.DASH]
-    ):
-        return None
-    op = operators[possible_op.ty.value]
-    return (possible_op.ty.value, op)
-
-
 def is_valid_ident(c: str) -> bool:
     return c.isalnum() or c == "_"
 
@@ -58,6 +62,8 @@ class Lexer(Cursor):
     def __init__(self, input: str) -> None:
         super().__init__(list(input))
         self.results: list[Token] = []
+        self.operators = OperatorTrie()
+        self.operators.declare(input)
 
     def lex_all(self) -> None:
         while c := self.current():
@@ -103,6 +109,12 @@ class Lexer(Cursor):
         elif c == ":" and self.input[self.at + 1] == ":":
             self.advance()
             return Token(TT.DOUBLE_COLON)
+        elif (op := self.operators.longest_match(self.input, self.at)) and (
+            len(op) > 1 or op not in SINGLE_CHAR_TOKENS
+        ):
+            self.at += len(op) - 1
+            name_id = names.intern(op)
+            return Token(TT.OPERATOR, val=names[name_id], name_id=name_id)
         elif c == '"':
             self.advance()
             string = ""
@@ -134,99 +146,56 @@ class Lexer(Cursor):
 
             ident = self.collect_until(identifier_check, True, start_str=c)
 
-            if "." in ident:
-                try:
-                    number = float(ident)
-                    sign = 0 if number >= 0 else 1
-
-                    number = abs(number)
-                    integer = int(number)
-                    fractional = number - integer
-                    integer_bin = (
-                        bin(integer).replace("0b", "") if integer != 0 else "0"
-                    )
-
-                    frac_bin: list[str] = (
-                        []
-                    )  # List to store the fractional binary digits
-                    while (
-                        fractional and len(frac_bin) < 23 + 3
-                    ):  # Stop after 23+3 bits to avoid overflow
-                        fractional *= 2  # Multiply by 2 to shift digits left
-                        bit = int(fractional)  # Extract the integer part (0 or 1)
-                        frac_bin.append(str(bit))  # Append the bit to the list
-                        fractional -= (
-                            bit  # Remove the integer part from the fractional value
-                        )
-                    frac_bin2: str = "".join(frac_bin)
-                    combined_bin = integer_bin + "." + frac_bin2
-
-                    if (
-                        "1" in combined_bin
-                    ):  # Ensure there is at least one significant bit
-                        first_one = combined_bin.index(
-                            "1"
-                        )  # Find the position of the first '1'
-                        if "." in combined_bin and first_one > combined_bin.index("."):
-                            first_one -= (
-                                1  # Adjust for the position of the binary point
-                            )
-                        exponent = (
-                            len(integer_bin) - 1 - first_one
-                        )  # Calculate the exponent from normalization
-                        mantissa = (integer_bin + frac_bin2)[
-                            first_one + 1 : first_one + 24
-                        ]  # Extract mantissa bits
-                    else:  # Special case for zero-like numbers
-                        exponent = 0
-                        mantissa = "0" * 23  # Mantissa is all zeros
-
-                    # Step 4: Encode the exponent (add bias of 127)
-                    exponent += 127  # Apply the bias to the exponent
-                    exponent_bin = (
-                        bin(exponent).replace("0b", "").zfill(8)
-                    )  # Convert to 8-bit binary
-
-                    # Step 5: Pad the mantissa to 23 bits
-                    mantissa = mantissa.ljust(
-                        23, "0"
-                    )  # Ensure the mantissa has exactly 23 bits
-
-                    # Combine the components into a 32-bit IEEE 754 representation
-                    ieee754 = f"{sign}{exponent_bin}{mantissa}"
-                    return Token(TT.LITERAL, val=ieee754, prim_ty=PrimitiveTypes.FLOAT)
-                except ValueError:
-                    raise Exception(
-                        f'Something went wrong handling decimal: "{ident}"? check how many dots...'
-                    )
-            # TODO: TEMPORARY!!
-            elif ident.isdigit():
-                return Token(TT.LITERAL, val=int(ident), prim_ty=PrimitiveTypes.INT)
-            return Token(TT.IDENT, val=ident)
+            if (number := parse_numeric(ident)) is not None:
+                return Token(TT.LITERAL, val=number[1], prim_ty=number[0])
+            elif "." in ident:
+                raise Exception(
+                    f'Something went wrong handling decimal: "{ident}"? check how many dots...'
+                )
+            name_id = names.intern(ident)
+            return Token(TT.IDENT, val=names[name_id], name_id=name_id)
         else:
             return Token(TT(c))
         return Token(TT.DUMMY)
 
 
 class Parser(Cursor):
-    def __init__(self, input: list[Token]) -> None:
+    # By default the parse rules run on a heap allocated stack (see
+    # common.run_stacked) so nesting depth isn't limited by Python's
+    # recursion limit. explicit_stack=False runs them recursively, which
+    # costs the same but gives tracebacks through every enclosing rule.
+    # With recover=True a declaration that fails to parse is recorded in
+    # self.diagnostics and skipped instead of stopping the whole parse,
+    # `locate` maps a token index to its (line, col) for those.
+    def __init__(
+        self,
+        input: list[Token],
+        explicit_stack: bool = True,
+        recover: bool = False,
+        locate: Callable[[int], tuple[int, int]] | None = None,
+    ) -> None:
         super().__init__(input)
+        self.run = run_stacked if explicit_stack else run_nested
+        self.recover = recover
+        self.locate = locate
+        self.diagnostics: list[Diagnostic] = []
         self.results: list["AstirExpr"] = []
-        global_symbols: SymbolTable = SymbolTable(0)
+        self.symbol_tables = ScopeArena()
+        global_symbols = self.symbol_tables.new()
         # TODO: we are waiting for typedef!
-        global_symbols.insert("int", PrimitiveType(PrimitiveTypes.INT))
-        global_symbols.insert("unit", PrimitiveType(PrimitiveTypes.UNIT))
-        global_symbols.insert("str", PrimitiveType(PrimitiveTypes.STR))
-        global_symbols.insert("float", PrimitiveType(PrimitiveTypes.FLOAT))
+        global_symbols.insert("int", primitive_type(PrimitiveTypes.INT))
+        global_symbols.insert("unit", primitive_type(PrimitiveTypes.UNIT))
+        global_symbols.insert("str", primitive_type(PrimitiveTypes.STR))
+        global_symbols.insert("float", primitive_type(PrimitiveTypes.FLOAT))
         # global_symbols.insert(
         #     "IO", Type("IO", 0, 4, None, generics=[Identifier("wrapped_val")])
         # )
-        inline_assembly_lambda_def_symbol_table: SymbolTable = SymbolTable(1)
+        inline_assembly_lambda_def_symbol_table = self.symbol_tables.new(0)
         inline_assembly_lambda_def_symbol_table.insert(
-            "xs", PrimitiveType(PrimitiveTypes.LIST, size=None)
+            "xs", primitive_type(PrimitiveTypes.LIST)
         )
         inline_assembly_lambda_def_symbol_table.insert(
-            "ret", PrimitiveType(PrimitiveTypes.UNIT)
+            "ret", primitive_type(PrimitiveTypes.UNIT)
         )
 
         def assembly_handler(args: list[AstirExpr]) -> AstirExpr:
@@ -253,16 +222,17 @@ class Parser(Cursor):
             ),
         )
 
-        global_symbols.insert("IO", PrimitiveType(PrimitiveTypes.UNIT))
+        global_symbols.insert("IO", primitive_type(PrimitiveTypes.UNIT))
+        global_symbols.insert("float64", primitive_type(PrimitiveTypes.FLOAT64))
 
-        self.symbol_tables: dict[int, SymbolTable] = {0: global_symbols}
         self.using_st: int = 0
         self.parsing_lambda_parameters = False
-        self.op_stack: list[str] = []
-        # temp solution
-        self.current_number_of_advances = 0
+        # Operator -> fixity, the builtin operators plus any the
+        # program declares.
+        self.operators: dict[str, dict[str, int]] = {
+            op: dict(fixity) for op, fixity in operators.items()
+        }
         self.tag = 0
-        self.already_parsing_sya = False
 
     def resolve_type(self, ty: Expr) -> None:
         pass
@@ -274,59 +244,221 @@ class Parser(Cursor):
         elif advance:
             self.advance()
 
-    def advance(self) -> None:
-        self.current_number_of_advances += 1
-        return super().advance()
-
     def peek(self, amt: int = 1) -> Token | None:
-        if self.at + amt > len(self.input):
+        if self.at + amt >= len(self.input):
             return None
         return self.input[self.at + amt]
 
-    def lookup(self, name: str, symbol_table_id: int | None = None) -> Symbol | None:
+    # Whether the current token starts a new declaration (`name\ ...`
+    # or `name :: ...`), decided from the next two tokens alone.
+    def at_declaration(self) -> bool:
+        c = self.current()
+        next = self.peek()
+        return (
+            c is not None
+            and c.ty == TT.IDENT
+            and next is not None
+            and (next.ty == TT.BACKSLASH or next.ty == TT.DOUBLE_COLON)
+        )
+
+    def lookup(self, name_id: int, symbol_table_id: int | None = None) -> Symbol | None:
         symbol_table_id = self.using_st if symbol_table_id is None else symbol_table_id
-        if symbol_table_id is None or symbol_table_id not in self.symbol_tables:
+        return self.symbol_tables.lookup(name_id, symbol_table_id)
+
+    def declare_operator(
+        self, op: str, precedence: int, associativity: int = 0
+    ) -> None:
+        self.operators[op] = {
+            "precedence": precedence,
+            "associativity": associativity,
+        }
+
+    def get_op(self, token: Token | None) -> tuple[str, dict[str, int]] | None:
+        if token is None:
             return None
-        symbol_table = self.symbol_tables[symbol_table_id]
-        symbol = symbol_table.lookup(name)
-        if symbol is None and (symbol_table.parent is not None):
-            return self.lookup(name, symbol_table.parent)
-        return symbol
+        op = token.val if token.ty == TT.OPERATOR else token.ty.value
+        fixity = self.operators.get(op)
+        if fixity is None:
+            return None
+        return (op, fixity)
 
     def parse_all(self) -> None:
         while c := self.current():
             if c == None:
                 break
-            parsed = self.parse()
+            start = self.at
+            try:
+                parsed = self.parse()
+            except Exception as e:
+                if not self.recover:
+                    raise
+                self.report(str(e))
+                self.skip_declaration(start)
+                self.using_st = 0
+                continue
             if parsed is None:
                 break
             self.results.append(parsed)
-            self.current_number_of_advances = 0
             self.using_st = 0
 
-    def parse(self, tag=None) -> AstirExpr | None:
+    # Same result as parse_all, but the top level declarations are
+    # parsed in a process pool. Everything a declaration leaves behind
+    # for the ones after it (symbol table IDs, ADT names in the global
+    # table, declared operators) is worked out from the tokens up front,
+    # see predict_declarations, so every worker starts from the state
+    # the sequential parse would be in and IDs come out the same. If a
+    # group fails to parse or doesn't match that prediction, or the pool
+    # itself can't be used, the whole input is parsed again sequentially,
+    # which also reports errors the same way. Anything else going wrong
+    # in the pool is raised as is.
+    def parse_parallel(self, workers: int | None = None) -> None:
+        workers = workers or os.cpu_count() or 1
+        # Span tokens point into a mapped file and can't be sent over.
+        if workers == 1 or not isinstance(self.input, list):
+            return self.parse_all()
+        starts = split_declarations(self.input, self.at)
+        # About four groups of declarations per worker, so one long
+        # declaration doesn't leave the others idle.
+        size = max(1, (len(self.input) - self.at) // (workers * 4))
+        bounds: list[tuple[int, int]] = []
+        group_start = self.at
+        for start in starts[1:]:
+            if start - group_start >= size:
+                bounds.append((group_start, start))
+                group_start = start
+        bounds.append((group_start, len(self.input)))
+        if len(bounds) <= 1:
+            return self.parse_all()
+
+        groups: list[list[Token]] = []
+        table_starts: list[int] = []
+        adt_prefixes: list[list[str]] = []
+        operator_prefixes: list[list[str]] = []
+        predictions: list[tuple[list[int], list[str], list[str]]] = []
+        next_symbol_table = len(self.symbol_tables)
+        adts: list[str] = []
+        declared: list[str] = []
+        for start, end in bounds:
+            tokens = self.input[start:end]
+            table_count, new_adts, new_operators = predict_declarations(
+                tokens, self.operators.keys() | set(declared)
+            )
+            groups.append(tokens)
+            table_starts.append(next_symbol_table)
+            adt_prefixes.append(list(adts))
+            operator_prefixes.append(list(declared))
+            predictions.append(
+                (
+                    list(range(next_symbol_table, next_symbol_table + table_count)),
+                    new_adts,
+                    new_operators,
+                )
+            )
+            next_symbol_table += table_count
+            adts.extend(new_adts)
+            declared.extend(new_operators)
+
+        try:
+            with ProcessPoolExecutor(workers) as pool:
+                parsed = list(
+                    pool.map(
+                        parse_declarations,
+                        groups,
+                        repeat(self.run is run_stacked),
+                        table_starts,
+                        adt_prefixes,
+                        operator_prefixes,
+                    )
+                )
+        except (BrokenProcessPool, PicklingError, OSError) as e:
+            tracing.parse.info("Process pool failed, parsing sequentially", error=str(e))
+            return self.parse_all()
+        groups_parsed: list[tuple[list[str], list[str], bytes]] = []
+        for group, prediction in zip(parsed, predictions):
+            if group is None:
+                return self.parse_all()
+            ids, new_adts, new_operators, data = group
+            if (ids, new_adts, new_operators) != prediction:
+                return self.parse_all()
+            groups_parsed.append((new_adts, new_operators, data))
+
+        global_symbols = self.symbol_tables[0]
+        for new_adts, new_operators, data in groups_parsed:
+            # The workers each interned their own TypeInstances.
+            results, tables, tag = load_interned(data, self.symbol_tables)
+            self.results.extend(results)
+            for table in tables:
+                self.symbol_tables.add(table)
+            for name in new_adts:
+                global_symbols.insert(name, Dummy())
+            for op in new_operators:
+                self.operators[op] = dict(default_fixity)
+            self.tag += tag
+        self.at = len(self.input)
+        self.using_st = 0
+
+    def report(self, message: str) -> None:
+        line, col = self.locate(self.at) if self.locate is not None else (None, None)
+        self.diagnostics.append(Diagnostic(message, self.at, line, col))
+
+    # Moves past the declaration that starts at `start` to the beginning
+    # of the next top level one: a prime form, `name\` or `[op]\` that
+    # isn't nested inside brackets. `name ::` isn't used as a sync point
+    # since parameter types inside a lambda header look the same.
+    def skip_declaration(self, start: int) -> None:
+        depth = 0
+        self.at = start
+        while (c := self.current()) is not None:
+            if self.at > start and depth <= 0:
+                if c.ty == TT.PRIME_FORM:
+                    return
+                next = self.peek()
+                if c.ty == TT.IDENT and next is not None and next.ty == TT.BACKSLASH:
+                    return
+                after = self.peek(3)
+                if (
+                    c.ty == TT.OPEN_SQUARE
+                    and after is not None
+                    and after.ty == TT.BACKSLASH
+                    and self.input[self.at + 2].ty == TT.CLOSE_SQUARE
+                ):
+                    return
+            if c.ty in OPENING_BRACKETS:
+                depth += 1
+            elif c.ty in CLOSING_BRACKETS:
+                depth -= 1
+            self.advance()
+
+    def parse(self, tag=None, min_precedence: int = 0) -> AstirExpr | None:
+        return self.run(self.parse_rule(tag, min_precedence))
+
+    # With infix=False only the operand is parsed and any operator after
+    # it is left for the caller, which is how parse_infix reads the right
+    # side of one.
+    def parse_rule(
+        self, tag=None, min_precedence: int = 0, infix: bool = True
+    ) -> Rule[AstirExpr | None]:
         c = self.current()
         result: AstirExpr | None = None
         if c is None:
             return None
         elif c.ty == TT.OPEN_SQUARE:
             self.advance()
-            if (next := self.current()) and next is not None and next.ty in SYMBOLS:
-                collected_custom_op = [next]
-                custom_op: str = TT(next.ty).value
+            if (
+                (next := self.current())
+                and next.ty in SYMBOLS
+                and (close := self.peek()) is not None
+                and close.ty == TT.CLOSE_SQUARE
+            ):
+                # The lexer hands declared operators over as one token
                 self.advance()
-                while (
-                    (next := self.current())
-                    and next is not None
-                    and (next.ty in SYMBOLS or next.ty == TT.CLOSE_SQUARE)
-                ):
-                    if next.ty == TT.CLOSE_SQUARE:
-                        self.advance()
-                        break
-                    collected_custom_op.append(next)
-                    custom_op += TT(next.ty).value
-                    self.advance()
-                result = Identifier(custom_op)
+                self.advance()
+                if next.ty == TT.OPERATOR:
+                    result = Identifier(next.val, name_id=next.name_id)
+                else:
+                    result = Identifier(next.ty.value)
+                if result.value not in self.operators:
+                    self.operators[result.value] = dict(default_fixity)
             else:
                 collected: list[AstirExpr] = []
                 while True:
@@ -337,20 +469,19 @@ class Parser(Cursor):
                     elif current.ty == TT.COMMA:
                         self.advance()
                         continue
-                    parsed = self.parse()
+                    parsed = yield self.parse_rule()
                     if parsed is None:
-                        self.at -= 1
-                        break
+                        raise Exception("Unterminated list")
                     collected.append(parsed)
                 result = Literal(
-                    PrimitiveType(PrimitiveTypes.LIST, size=len(collected)), collected
+                    primitive_type(PrimitiveTypes.LIST, size=len(collected)), collected
                 )
         elif c.ty == TT.PRIME_FORM:
             if c.val == "d":
                 self.advance()
                 if (next := self.current()) and not next.ty == TT.IDENT:
                     raise Exception("Expected an identifier after prime form")
-                name = self.parse()
+                name = yield self.parse_rule()
                 if not isinstance(name, Identifier):
                     raise Exception(f"Expected identifier for the name {name} [{tag}]")
 
@@ -368,51 +499,40 @@ class Parser(Cursor):
                         # parsing = []
                         self.advance()
                         continue
-                    elif current.ty == TT.PRIME_FORM:
+                    elif current.ty == TT.PRIME_FORM or self.at_declaration():
                         break
 
-                    parsed = self.parse("23")
+                    parsed = yield self.parse_rule("23")
                     if (
-                        parsed is None
-                        or not isinstance(parsed, Literal)
+                        not isinstance(parsed, Literal)
                         and not isinstance(parsed, Reference)
                         and not isinstance(parsed, PrimitiveType)
-                        and (
-                            not isinstance(parsed, Identifier)
-                            or (
-                                isinstance(parsed, Identifier)
-                                and parsed.for_assignment == True
-                            )
-                        )
+                        and not isinstance(parsed, Identifier)
                     ):
-                        self.at -= 1
-                        break
+                        raise Exception(
+                            f"Unexpected value: {parsed} in data type definition"
+                        )
                     parsing.append(parsed)
                 symbol_table = self.symbol_tables[self.using_st]
                 new_symbol = symbol_table.insert(name.value, Dummy())
                 result = ADT(
-                    Reference(name.value, symbol_table.id, new_symbol.id, False),
+                    new_symbol.as_ref(),
                     name.value,
                     parsing,
                 )
                 self.tag += 1
             elif c.val == "t":
                 self.advance()
-                type_class_name = self.parse()
+                type_class_name = yield self.parse_rule()
                 if not isinstance(type_class_name, Identifier):
                     raise Exception("Expected an identifier after the type class.")
 
-                previous_symbol_table_id = self.using_st
-                symbol_table_id = list(self.symbol_tables.items())[-1][0] + 1
-                type_class_symbol_table = SymbolTable(
-                    symbol_table_id, previous_symbol_table_id
-                )
-                self.symbol_tables[symbol_table_id] = type_class_symbol_table
+                type_class_symbol_table = self.symbol_tables.new(self.using_st)
+                symbol_table_id = type_class_symbol_table.id
                 self.using_st = symbol_table_id
-                type_class_symbol_table = self.symbol_tables[symbol_table_id]
                 generic_list: list[AstirExpr] = []
                 while (next := self.current()) and next.ty != TT.CURLY_OPEN:
-                    generic = self.parse()
+                    generic = yield self.parse_rule()
                     if not isinstance(generic, Identifier):
                         raise Exception("Expected identifier")
 
@@ -423,31 +543,37 @@ class Parser(Cursor):
 
                 type_class_symbol_table.insert(
                     type_class_name.value,
-                    TypeClass(type_class_name.value, generic_list, SymbolTable(10000)),
+                    TypeClass(
+                        type_class_name.value,
+                        generic_list,
+                        self.symbol_tables.new(symbol_table_id),
+                    ),
                 )
                 type_class_symbol_table.usable_id += 1
-                print(
-                    f"Type class {type_class_name} with generic fields {self.symbol_tables[symbol_table_id]} (last:{self.current()})"
+                tracing.parse.debug(
+                    lambda: f"Type class {type_class_name} with generic fields {type_class_symbol_table} (last:{self.current()})",
+                    at=self.at,
                 )
                 self.expect(TT.CURLY_OPEN)
                 items = []
                 while (next := self.current()) and next.ty != TT.CURLY_CLOSE:
                     # TODO setup ST or smth so that the inside knows what generics/names it can/cannot use
-                    parsed = self.parse("GG")
+                    parsed = yield self.parse_rule("GG")
                     items.append(parsed)
-                print(
-                    f"Type class {type_class_name} (c=>{self.current()})\n\tItems: {items}"
+                tracing.parse.debug(
+                    lambda: f"Type class {type_class_name} (c=>{self.current()})\n\tItems: {items}",
+                    at=self.at,
                 )
                 result = Dummy()
         elif c.ty == TT.LITERAL:
             if c.prim_ty is None or c.val is None:
                 raise Exception("Invalid primitive type...how?")
             self.advance()
-            result = Literal(PrimitiveType(c.prim_ty), c.val)
+            result = Literal(primitive_type(c.prim_ty), c.val)
         elif c.ty == TT.IDENT:
-            if c.val is None:
+            if c.val is None or c.name_id is None:
                 raise Exception("Identifier with no value?")
-            symbol = self.lookup(c.val)
+            symbol = self.lookup(c.name_id)
             if symbol is not None:
                 self.advance()
                 if isinstance(symbol.val, TypeClass) or isinstance(symbol.val, Type):
@@ -457,12 +583,12 @@ class Parser(Cursor):
                         c = self.current()
                         if c is None:
                             break
-                        parsed = self.parse()
+                        parsed = yield self.parse_rule()
                         if parsed is None:
                             raise Exception(f"Failed to parse value: {c}")
                         filled_in_generics.append(parsed)
 
-                    result = TypeInstance(
+                    result = self.symbol_tables.type_instance(
                         symbol.name,
                         symbol.belongs_to,
                         symbol.id,
@@ -471,7 +597,7 @@ class Parser(Cursor):
                 else:
                     result = symbol.as_ref()
             else:
-                next = self.input[self.at + 1]
+                next = self.peek()
                 if (
                     next is not None
                     and next.ty is TT.IDENT
@@ -480,7 +606,7 @@ class Parser(Cursor):
                 ):
                     self.advance()
                     # sym_table = self.symbol_tables[self.using_st]
-                    expr = self.parse()
+                    expr = yield self.parse_rule()
                     if expr is not None and isinstance(expr, Reference):
                         # sym_table.insert(c.val, expr)
                         result = Parameter(c.val, val=expr)
@@ -495,7 +621,7 @@ class Parser(Cursor):
                         and (c2.ty == TT.BACKSLASH or c2.ty == TT.DOUBLE_COLON)
                     ):
                         for_assignment = True
-                    result = Identifier(c.val, for_assignment)
+                    result = Identifier(c.val, for_assignment, c.name_id)
 
         elif c.ty == TT.OPEN_PAREN:
             self.advance()
@@ -503,21 +629,19 @@ class Parser(Cursor):
             has_comma: bool = False
             while True:
                 c = self.current()
-                if c is not None:
-                    if c.ty == TT.CLOSE_PAREN:
-                        self.advance()
-                        break
-                    elif c.ty == TT.COMMA:
-                        self.advance()
-                        has_comma = True
-                        continue
-                    else:
-                        expr = self.parse()
-                        if expr is None:
-                            self.at -= 1
-                            break
-                        the_between.append(expr)
-            print(f"({self.current()} AFTER {the_between}")
+                if c is None:
+                    raise Exception("Unclosed parenthesis")
+                elif c.ty == TT.CLOSE_PAREN:
+                    self.advance()
+                    break
+                elif c.ty == TT.COMMA:
+                    self.advance()
+                    has_comma = True
+                    continue
+                expr = yield self.parse_rule()
+                if expr is None:
+                    raise Exception("Unclosed parenthesis")
+                the_between.append(expr)
             if len(the_between) == 0:
                 # We init Parenthesized with no expression so
                 # that it is treated as an empty tuple, non value
@@ -539,10 +663,8 @@ class Parser(Cursor):
             # then match arguments with arguments.
         elif c.ty == TT.BACKSLASH:
             self.advance()
-            previous_symbol_table_id = self.using_st
-            symbol_table_id = list(self.symbol_tables.items())[-1][0] + 1
-            lambda_symbol_table = SymbolTable(symbol_table_id, previous_symbol_table_id)
-            self.symbol_tables[symbol_table_id] = lambda_symbol_table
+            lambda_symbol_table = self.symbol_tables.new(self.using_st)
+            symbol_table_id = lambda_symbol_table.id
             self.using_st = symbol_table_id
             while True:
                 c = self.current()
@@ -552,32 +674,35 @@ class Parser(Cursor):
                         continue
                     elif c.ty == TT.DOUBLE_COLON:
                         self.advance()
-                        print(f"{self.current()}")
-                        ret_type = self.parse()
+                        if tracing.parse.level <= tracing.DEBUG:
+                            tracing.parse.debug(
+                                f"Return type {self.current()}", at=self.at
+                            )
+                        ret_type = yield self.parse_rule()
                         if ret_type is None:
                             raise Exception(
                                 f"Return type was not there or non identifier ({ret_type})"
                             )
-                        self.symbol_tables[symbol_table_id].insert("ret", ret_type)
+                        lambda_symbol_table.insert("ret", ret_type)
                         break
                     # self.advance()
-                expr = self.parse("32")
+                expr = yield self.parse_rule("32")
                 if (
                     isinstance(expr, Parameter)
                     and expr.name is not None
                     and isinstance(expr.val, AstirExpr)
                 ):
-                    self.symbol_tables[symbol_table_id].insert(expr.name, expr.val)
+                    lambda_symbol_table.insert(expr.name, expr.val)
                 elif isinstance(expr, TypeInstance) or isinstance(expr, Reference):
-                    self.symbol_tables[symbol_table_id].insert(
-                        f"{expr.name}{self.symbol_tables[symbol_table_id].usable_id}",
+                    lambda_symbol_table.insert(
+                        f"{expr.name}{lambda_symbol_table.usable_id}",
                         expr,
                     )
                 elif isinstance(expr, Parenthesized) and isinstance(
                     expr.inner, LambdaDefinition
                 ):
-                    self.symbol_tables[symbol_table_id].insert(
-                        f"lambda_def{self.symbol_tables[symbol_table_id].usable_id}",
+                    lambda_symbol_table.insert(
+                        f"lambda_def{lambda_symbol_table.usable_id}",
                         expr,
                     )
                 else:
@@ -586,7 +711,7 @@ class Parser(Cursor):
             # if body is None:
             #     raise Exception(f"Lambda must have body {self.current()}")
 
-            result = LambdaDefinition(self.symbol_tables[symbol_table_id])
+            result = LambdaDefinition(lambda_symbol_table)
             # popped = self.results.pop()
             # if not isinstance(popped, Identifier):
             #     return popped
@@ -613,11 +738,10 @@ class Parser(Cursor):
 
         if (
             isinstance(result, Reference)
-            and len(self.symbol_tables) > result.belongs_to >= 0
+            and result.belongs_to in self.symbol_tables
             # and c is not None
         ):
-            st = self.symbol_tables[result.belongs_to]
-            symbol = st.lookup_by_id(result.symbol_id)
+            symbol = self.symbol_tables.symbol(result.belongs_to, result.symbol_id)
             if symbol is None:
                 raise Exception(f"Unkown symbol reference: {result}")
             if isinstance(symbol.val, Lambda) or isinstance(
@@ -640,9 +764,10 @@ class Parser(Cursor):
                     return result
                 elif p_len > 1:
                     # NOW we have more arguments so we will want to parse more.
-                    self.current_number_of_advances = 0
-                    possible_args: list[AstirExpr] = []
-
+                    # How many is decided from the parameter types alone,
+                    # before any argument is parsed, so nothing ever has
+                    # to be rewound.
+                    argument_types: list[PrimitiveType] = []
                     for k, ref in parameters.symbols.items():
                         if ref.name == "ret":
                             continue
@@ -650,7 +775,7 @@ class Parser(Cursor):
                         type_symbol: PrimitiveType | None = None
                         if isinstance(ref.val, Reference):
                             type_symbol_symbol = self.lookup(
-                                ref.val.name, ref.val.belongs_to
+                                ref.val.name_id, ref.val.belongs_to
                             )
                             if type_symbol_symbol is None or not isinstance(
                                 type_symbol_symbol.val, PrimitiveType
@@ -662,12 +787,22 @@ class Parser(Cursor):
 
                         if type_symbol is None:
                             raise Exception("Could not find suitable type.")
+                        argument_types.append(type_symbol)
+                    if len(argument_types) == 0:
+                        return result
 
-                        possible_arg = self.parse()
+                    possible_args: list[AstirExpr] = []
+                    for type_symbol in argument_types:
+                        possible_arg = yield self.parse_rule()
                         if possible_arg is None:
                             raise Exception("Failed to parse")
-                        print(f"PARSED: {possible_arg}")
-                        if possible_arg.ty.val != type_symbol.ty:
+                        # Types are interned, so a match is usually the
+                        # same object. A sized type (a list literal) still
+                        # matches its unsized parameter type.
+                        if (
+                            possible_arg.ty is not type_symbol
+                            and possible_arg.ty.val is not type_symbol.val
+                        ):
                             raise Exception(
                                 f"{bcolors.FAIL}{bcolors.BOLD}Type mismatch{bcolors.ENDC}\n\t**Expected {type_symbol.ty}\n\t**Got {possible_arg.ty.val}"
                             )
@@ -680,11 +815,6 @@ class Parser(Cursor):
                                 f"Null type? 1. {possible_arg is None} 2. {possible_arg.ty is None} 3. {not isinstance(possible_arg.ty, Symbol)} {bcolors.OKCYAN}{bcolors.BOLD}({possible_arg.ty}){bcolors.ENDC}"
                             )
                         possible_args.append(possible_arg)
-                    if len(possible_args) == 0:
-                        print("no possible args")
-                        self.at = self.at - self.current_number_of_advances
-                        self.current_number_of_advances = 0
-                        return result
 
                     if (
                         isinstance(symbol.val, LambdaDefinition)
@@ -692,38 +822,147 @@ class Parser(Cursor):
                     ):
                         return symbol.val.special_callable(possible_args)
                     return Application(
-                        Reference(symbol.name, symbol.belongs_to, symbol.id, False),
+                        symbol.as_ref(),
                         possible_args,
                     )
-        possible_op = get_op(c)
-        if not check_is_allowed(result) or result is None or self.already_parsing_sya:
-            return result
-        if possible_op is None:
+        if not check_is_allowed(result) or not infix:
             return result
-
-        self.advance()
-        # NOW WE START! begin working with the shunting yard algorithm
-        # for parsing arithmetic
-        self.op_stack.append(possible_op[0])
-        self.already_parsing_sya = True
-        res: list[AstirExpr | str] = [result]
-        while True:
-            c = self.current()
-            possible_op = get_op(c)
-            if c is None:
-                break
-            elif possible_op is not None:
-                self.op_stack.append(possible_op[0])
-                self.advance()
-                continue
-
-            parsed = self.parse()
-            if not check_is_allowed(parsed) or parsed is None:
-                self.at -= 1
+        return (yield from self.parse_infix(result, min_precedence))
+
+    # Precedence climbing (Pratt parsing) over self.operators. Every
+    # operator binding at least as tight as min_precedence is folded
+    # into `left`. Operators still waiting for their right operand are
+    # kept on `pending` with their left one instead of in nested rules:
+    # each operand is parsed on its own, then every pending operator
+    # that binds tighter than the one after it (or as tight, unless
+    # it's right associative) gets it as its right operand. A chain of
+    # any length and associativity is one loop here and one rule per
+    # operand, and the whole expression is still built in one pass.
+    def parse_infix(self, left: AstirExpr, min_precedence: int) -> Rule[AstirExpr]:
+        # (operator, precedence, associativity, left operand)
+        pending: list[tuple[str, int, int, AstirExpr]] = []
+        possible_op = self.get_op(self.current())
+        while possible_op is not None:
+            op, fixity = possible_op
+            precedence = fixity["precedence"]
+            while len(pending) > 0 and (
+                pending[-1][1] > precedence
+                or (pending[-1][1] == precedence and pending[-1][2] != 1)
+            ):
+                pending_op, pending_precedence, associativity, pending_left = pending.pop()
+                if associativity == 2 and pending_precedence == precedence:
+                    raise Exception(
+                        f'Operator "{pending_op}" is not associative, "{op}" can\'t follow it'
+                    )
+                left = BinaryOperation(pending_op, pending_left, left)
+            if precedence < min_precedence:
                 break
-            res.append(parsed)
-        res.extend(self.op_stack)
-        self.op_stack = []
-        sya_res = ShuntingYardAlgorithmResults(self.op_stack, res)
-        self.already_parsing_sya = False
-        return sya_res  # type: ignore
+            self.advance()
+            pending.append((op, precedence, fixity["associativity"], left))
+            right = yield self.parse_rule(infix=False)
+            if right is None or not check_is_allowed(right):
+                raise Exception(f'Expected an operand after "{op}", got {right}')
+            left = right
+            possible_op = self.get_op(self.current())
+        while len(pending) > 0:
+            pending_op, _, _, pending_left = pending.pop()
+            left = BinaryOperation(pending_op, pending_left, left)
+        return left
+
+
+# Indices of the tokens that start a top level declaration: a prime
+# form or `name\` outside of any brackets, starting with `at`. A parse
+# rule never reads across one of these (everything that could stops
+# at them or fails), so the stream can be cut there and each piece
+# parsed on its own. `[op]\` isn't one, a data type definition takes
+# `[op]` as one of its values.
+def split_declarations(tokens: list[Token], at: int = 0) -> list[int]:
+    starts = [at]
+    depth = 0
+    for idx in range(at, len(tokens)):
+        ty = tokens[idx].ty
+        if idx > at and depth <= 0:
+            if ty == TT.PRIME_FORM or (
+                ty == TT.IDENT
+                and idx + 1 < len(tokens)
+                and tokens[idx + 1].ty == TT.BACKSLASH
+            ):
+                starts.append(idx)
+        if ty in OPENING_BRACKETS:
+            depth += 1
+        elif ty in CLOSING_BRACKETS:
+            depth -= 1
+    return starts
+
+
+# What parsing `tokens` will add to the parser's state, read off the
+# tokens alone: the number of symbol tables it creates (one per lambda,
+# two per type class), the names of the data types it puts in the global
+# table and the operators `[op]` declares that aren't in `operators`.
+def predict_declarations(
+    tokens: list[Token], operators: set[str]
+) -> tuple[int, list[str], list[str]]:
+    tables = 0
+    adts: list[str] = []
+    declared: list[str] = []
+    for idx, token in enumerate(tokens):
+        if token.ty == TT.BACKSLASH:
+            tables += 1
+        elif token.ty == TT.PRIME_FORM and token.val == "t":
+            # Its own scope and the one for its members
+            tables += 2
+        elif (
+            token.ty == TT.PRIME_FORM
+            and token.val == "d"
+            and idx + 1 < len(tokens)
+            and tokens[idx + 1].ty == TT.IDENT
+        ):
+            adts.append(tokens[idx + 1].val)
+        elif (
+            token.ty == TT.OPEN_SQUARE
+            and idx + 2 < len(tokens)
+            and tokens[idx + 1].ty in SYMBOLS
+            and tokens[idx + 2].ty == TT.CLOSE_SQUARE
+        ):
+            op_token = tokens[idx + 1]
+            op = op_token.val if op_token.ty == TT.OPERATOR else op_token.ty.value
+            if op not in operators and op not in declared:
+                declared.append(op)
+    return (tables, adts, declared)
+
+
+# Process pool worker for Parser.parse_parallel. Parses one group of
+# declarations starting from the state the sequential parse would be
+# in by then, and sends back what it added to it: the IDs of its symbol
+# tables, its data types and operators, and pickled, its results, those
+# tables and its tag, which the caller loads with load_interned. None
+# when the group doesn't parse, the caller parses everything again in
+# order so the error is reported where it is in the whole input.
+def parse_declarations(
+    tokens: list[Token],
+    explicit_stack: bool,
+    next_symbol_table: int,
+    adts: list[str],
+    declared: list[str],
+) -> tuple[list[int], list[str], list[str], bytes] | None:
+    parser = Parser(tokens, explicit_stack)
+    global_symbols = parser.symbol_tables[0]
+    for name in adts:
+        global_symbols.insert(name, Dummy())
+    for op in declared:
+        parser.operators[op] = dict(default_fixity)
+    parser.symbol_tables.skip_to(next_symbol_table)
+    global_count = global_symbols.usable_id
+    operator_count = len(parser.operators)
+    try:
+        parser.parse_all()
+    except Exception:
+        return None
+    tables = parser.symbol_tables.since(next_symbol_table)
+    new_adts = [
+        global_symbols.symbols[id].name
+        for id in range(global_count, global_symbols.usable_id)
+    ]
+    new_operators = list(parser.operators)[operator_count:]
+    data = dumps((parser.results, tables, parser.tag), HIGHEST_PROTOCOL)
+    return ([table.id for table in tables], new_adts, new_operators, data)
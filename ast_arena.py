@@ -0,0 +1,327 @@
+import pickle
+from array import array
+from typing import Any, Iterator
+
+from ast_exprs import (
+    ADT,
+    Application,
+    Assignment,
+    AstirExpr,
+    AstirTuple,
+    BinaryOperation,
+    Dummy,
+    Identifier,
+    InlineASM,
+    Lambda,
+    LambdaDefinition,
+    Literal,
+    Parameter,
+    Parenthesized,
+    PrimitiveType,
+    Reference,
+    ScopeArena,
+    TypeInstance,
+    primitive_type,
+)
+from common import PrimitiveTypes, Rule, run_stacked
+
+# Node classes an AstArena can hold, a node's kind is its index here.
+KINDS: list[type] = [
+    Dummy,
+    Identifier,
+    Reference,
+    Literal,
+    PrimitiveType,
+    BinaryOperation,
+    Application,
+    InlineASM,
+    ADT,
+    LambdaDefinition,
+    Lambda,
+    Parenthesized,
+    AstirTuple,
+    Assignment,
+    Parameter,
+    TypeInstance,
+]
+KIND = {cls: kind for kind, cls in enumerate(KINDS)}
+NO_NODE = -1
+
+
+# A whole program's AST as flat arrays instead of a tree of objects.
+# Node n has kind kinds[n], its first child at first_child[n] and its
+# next sibling at next_sibling[n] (NO_NODE when there is none), and the
+# fields that aren't nodes in payloads[payload[n]], where equal
+# payloads are only stored once. Nodes are added children first, so a
+# node's children always come before it.
+class AstArena:
+    def __init__(self, scopes: ScopeArena | None = None) -> None:
+        self.kinds = array("B")
+        self.first_child = array("q")
+        self.next_sibling = array("q")
+        self.payload = array("q")
+        self.payloads: list[Any] = []
+        self.payload_ids: dict[tuple[int, Any], int] = {}
+        self.roots: list[int] = []
+        # Lambdas only keep the ID of their symbol table, converting
+        # them back gets the table from here.
+        self.scopes = scopes
+
+    @classmethod
+    def from_exprs(
+        cls, exprs: list[AstirExpr], scopes: ScopeArena | None = None
+    ) -> "AstArena":
+        arena = cls(scopes)
+        for expr in exprs:
+            arena.roots.append(arena.add(expr))
+        return arena
+
+    def to_exprs(self) -> list[AstirExpr]:
+        return [self.to_expr(root) for root in self.roots]
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def kind(self, node: int) -> type:
+        return KINDS[self.kinds[node]]
+
+    def get_payload(self, node: int) -> Any:
+        idx = self.payload[node]
+        return None if idx == NO_NODE else self.payloads[idx]
+
+    def children(self, node: int) -> Iterator[int]:
+        child = self.first_child[node]
+        while child != NO_NODE:
+            yield child
+            child = self.next_sibling[child]
+
+    # Every node below `root` (below every root when it's None), each
+    # before its children, together with its depth. Runs without
+    # recursion, so any depth of tree is fine.
+    def walk(self, root: int | None = None) -> Iterator[tuple[int, int]]:
+        stack = [(node, 0) for node in reversed(self.roots if root is None else [root])]
+        first_child = self.first_child
+        next_sibling = self.next_sibling
+        while len(stack) > 0:
+            node, depth = stack.pop()
+            yield node, depth
+            at = len(stack)
+            child = first_child[node]
+            while child != NO_NODE:
+                stack.append((child, depth + 1))
+                child = next_sibling[child]
+            stack[at:] = stack[at:][::-1]
+
+    def node(self, kind: int, payload: Any, children: list[int]) -> int:
+        idx = len(self.kinds)
+        self.kinds.append(kind)
+        if payload is None:
+            self.payload.append(NO_NODE)
+        else:
+            key = (kind, payload)
+            payload_id = self.payload_ids.get(key)
+            if payload_id is None:
+                payload_id = self.payload_ids[key] = len(self.payloads)
+                self.payloads.append(payload)
+            self.payload.append(payload_id)
+        self.first_child.append(children[0] if len(children) > 0 else NO_NODE)
+        self.next_sibling.append(NO_NODE)
+        for previous, next in zip(children, children[1:]):
+            self.next_sibling[previous] = next
+        return idx
+
+    def add(self, expr: AstirExpr) -> int:
+        return run_stacked(self.add_rule(expr))
+
+    def add_rule(self, expr: AstirExpr) -> Rule[int]:
+        kind = KIND.get(type(expr))
+        if kind is None:
+            raise Exception(f"Can't store {type(expr).__name__} in an AstArena")
+        payload: Any = None
+        nodes: list[AstirExpr] = []
+        if isinstance(expr, Identifier):
+            payload = (expr.value, expr.for_assignment)
+        elif isinstance(expr, Reference):
+            payload = (expr.name, expr.belongs_to, expr.symbol_id, expr.copy_val)
+        elif isinstance(expr, Literal):
+            if expr.ty.val == PrimitiveTypes.LIST:
+                payload = (expr.ty.val, expr.ty.size)
+                nodes = expr.val
+            else:
+                payload = (expr.ty.val, expr.ty.size, expr.val)
+        elif isinstance(expr, PrimitiveType):
+            payload = (expr.val, expr.size)
+        elif isinstance(expr, BinaryOperation):
+            payload = expr.operator
+            nodes = [expr.left, expr.right]
+        elif isinstance(expr, Application):
+            nodes = [expr.lambda_ref, *expr.parameters]
+        elif isinstance(expr, InlineASM):
+            payload = tuple(expr.lines)
+        elif isinstance(expr, ADT):
+            payload = expr.name
+            nodes = [expr.ty, *expr.values]
+        elif isinstance(expr, LambdaDefinition):
+            if expr.special_callable is not None:
+                raise Exception("Builtin lambdas can't be stored in an AstArena")
+            payload = expr.parameters.id
+        elif isinstance(expr, Lambda):
+            payload = (expr.definition.parameters.id, expr.belongs_to, expr.symbol_id)
+            nodes = [expr.body]
+        elif isinstance(expr, Parenthesized):
+            # With something inside, the type is always that of the inside.
+            payload = expr.ty if expr.inner is None else None
+            nodes = [] if expr.inner is None else [expr.inner]
+        elif isinstance(expr, AstirTuple):
+            nodes = expr.values
+        elif isinstance(expr, Assignment):
+            nodes = [expr.left, expr.right]
+        elif isinstance(expr, Parameter):
+            payload = (expr.name, expr.generic)
+            val = expr.val[0] if isinstance(expr.val, tuple) else expr.val
+            nodes = [] if val is None else [val]
+        elif isinstance(expr, TypeInstance):
+            payload = (expr.name, expr.ty_belongs_to, expr.type_id)
+            nodes = expr.filled_in_generics
+        children: list[int] = []
+        for child in nodes:
+            children.append((yield self.add_rule(child)))
+        return self.node(kind, payload, children)
+
+    def to_expr(self, node: int) -> AstirExpr:
+        return run_stacked(self.expr_rule(node))
+
+    def expr_rule(self, node: int) -> Rule[AstirExpr]:
+        kind = KINDS[self.kinds[node]]
+        payload = self.get_payload(node)
+        nodes: list[AstirExpr] = []
+        for child in self.children(node):
+            nodes.append((yield self.expr_rule(child)))
+        if kind is Dummy:
+            return Dummy()
+        elif kind is Identifier:
+            return Identifier(payload[0], payload[1])
+        elif kind is Reference:
+            return Reference(*payload)
+        elif kind is Literal:
+            if payload[0] == PrimitiveTypes.LIST:
+                return Literal(primitive_type(payload[0], payload[1]), nodes)
+            return Literal(primitive_type(payload[0], payload[1]), payload[2])
+        elif kind is PrimitiveType:
+            return primitive_type(*payload)
+        elif kind is BinaryOperation:
+            return BinaryOperation(payload, nodes[0], nodes[1])
+        elif kind is Application:
+            return Application(nodes[0], nodes[1:])  # type: ignore
+        elif kind is InlineASM:
+            return InlineASM(list(payload))
+        elif kind is ADT:
+            return ADT(nodes[0], payload, nodes[1:])
+        elif kind is LambdaDefinition:
+            return LambdaDefinition(self.scope(payload))
+        elif kind is Lambda:
+            return Lambda(self.scope(payload[0]), nodes[0], payload[1], payload[2])
+        elif kind is Parenthesized:
+            if len(nodes) == 0:
+                return Parenthesized(payload)
+            return Parenthesized(nodes[0].ty, nodes[0])
+        elif kind is AstirTuple:
+            return AstirTuple(nodes)
+        elif kind is Assignment:
+            return Assignment(nodes[0], nodes[1])
+        elif kind is Parameter:
+            return Parameter(payload[0], nodes[0] if len(nodes) > 0 else None, payload[1])
+        elif kind is TypeInstance:
+            name, ty_belongs_to, type_id = payload
+            if self.scopes is None:
+                return TypeInstance(name, ty_belongs_to, type_id, nodes)
+            return self.scopes.type_instance(name, ty_belongs_to, type_id, nodes)
+        raise Exception(f"Unknown node kind {kind}")
+
+    def scope(self, id: int):
+        if self.scopes is None:
+            raise Exception("Converting lambdas back needs the ScopeArena they came from")
+        return self.scopes[id]
+
+    # The arrays go out as raw bytes, the payloads are pickled. Symbol
+    # tables aren't included, pass the same ScopeArena to from_bytes.
+    def to_bytes(self) -> bytes:
+        return pickle.dumps(
+            (
+                self.kinds,
+                self.first_child,
+                self.next_sibling,
+                self.payload,
+                self.payloads,
+                self.roots,
+            ),
+            pickle.HIGHEST_PROTOCOL,
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes, scopes: ScopeArena | None = None) -> "AstArena":
+        arena = cls(scopes)
+        (
+            arena.kinds,
+            arena.first_child,
+            arena.next_sibling,
+            arena.payload,
+            arena.payloads,
+            arena.roots,
+        ) = pickle.loads(data)
+        for node in range(len(arena.kinds)):
+            payload_id = arena.payload[node]
+            if payload_id != NO_NODE:
+                arena.payload_ids[(arena.kinds[node], arena.payloads[payload_id])] = payload_id
+        return arena
+
+
+# Calls visit_<kind>(node) for every node it's handed, for example
+# visit_BinaryOperation, and generic_visit, which visits the node's
+# children, for kinds it has no method for. Like ast.NodeVisitor, but
+# over arena indices and with the dispatch worked out once up front.
+# Also unlike it, generic_visit doesn't recurse: the children go on a
+# stack the outermost visit() works through, each node still before
+# its children and those in order, so any depth of tree is fine (see
+# AstArena.walk). That means they're visited after the method that
+# called generic_visit has returned, not while it runs.
+class ArenaVisitor:
+    def __init__(self, arena: AstArena) -> None:
+        self.arena = arena
+        self.dispatch = [
+            getattr(self, f"visit_{cls.__name__}", self.generic_visit) for cls in KINDS
+        ]
+        # Nodes generic_visit left to visit, None outside of visit().
+        self.pending: list[int] | None = None
+
+    def visit(self, node: int) -> Any:
+        return self.run(self.dispatch[self.arena.kinds[node]], node)
+
+    def generic_visit(self, node: int) -> None:
+        if self.pending is None:
+            return self.run(lambda node: ArenaVisitor.generic_visit(self, node), node)
+        at = len(self.pending)
+        self.pending.extend(self.arena.children(node))
+        self.pending[at:] = self.pending[at:][::-1]
+
+    # Calls `method` on `node`, then visits what it left on the stack.
+    # A visit_ method that visits a child itself gets a stack of its
+    # own, so that child's subtree is done by the time it returns.
+    def run(self, method, node: int) -> Any:
+        outer = self.pending
+        pending: list[int] = []
+        self.pending = pending
+        kinds = self.arena.kinds
+        dispatch = self.dispatch
+        try:
+            result = method(node)
+            while len(pending) > 0:
+                child = pending.pop()
+                dispatch[kinds[child]](child)
+        finally:
+            self.pending = outer
+        return result
+
+    def visit_all(self) -> None:
+        for root in self.arena.roots:
+            self.visit(root)
@@ -1,42 +1,66 @@
+import io
+import pickle
 from abc import ABC
-from common import TT, PrimitiveTypes, bcolors
-from typing import Any, Union, Callable
+from common import TT, PrimitiveTypes, bcolors, names
+from typing import Any, Union, Callable, Iterator
 
 
+# Nodes are made in the hundreds of thousands, so every class lists its
+# fields in __slots__ instead of carrying a __dict__.
 class AstirExpr(ABC):
+    __slots__ = ("ty",)
+
     def __init__(self, ty: Union["PrimitiveTypes", "AstirExpr"]):
         super().__init__()
         self.ty = ty
 
 
 class Reference(AstirExpr):
+    __slots__ = ("name_id", "name", "symbol_id", "belongs_to", "copy_val")
+
     def __init__(
         self,
         name: str,
         belongs_to: int,
         symbol_id: int,
         copy_val: bool = False,
+        name_id: int | None = None,
     ) -> None:
         super().__init__(PrimitiveTypes.UNIT)
-        self.name = name
+        self.name_id = names.intern(name) if name_id is None else name_id
+        self.name = names[self.name_id]
         self.symbol_id = symbol_id
         self.belongs_to = belongs_to
         self.copy_val = copy_val
 
+    # See lexer.Token.__getstate__, the name is re-interned on load.
+    # Going through the constructor is also quicker than setting each
+    # slot from a state dict.
+    def __reduce__(self):
+        return (Reference, (self.name, self.belongs_to, self.symbol_id, self.copy_val))
+
     def __repr__(self) -> str:
         return f"Ref(ST={self.belongs_to}, Ref={self.name}, ID={self.symbol_id})"
 
 
 class Symbol:
-    def __init__(self, name: str, val: AstirExpr, belongs_to: int, id: int) -> None:
+    __slots__ = ("name_id", "name", "val", "belongs_to", "id")
+
+    def __init__(self, name_id: int, val: AstirExpr, belongs_to: int, id: int) -> None:
         super().__init__()
-        self.name = name
+        self.name_id = name_id
+        self.name = names[name_id]
         self.val = val
         self.belongs_to = belongs_to
         self.id = id
 
     def as_ref(self) -> Reference:
-        return Reference(self.name, self.belongs_to, self.id, False)
+        return Reference(self.name, self.belongs_to, self.id, False, self.name_id)
+
+    def __setstate__(self, state: tuple[None, dict]) -> None:
+        for name, value in state[1].items():
+            setattr(self, name, value)
+        self.name_id = names.intern(self.name)
 
     def __repr__(self) -> str:
         return (
@@ -49,15 +73,18 @@ class Symbol:
 class SymbolTable:
     def __init__(self, id: int, parent: int | None = None) -> None:
         self.symbols: dict[int, Symbol] = {}
-        self.name_to_id: dict[str, int] = {}
+        # Keyed on interned name IDs, see common.Interner.
+        self.name_to_id: dict[int, int] = {}
         self.usable_id = 0
         self.id = id
         self.parent = parent
+        # ScopeArena.resolved when the table is in an arena.
+        self.resolved: dict[int, dict[int, Symbol | None]] | None = None
 
-    def lookup(self, name: str) -> Symbol | None:
-        if name not in self.name_to_id:
+    def lookup(self, name_id: int) -> Symbol | None:
+        if name_id not in self.name_to_id:
             return None
-        id = self.name_to_id[name]
+        id = self.name_to_id[name_id]
         return self.lookup_by_id(id)
 
     def lookup_by_id(self, id: int) -> Symbol | None:
@@ -66,18 +93,160 @@ class SymbolTable:
         return self.symbols[id]
 
     def insert(self, name: str, val: AstirExpr) -> Symbol:
-        symbol = Symbol(name, val, self.id, self.usable_id)
+        name_id = names.intern(name)
+        symbol = Symbol(name_id, val, self.id, self.usable_id)
         self.symbols[self.usable_id] = symbol
-        self.name_to_id[name] = self.usable_id
+        self.name_to_id[name_id] = self.usable_id
         self.usable_id += 1
+        if self.resolved is not None:
+            self.resolved.pop(name_id, None)
 
         return symbol
 
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["name_to_id"] = {names[k]: v for k, v in self.name_to_id.items()}
+        state["resolved"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.name_to_id = {names.intern(k): v for k, v in state["name_to_id"].items()}
+
     def __repr__(self) -> str:
         return f"{self.symbols}"
 
 
+# Every symbol table of a program, in a list indexed by its ID. IDs are
+# handed out in order, so creating a scope is an append and getting one
+# back is an index, and any symbol is reachable as (scope, symbol ID).
+class ScopeArena:
+    def __init__(self) -> None:
+        self.scopes: list[SymbolTable | None] = []
+        # name ID -> scope -> what lookup() found for it there. Inserting
+        # a name anywhere can change what it resolves to in every scope
+        # below, so SymbolTable.insert drops all of that name's entries.
+        self.resolved: dict[int, dict[int, Symbol | None]] = {}
+        self.hits = 0
+        self.misses = 0
+        # The interned TypeInstances, see type_instance. Kept here rather
+        # than globally since the key names scopes and symbols by ID,
+        # which only mean something in this arena, and so they go away
+        # with the program they were made for.
+        self.type_instances: dict[tuple, "TypeInstance"] = {}
+
+    def new(self, parent: int | None = None) -> SymbolTable:
+        table = SymbolTable(len(self.scopes), parent)
+        table.resolved = self.resolved
+        self.scopes.append(table)
+        return table
+
+    # Puts a table that was built somewhere else (see
+    # ast_1.parse_declarations) into the slot its ID says it goes in.
+    def add(self, table: SymbolTable) -> None:
+        if table.id != len(self.scopes):
+            raise Exception(f"Scope {table.id} is out of order, expected {len(self.scopes)}")
+        for name_id in table.name_to_id:
+            self.resolved.pop(name_id, None)
+        table.resolved = self.resolved
+        self.scopes.append(table)
+
+    # Leaves the IDs up to `id` to be filled in by someone else, the
+    # next new() scope gets `id`.
+    def skip_to(self, id: int) -> None:
+        self.scopes.extend([None] * (id - len(self.scopes)))
+
+    def __getitem__(self, id: int) -> SymbolTable:
+        table = self.scopes[id]
+        if table is None:
+            raise Exception(f"Scope {id} is not in this arena")
+        return table
+
+    def __contains__(self, id: int) -> bool:
+        return 0 <= id < len(self.scopes) and self.scopes[id] is not None
+
+    def __len__(self) -> int:
+        return len(self.scopes)
+
+    def __iter__(self) -> Iterator[SymbolTable]:
+        return (table for table in self.scopes if table is not None)
+
+    # The tables from ID `id` on, in order, without the slots skip_to
+    # left for someone else.
+    def since(self, id: int) -> list[SymbolTable]:
+        return [table for table in self.scopes[id:] if table is not None]
+
+    # Finds `name_id` in `scope` or the closest scope around it. The
+    # answer is cached for every scope the walk passed through, and the
+    # walk stops at the first scope that already has one, so each
+    # (scope, name) pair is only resolved once until the name is
+    # inserted somewhere again.
+    def lookup(self, name_id: int, scope: int | None) -> Symbol | None:
+        resolved = self.resolved.get(name_id)
+        if resolved is None:
+            resolved = self.resolved[name_id] = {}
+        elif scope in resolved:
+            self.hits += 1
+            return resolved[scope]
+        self.misses += 1
+        scopes = self.scopes
+        walked: list[int] = []
+        symbol: Symbol | None = None
+        while scope is not None and 0 <= scope < len(scopes):
+            if scope in resolved:
+                symbol = resolved[scope]
+                break
+            table = scopes[scope]
+            if table is None:
+                break
+            walked.append(scope)
+            if name_id in table.name_to_id:
+                symbol = table.symbols[table.name_to_id[name_id]]
+                break
+            scope = table.parent
+        for scope in walked:
+            resolved[scope] = symbol
+        return symbol
+
+    # The one TypeInstance of the type `type_id` in scope `ty_belongs_to`
+    # with these generics filled in. Made the first time it's asked for,
+    # the same object after that.
+    def type_instance(
+        self,
+        name: str,
+        ty_belongs_to: int,
+        type_id: int,
+        filled_in_generics: list[AstirExpr] = [],
+    ) -> "TypeInstance":
+        key: tuple = (name, ty_belongs_to, type_id)
+        for generic in filled_in_generics:
+            generic_id = generic_key(generic)
+            if generic_id is None:
+                return TypeInstance(name, ty_belongs_to, type_id, filled_in_generics)
+            key += (generic_id,)
+        interned = self.type_instances.get(key)
+        if interned is None:
+            interned = self.type_instances[key] = TypeInstance(
+                name, ty_belongs_to, type_id, filled_in_generics
+            )
+        return interned
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def symbol(self, scope: int, id: int) -> Symbol | None:
+        if scope not in self:
+            return None
+        return self.scopes[scope].lookup_by_id(id)  # type: ignore
+
+    def __repr__(self) -> str:
+        return f"{dict(enumerate(self.scopes))}"
+
+
 class Parameter(AstirExpr):
+    __slots__ = ("name", "val", "generic")
+
     def __init__(self, name: str | None = None, val: AstirExpr | None = None, generic: bool = False):
         super().__init__(PrimitiveTypes.UNIT)
         self.name = name
@@ -89,6 +258,8 @@ class Parameter(AstirExpr):
 
 
 class TypeClass(AstirExpr):
+    __slots__ = ("members", "name", "generics")
+
     def __init__(self, name: str, generics: list[AstirExpr], members: SymbolTable):
         super().__init__(self)
         self.members: SymbolTable = members
@@ -97,6 +268,8 @@ class TypeClass(AstirExpr):
 
 
 class Type(AstirExpr):
+    __slots__ = ("name", "operators", "generics", "belongs_to", "id")
+
     def __init__(
         self,
         name: str,
@@ -115,6 +288,8 @@ class Type(AstirExpr):
 
 
 class TypeInstance(AstirExpr):
+    __slots__ = ("name", "ty_belongs_to", "type_id", "filled_in_generics")
+
     def __init__(
         self,
         name: str,
@@ -128,12 +303,48 @@ class TypeInstance(AstirExpr):
         self.type_id = type_id
         self.filled_in_generics = filled_in_generics
 
+    # Unpickles through intern_type_instance, see load_interned.
+    def __reduce__(self):
+        return (
+            intern_type_instance,
+            (self.name, self.ty_belongs_to, self.type_id, self.filled_in_generics),
+        )
+
     def __repr__(self):
         return f"TypeInstance(NAME={self.name}, FILLED_IN_GENERICS={self.filled_in_generics})"
 
 
+# What a pickled TypeInstance is made with. Plain pickle makes a new
+# one, load_interned the one its ScopeArena has for those fields.
+def intern_type_instance(
+    name: str, ty_belongs_to: int, type_id: int, filled_in_generics: list[AstirExpr]
+) -> TypeInstance:
+    return TypeInstance(name, ty_belongs_to, type_id, filled_in_generics)
+
+
+class InterningUnpickler(pickle.Unpickler):
+    def __init__(self, file, scopes: ScopeArena) -> None:
+        super().__init__(file)
+        self.scopes = scopes
+
+    def find_class(self, module: str, name: str) -> Any:
+        if module == __name__ and name == "intern_type_instance":
+            return self.scopes.type_instance
+        return super().find_class(module, name)
+
+
+# Unpickles parser output made for `scopes` somewhere else, a cache
+# entry or a worker process, with every TypeInstance in it interned in
+# `scopes` like one its own parser made. Generics are loaded before the
+# instances using them, so those are interned first.
+def load_interned(data, scopes: ScopeArena) -> Any:
+    return InterningUnpickler(io.BytesIO(data), scopes).load()
+
+
 # Algebraic Data Type
 class ADT(AstirExpr):
+    __slots__ = ("name", "values")
+
     def __init__(self, ty, name: str, values: list[AstirExpr]):
         super().__init__(ty)
         self.name = name
@@ -146,6 +357,8 @@ class ADT(AstirExpr):
 
 
 class Dummy(AstirExpr):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(PrimitiveTypes.UNIT)
 
@@ -166,6 +379,8 @@ def check_is_allowed(AstirExpr: AstirExpr | None) -> bool:
 
 
 class LambdaDefinition(AstirExpr):
+    __slots__ = ("parameters", "special_callable")
+
     def __init__(
         self,
         parameters: SymbolTable,  # | list[PrimitiveTypes | AstirExpr]
@@ -193,6 +408,8 @@ class LambdaDefinition(AstirExpr):
 
 
 class InlineASM(AstirExpr):
+    __slots__ = ("lines",)
+
     def __init__(self, lines: list[str]):
         super().__init__(PrimitiveTypes.UNIT)
         self.lines = lines
@@ -202,6 +419,8 @@ class InlineASM(AstirExpr):
 
 
 class Lambda(AstirExpr):
+    __slots__ = ("definition", "belongs_to", "body", "symbol_id")
+
     def __init__(
         self, parameters: SymbolTable, body: AstirExpr, belongs_to: int, symbol_id: int
     ):
@@ -217,6 +436,8 @@ class Lambda(AstirExpr):
 
 
 class Parenthesized(AstirExpr):
+    __slots__ = ("inner",)
+
     def __init__(
         self, ty: AstirExpr | PrimitiveTypes, inner: AstirExpr | None = None
     ) -> None:
@@ -227,27 +448,42 @@ class Parenthesized(AstirExpr):
         return f"Parenthesized({self.inner})"
 
 
-class ShuntingYardAlgorithmResults(AstirExpr):
-    def __init__(self, operators: list[str], results: list[AstirExpr | str]) -> None:
-        super().__init__(PrimitiveTypes.UNIT)
-        self.oeprators = operators
-        self.results = results
+class BinaryOperation(AstirExpr):
+    __slots__ = ("operator", "left", "right")
+
+    def __init__(self, operator: str, left: AstirExpr, right: AstirExpr) -> None:
+        # Operators don't change the type of what they work on (yet),
+        # so the result has the type of the left operand.
+        super().__init__(left.ty)
+        self.operator = operator
+        self.left = left
+        self.right = right
 
     def __repr__(self) -> str:
-        return f"ShuntingYardAlgorithmResults({self.results}, ops={self.oeprators})"
+        return f"BinaryOperation({self.left} {self.operator} {self.right})"
 
 
 class Identifier(AstirExpr):
-    def __init__(self, value: str, for_assignment: bool = False) -> None:
+    __slots__ = ("name_id", "value", "for_assignment")
+
+    def __init__(
+        self, value: str, for_assignment: bool = False, name_id: int | None = None
+    ) -> None:
         super().__init__(PrimitiveTypes.UNIT)
-        self.value = value
+        self.name_id = names.intern(value) if name_id is None else name_id
+        self.value = names[self.name_id]
         self.for_assignment = for_assignment
 
+    def __reduce__(self):
+        return (Identifier, (self.value, self.for_assignment))
+
     def __repr__(self) -> str:
         return f"Ident({self.value})"
 
 
 class AstirTuple(AstirExpr):
+    __slots__ = ("values",)
+
     def __init__(self, values: list[AstirExpr]) -> None:
         super().__init__(PrimitiveTypes.UNIT)
         self.values = values
@@ -257,6 +493,8 @@ class AstirTuple(AstirExpr):
 
 
 class Assignment(AstirExpr):
+    __slots__ = ("left", "right")
+
     def __init__(self, left: AstirExpr, right: AstirExpr) -> None:
         super().__init__(PrimitiveTypes.UNIT)
         self.left = left
@@ -267,16 +505,54 @@ class Assignment(AstirExpr):
 
 
 class PrimitiveType(AstirExpr):
+    __slots__ = ("val", "size")
+
     def __init__(self, inner: PrimitiveTypes, size: int | None = None) -> None:
         super().__init__(inner)
         self.val = inner
         self.size = size
 
+    # Unpickles to the interned instance, see primitive_type.
+    def __reduce__(self):
+        return (primitive_type, (self.val, self.size))
+
     def __repr__(self) -> str:
         return f"PrimitiveType(I={self.val}, SIZE={self.size})"
 
 
+# Types are never changed once made, so each structurally different one
+# is only made once and every node of that type shares it. Two interned
+# types are then the same type exactly when they're the same object.
+PRIMITIVE_TYPES = {ty: PrimitiveType(ty) for ty in PrimitiveTypes}
+SIZED_PRIMITIVE_TYPES: dict[tuple[PrimitiveTypes, int], PrimitiveType] = {}
+
+
+def primitive_type(ty: PrimitiveTypes, size: int | None = None) -> PrimitiveType:
+    if size is None:
+        return PRIMITIVE_TYPES[ty]
+    interned = SIZED_PRIMITIVE_TYPES.get((ty, size))
+    if interned is None:
+        interned = SIZED_PRIMITIVE_TYPES[(ty, size)] = PrimitiveType(ty, size)
+    return interned
+
+
+# What makes a generic argument the same as another one, None when it
+# can't be told apart by its fields (a lambda type, say) and the
+# instance using it isn't interned.
+def generic_key(generic: AstirExpr) -> Any:
+    if isinstance(generic, (TypeInstance, PrimitiveType)):
+        # Interned already, the object is the key.
+        return generic
+    elif isinstance(generic, Reference):
+        return (Reference, generic.belongs_to, generic.symbol_id, generic.copy_val)
+    elif isinstance(generic, Identifier):
+        return (Identifier, generic.name_id, generic.for_assignment)
+    return None
+
+
 class Literal(AstirExpr):
+    __slots__ = ("val",)
+
     def __init__(self, literal_ty: PrimitiveType, val: Any) -> None:
         super().__init__(literal_ty)
         self.val = val
@@ -298,6 +574,8 @@ d'Option :: Some(int) | None
 
 
 class Application(AstirExpr):
+    __slots__ = ("lambda_ref", "parameters")
+
     def __init__(self, lambda_ref: Reference, parameters: list[AstirExpr]):
         super().__init__(PrimitiveTypes.UNIT)
         self.lambda_ref = lambda_ref
@@ -0,0 +1,77 @@
+# Deeply nested input through ast_1.Parser and v2's mkast.Parser, with
+# parse rules on the explicit stack (run_stacked, the default) and
+# recursive (run_nested). Recursive parsing stops at Python's recursion
+# limit, the explicit stack should stay linear in time and memory.
+# Run from the repository root:
+#
+#     python -m benchmarks.deep_nesting [depth ...]
+import os
+import sys
+import time
+import tracemalloc
+
+from ast_1 import Parser
+from lexer import TableLexer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "v2"))
+import lex as v2_lex  # noqa: E402
+import mkast  # noqa: E402
+
+
+def lambda_type(n: int) -> str:
+    return "\\ (" * n + "\\ :: int" + ") :: int" * n + "\n"
+
+
+# name -> (whether it's v2's parser, the source for depth n)
+CASES = {
+    "parens": (False, lambda n: "(" * n + "1" + ")" * n + "\n"),
+    "lists": (False, lambda n: "[" * n + "1" + "]" * n + "\n"),
+    "operands": (False, lambda n: "1 + (" * n + "1" + ")" * n + "\n"),
+    "lambda types": (False, lambda_type),
+    "v2 parens": (True, lambda n: "(" * n + "a" + ")" * n + "\n"),
+}
+
+
+def make_parser(v2: bool, source: str, explicit_stack: bool):
+    if v2:
+        v2_lexer = v2_lex.TableLexer(source)
+        v2_lexer.lex_all()
+        return mkast.Parser(v2_lexer.results, explicit_stack=explicit_stack)
+    lexer = TableLexer(source)
+    lexer.lex_all()
+    return Parser(lexer.results, explicit_stack=explicit_stack)
+
+
+# Time parsing took and its peak memory, measured in a second run since
+# tracemalloc slows everything down, or the error it stopped with.
+def measure(v2: bool, source: str, explicit_stack: bool) -> str:
+    parser = make_parser(v2, source, explicit_stack)
+    start = time.perf_counter()
+    try:
+        parser.parse_all()
+    except RecursionError:
+        return "RecursionError"
+    elapsed = time.perf_counter() - start
+    parser = make_parser(v2, source, explicit_stack)
+    tracemalloc.start()
+    parser.parse_all()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return f"{elapsed * 1e3:.0f}ms {peak / 1e6:.1f}MB"
+
+
+def main() -> None:
+    depths = [int(arg) for arg in sys.argv[1:]] or [100, 10000, 100000]
+    print("depth: recursive / explicit stack")
+    for name, (v2, generate) in CASES.items():
+        row = []
+        for n in depths:
+            source = generate(n)
+            row.append(
+                f"n={n}: {measure(v2, source, False)} / {measure(v2, source, True)}"
+            )
+        print(f"{name:13}", " | ".join(row))
+
+
+if __name__ == "__main__":
+    main()
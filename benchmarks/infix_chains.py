@@ -0,0 +1,71 @@
+# Parser time on long chains of infix operators: left associative `+`,
+# a right associative operator, and the two mixed at different
+# precedences. Run from the repository root:
+#
+#     python -m benchmarks.infix_chains [operands ...]
+import sys
+import time
+
+from ast_1 import Parser
+from ast_exprs import BinaryOperation
+from lexer import TableLexer
+
+# `[<*>]\ :: int` declares the operator, declare_operator below makes it
+# right associative and tighter than `+`.
+DECLARATION = "[<*>]\\ :: int\n"
+
+
+def left_chain(n: int) -> str:
+    return " + ".join(str(i % 7) for i in range(n)) + "\n"
+
+
+def right_chain(n: int) -> str:
+    return DECLARATION + " <*> ".join(str(i % 7) for i in range(n)) + "\n"
+
+
+def mixed_chain(n: int) -> str:
+    ops = [" + ", " <*> ", " - ", " <*> "]
+    text = "".join(str(i % 7) + ops[i % 4] for i in range(n - 1)) + "1"
+    return DECLARATION + text + "\n"
+
+
+def parse(tokens: list) -> Parser:
+    parser = Parser(tokens)
+    parser.declare_operator("<*>", 2, 1)
+    parser.parse_all()
+    return parser
+
+
+def operators_in(expr) -> int:
+    count = 0
+    stack = [expr]
+    while len(stack) > 0:
+        current = stack.pop()
+        if isinstance(current, BinaryOperation):
+            count += 1
+            stack.append(current.left)
+            stack.append(current.right)
+    return count
+
+
+def main() -> None:
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+    for name, generate in [
+        ("left +", left_chain),
+        ("right <*>", right_chain),
+        ("mixed", mixed_chain),
+    ]:
+        for n in sizes:
+            lexer = TableLexer(generate(n))
+            lexer.lex_all()
+            best = float("inf")
+            for _ in range(3):
+                start = time.perf_counter()
+                parser = parse(list(lexer.results))
+                best = min(best, time.perf_counter() - start)
+            assert operators_in(parser.results[-1]) == n - 1
+            print(f"{name:10} n={n:<6} {best * 1e3:8.1f}ms  {best / n * 1e6:5.2f}us per operand")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Memory held by a parsed program per AST node, measured with
+# tracemalloc on a large generated program, and bytes per instance for
+# the most common node classes. Nodes keep their fields in __slots__ and
+# literals share one PrimitiveType per type, see ast_exprs.py. Run from
+# the repository root:
+#
+#     python -m benchmarks.node_memory [declarations]
+import contextlib
+import gc
+import io
+import sys
+import tracemalloc
+
+import ast_exprs
+from ast_1 import Parser
+from common import PrimitiveTypes
+from lexer import TableLexer
+
+INSTANCES = 100000
+
+
+def generate(declarations: int) -> str:
+    return "".join(
+        f"d'P{i} :: int float str | Q{i} | R{i} int\n"
+        f"f{i}\\ P{i}, int, (\\ :: int) :: P{i}\n"
+        f'asm ["mov x0, #{i}", "ret"]\n'
+        f"{i} + 2 - 3 + {i}\n"
+        for i in range(declarations)
+    )
+
+
+# Bytes still allocated once `make` has returned, with only what it
+# returned kept alive.
+def retained(make):
+    gc.collect()
+    tracemalloc.start()
+    kept = make()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return kept, size
+
+
+def parse(tokens) -> Parser:
+    parser = Parser(tokens)
+    # Top level expressions are printed as they're parsed.
+    with contextlib.redirect_stdout(io.StringIO()):
+        parser.parse_all()
+    return parser
+
+
+# Every node and symbol reachable from the results and symbol tables,
+# each counted once.
+def count_nodes(parser: Parser) -> int:
+    seen: set[int] = set()
+    nodes = 0
+    stack: list = [parser.results, [table for table in parser.symbol_tables]]
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        if isinstance(value, (ast_exprs.AstirExpr, ast_exprs.Symbol)):
+            nodes += 1
+            for cls in type(value).__mro__:
+                for name in getattr(cls, "__slots__", ()):
+                    if hasattr(value, name):
+                        stack.append(getattr(value, name))
+        elif isinstance(value, ast_exprs.SymbolTable):
+            stack.append(value.symbols)
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+    return nodes
+
+
+def main() -> None:
+    declarations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    lexer = TableLexer(generate(declarations))
+    lexer.lex_all()
+    parser, size = retained(lambda: parse(lexer.results))
+    nodes = count_nodes(parser)
+    print(
+        f"{declarations} declarations: {nodes} nodes and symbols, "
+        f"{size / 1e6:.1f}MB retained, {size / nodes:.0f} bytes per node"
+    )
+
+    left, right = ast_exprs.Dummy(), ast_exprs.Dummy()
+    int_type = ast_exprs.primitive_type(PrimitiveTypes.INT)
+    classes = {
+        "Identifier": lambda i: ast_exprs.Identifier("x"),
+        "Reference": lambda i: ast_exprs.Reference("x", 0, 1),
+        "Literal": lambda i: ast_exprs.Literal(int_type, i),
+        "BinaryOperation": lambda i: ast_exprs.BinaryOperation("+", left, right),
+        "Symbol": lambda i: ast_exprs.Symbol(0, left, 0, i),
+    }
+    for name, make in classes.items():
+        # The ints Literal and Symbol keep are made up front, so only the
+        # nodes themselves are counted.
+        values = list(range(INSTANCES))
+        _, size = retained(lambda: [make(i) for i in values])
+        # Less the list holding them.
+        size -= sys.getsizeof([None] * INSTANCES)
+        print(f"{name:16} {size / INSTANCES:4.0f} bytes")
+
+    literals = [
+        ast_exprs.primitive_type(PrimitiveTypes.INT) for _ in range(INSTANCES)
+    ]
+    print(f"primitive_type   {len({id(ty) for ty in literals})} instance(s) for {INSTANCES} calls")
+
+
+if __name__ == "__main__":
+    main()
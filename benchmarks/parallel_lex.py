@@ -0,0 +1,68 @@
+# TableLexer.lex_parallel with 1 to N workers against lex_all, on a
+# generated source. Run from the repository root:
+#
+#     python -m benchmarks.parallel_lex [pieces] [max workers]
+#
+# The speedup is bounded by the cores there are, with one core this
+# only shows what the pool and the merge cost.
+import os
+import random
+import sys
+import time
+
+from lexer import PARALLEL_LEX_MIN_SIZE, TableLexer
+
+PIECES = ["foo", "x1", "d'", "::", "+", "12", '"s t r"', "// c\n", "\n"]
+
+
+def generate(pieces: int, seed: int = 11) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(PIECES) for _ in range(pieces))
+
+
+def timed(lex) -> tuple[float, list]:
+    start = time.perf_counter()
+    results = lex()
+    return (time.perf_counter() - start, results)
+
+
+def lex_all(source: str) -> list:
+    lexer = TableLexer(source)
+    lexer.lex_all()
+    return lexer.results
+
+
+def lex_parallel(source: str, workers: int | None) -> list:
+    lexer = TableLexer(source)
+    lexer.lex_parallel(workers)
+    return lexer.results
+
+
+def fields(tokens: list) -> list:
+    return [(token.ty, token.prim_ty, token.val) for token in tokens]
+
+
+def main() -> None:
+    pieces = int(sys.argv[1]) if len(sys.argv) > 1 else 1500000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else max(8, os.cpu_count() or 1)
+    source = generate(pieces)
+    print(
+        f"{len(source) >> 10} KiB of source, {os.cpu_count()} cores, "
+        f"lex_parallel() lexes sequentially below {PARALLEL_LEX_MIN_SIZE >> 10} KiB"
+    )
+    sequential, tokens = timed(lambda: lex_all(source))
+    expected = fields(tokens)
+    print(f"lex_all            {sequential:6.2f}s  {len(tokens)} tokens")
+    workers = 1
+    while workers <= max_workers:
+        elapsed, results = timed(lambda: lex_parallel(source, workers))
+        assert fields(results) == expected, f"{workers} workers lexed differently"
+        print(f"{workers:2} workers         {elapsed:6.2f}s  x{sequential / elapsed:.2f}")
+        workers *= 2
+    elapsed, results = timed(lambda: lex_parallel(source, None))
+    assert fields(results) == expected
+    print(f"lex_parallel()     {elapsed:6.2f}s  x{sequential / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# Parse time on the inputs that used to make the parser rewind and parse
+# tokens again: long runs of applications, long argument lists, lambda
+# headers, long parameter lists, data types with many variants and long
+# sums. Time per token should stay flat as n grows, tests/test_parser.py
+# checks the rule count does. Run from the repository root:
+#
+#     python -m benchmarks.parse_chains [n ...]
+import sys
+import time
+
+from ast_1 import Parser
+from lexer import TableLexer
+
+CHAINS = {
+    "applications": lambda n: 'asm ["mov x0, #1", "ret"]\n' * n,
+    "long arguments": lambda n: "asm [" + ", ".join(['"nop"'] * n) + "]\n",
+    "lambda headers": lambda n: "\\ :: int\n" * n,
+    "parameters": lambda n: "f\\ " + ", ".join(["int"] * n) + " :: int\n",
+    "variants": lambda n: "d'T :: " + " | ".join(f"V{i}" for i in range(n)) + "\n",
+    "operands": lambda n: " + ".join(["1"] * n) + "\n",
+}
+
+
+def best_parse_time(tokens: list, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        parser = Parser(list(tokens))
+        start = time.perf_counter()
+        parser.parse_all()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 4000, 16000, 64000]
+    for name, generate in CHAINS.items():
+        row = []
+        for n in sizes:
+            lexer = TableLexer(generate(n))
+            lexer.lex_all()
+            elapsed = best_parse_time(lexer.results)
+            row.append(f"n={n} {elapsed * 1e3:7.1f}ms {elapsed / len(lexer.results) * 1e6:4.1f}us/token")
+        print(f"{name:15}", " | ".join(row))
+
+
+if __name__ == "__main__":
+    main()
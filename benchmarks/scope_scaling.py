@@ -0,0 +1,68 @@
+# Scaling of the ScopeArena up to 100k scopes: lambda headers parsed end
+# to end (one scope each), allocating scopes straight from the arena,
+# and looking a name up from scopes nested under each other. Time per
+# scope should stay flat. Run from the repository root:
+#
+#     python -m benchmarks.scope_scaling [scopes ...]
+import sys
+import time
+
+from ast_1 import Parser
+from ast_exprs import Dummy, ScopeArena
+from common import names
+from lexer import TableLexer
+
+
+def parse_headers(n: int) -> float:
+    lexer = TableLexer("f\\ :: int\n" * n)
+    lexer.lex_all()
+    parser = Parser(lexer.results)
+    start = time.perf_counter()
+    parser.parse_all()
+    elapsed = time.perf_counter() - start
+    assert len(parser.symbol_tables) > n
+    return elapsed
+
+
+def allocate(n: int) -> float:
+    arena = ScopeArena()
+    root = arena.new()
+    start = time.perf_counter()
+    for _ in range(n):
+        arena.new(root.id)
+    return time.perf_counter() - start
+
+
+# Every scope nested in the one before it, then a name from the
+# outermost looked up once from each, innermost first. Each lookup only
+# walks up to the first scope it was already resolved in.
+def lookup_nested(n: int) -> float:
+    arena = ScopeArena()
+    root = arena.new()
+    root.insert("x", Dummy())
+    scope = root.id
+    for _ in range(n):
+        scope = arena.new(scope).id
+    name_id = names.intern("x")
+    start = time.perf_counter()
+    for id in range(scope, root.id - 1, -1):
+        assert arena.lookup(name_id, id) is not None
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    for name, measure in [
+        ("parse lambda headers", parse_headers),
+        ("allocate scopes", allocate),
+        ("lookup, nested scopes", lookup_nested),
+    ]:
+        row = []
+        for n in sizes:
+            elapsed = measure(n)
+            row.append(f"n={n} {elapsed * 1e3:7.1f}ms {elapsed / n * 1e9:5.0f}ns/scope")
+        print(f"{name:22}", " | ".join(row))
+
+
+if __name__ == "__main__":
+    main()
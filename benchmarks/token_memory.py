@@ -0,0 +1,64 @@
+# Memory held by a lexed token stream, a list[Token] against a
+# TokenBuffer, measured with tracemalloc. ast_1.Lexer makes a Token for
+# every token, TableLexer shares one per distinct text (and keeps no
+# offsets), the TokenBuffer keeps offsets too. Run from the repository
+# root:
+#
+#     python -m benchmarks.token_memory [tokens]
+import gc
+import random
+import sys
+import tracemalloc
+
+from lexer import TableLexer
+
+PIECES = [
+    "foo", "bar_baz", "x1", "d'", "::", "→", "+", "-", "(", ")", "[", "]",
+    "=", "|", "\\", ",", "12", "1.5", '"some \\"string"', "// comment here\n", "\n",
+]
+
+
+def generate(pieces: int, seed: int = 5) -> str:
+    rng = random.Random(seed)
+    return "".join(rng.choice(PIECES) + " " for _ in range(pieces))
+
+
+# Bytes still allocated once `make` has returned, with only what it
+# returned kept alive.
+def retained(make):
+    gc.collect()
+    tracemalloc.start()
+    kept = make()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return kept, size
+
+
+def lex_list(lexer_type, source: str):
+    lexer = lexer_type(source)
+    lexer.lex_all()
+    return lexer.results
+
+
+def main() -> None:
+    pieces = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    source = generate(pieces)
+    tokens, list_size = retained(lambda: lex_list(TableLexer, source))
+    buffer, buffer_size = retained(lambda: TableLexer(source).lex_compact())
+    assert [(t.ty, t.prim_ty, t.val) for t in tokens] == [
+        (t.ty, t.prim_ty, t.val) for t in buffer
+    ]
+    print(f"{len(tokens)} tokens")
+    # ast_1.Lexer only runs on Python 3.12, see tests/test_lexer.py.
+    if sys.version_info >= (3, 12):
+        from ast_1 import Lexer
+
+        _, old_size = retained(lambda: lex_list(Lexer, source))
+        print(f"list[Token], ast_1.Lexer  {old_size / len(tokens):6.1f} bytes per token")
+    print(f"list[Token], TableLexer   {list_size / len(tokens):6.1f} bytes per token")
+    print(f"TokenBuffer               {buffer_size / len(buffer):6.1f} bytes per token")
+
+
+if __name__ == "__main__":
+    main()
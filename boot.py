@@ -1,23 +1,96 @@
+import sys
+
 from asm import ASM
-from ast_1 import Parser, Lexer  # type: ignore
+from ast_1 import Parser  # type: ignore
+from cache import DEFAULT_DIRECTORY, ParseCache
+from fold import Folder
+from lexer import SourceBuffer, SpanLexer, TableLexer
+import tracing
 
 # from asm import ASM # type: ignore
 
 
-def run():
-    file = open("boot.dal").read()
-    lexer = Lexer(file)
-    lexer.lex_all()
-    print(f"{lexer.results}\n\n")
-    parser = Parser(lexer.results)
-    parser.parse_all()
+def run(
+    path: str = "boot.dal",
+    use_mmap: bool = False,
+    parallel: bool = False,
+    recover: bool = False,
+    cache_directory: str | None = DEFAULT_DIRECTORY,
+    fold: bool = True,
+):
+    if use_mmap:
+        # Tokens only hold offsets into the mapped file, so
+        # the source has to stay open until codegen is done.
+        source = SourceBuffer(path)
+        lexer: SpanLexer | TableLexer = SpanLexer(source)
+    else:
+        file = open(path).read()
+        lexer = TableLexer(file)
+    if parallel and isinstance(lexer, TableLexer):
+        lexer.lex_parallel()
+    else:
+        lexer.lex_all()
+    tracing.lex.info(lambda: f"{lexer.results}", tokens=len(lexer.results))
+    parser = Parser(lexer.results, recover=recover, locate=lexer.line_col)  # type: ignore
+    cache = None if cache_directory is None else ParseCache(cache_directory)
+    key = "" if cache is None else cache.key(lexer.results)
+    if cache is not None and cache.load(key, parser):
+        tracing.parse.info("Loaded from cache", key=key)
+    else:
+        if parallel:
+            parser.parse_parallel()
+        else:
+            parser.parse_all()
+        if cache is not None and len(parser.diagnostics) == 0:
+            cache.store(key, parser)
+    if len(parser.diagnostics) > 0:
+        for diagnostic in parser.diagnostics:
+            print(f"{path}:{diagnostic}")
+        if use_mmap:
+            source.close()
+        sys.exit(1)
 
-    print(f"{parser.results}\n\n")
-    code_generator = ASM(parser.results, parser.symbol_tables)
+    tracing.parse.info(lambda: f"{parser.results}", declarations=len(parser.results))
+    results = Folder().fold_all(parser.results) if fold else parser.results
+    code_generator = ASM(results, parser.symbol_tables)
     code_generator.generate_all()
-    print(f"{code_generator.lines}")
+    tracing.codegen.info(
+        lambda: f"{code_generator.lines}",
+        lines=len(code_generator.lines),
+        spills=code_generator.spills,
+    )
     open("boot.s", "w+").write("\n".join(code_generator.lines))
+    if use_mmap:
+        source.close()
+
+
+# Value of a `--name=value` argument, None when it wasn't passed.
+def option(name: str) -> str | None:
+    for arg in sys.argv:
+        if arg.startswith(name + "="):
+            return arg[len(name) + 1 :]
+    return None
 
 
 if __name__ == "__main__":
-    run()
+    # --trace=parse=debug,codegen turns on tracing (see tracing.configure),
+    # --trace-json=path writes it as JSON lines instead of to stderr.
+    # Parses are cached in .dalcache, --cache-dir=path puts them
+    # elsewhere and --no-cache turns that off. --no-fold skips constant
+    # folding (see fold.py).
+    trace = option("--trace")
+    trace_json = option("--trace-json")
+    if trace is not None or trace_json is not None:
+        tracing.configure(trace or "all=debug", trace_json)
+    run(
+        use_mmap="--mmap" in sys.argv,
+        parallel="--parallel" in sys.argv,
+        recover="--recover" in sys.argv,
+        cache_directory=(
+            None
+            if "--no-cache" in sys.argv
+            else option("--cache-dir") or DEFAULT_DIRECTORY
+        ),
+        fold="--no-fold" not in sys.argv,
+    )
+    tracing.close()
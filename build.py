@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from graphlib import CycleError, TopologicalSorter
+
+from asm import ASM
+from ast_1 import Parser, split_declarations
+from boot import option
+from cache import compiler_hash, token_hash
+from common import TT
+from fold import Folder
+from lexer import TableLexer
+import tracing
+
+# Builds a program that's split over several .dal files, one .s per
+# file. Dalia has no imports, so a file depends on every other file that
+# declares a name it uses but doesn't declare itself, worked out from
+# the tokens alone (see scan_file). Files are parsed and compiled in
+# that order on a process pool, a file as soon as everything it depends
+# on is done, with the globals it uses from them put in its global
+# table first. manifest.json in the output directory remembers what
+# each file looked like, so the next build only redoes the files that
+# changed, and the files that depend on them if what they declare came
+# out different.
+
+MANIFEST = "manifest.json"
+DEFAULT_OUTPUT = "build"
+
+
+# Hash of everything that decides what a build outputs besides the
+# files themselves, a different one rebuilds everything.
+def build_hash() -> str:
+    digest = hashlib.sha256(compiler_hash())
+    for name in ["fold.py", "asm.py", "regalloc.py"]:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+# The token hash of `path`, the top level names it declares, those of
+# them that are lambdas and the names it uses without declaring them.
+# Lambda parameters are counted as uses, so a parameter named like
+# another file's global makes this file depend on it.
+def scan_file(path: str) -> tuple[str, list[str], list[str], list[str]]:
+    lexer = TableLexer(open(path).read())
+    lexer.lex_all()
+    tokens = lexer.results
+    declared: list[str] = []
+    lambdas: list[str] = []
+    for start in split_declarations(tokens):
+        token = tokens[start] if start < len(tokens) else None
+        if token is None:
+            continue
+        if (
+            token.ty == TT.IDENT
+            and start + 1 < len(tokens)
+            and tokens[start + 1].ty == TT.BACKSLASH
+        ):
+            declared.append(token.val)
+            lambdas.append(token.val)
+        elif (
+            token.ty == TT.PRIME_FORM
+            and start + 1 < len(tokens)
+            and tokens[start + 1].ty == TT.IDENT
+        ):
+            declared.append(tokens[start + 1].val)
+    builtins = {symbol.name for symbol in Parser([]).symbol_tables[0].symbols.values()}
+    used: list[str] = []
+    seen = set(declared) | builtins
+    for token in tokens:
+        if token.ty == TT.IDENT and token.val not in seen:
+            seen.add(token.val)
+            used.append(token.val)
+    return (token_hash(tokens), declared, lambdas, used)
+
+
+# Process pool worker for Build. Parses and compiles one file, after
+# putting `imports` (name, value) in its global table, and writes
+# `output`. Sends back its diagnostics and the pickled (name, value) of
+# every global it declared.
+def build_file(
+    path: str,
+    output: str,
+    imports: list[bytes],
+    wanted: list[str],
+    exported: list[str],
+) -> tuple[list[str], bytes]:
+    lexer = TableLexer(open(path).read())
+    lexer.lex_all()
+    parser = Parser(lexer.results, recover=True, locate=lexer.line_col)
+    global_symbols = parser.symbol_tables[0]
+    for data in imports:
+        for name, val in pickle.loads(data):
+            if name in wanted:
+                global_symbols.insert(name, val)
+    first_own = global_symbols.usable_id
+    parser.parse_all()
+    diagnostics = [f"{path}:{diagnostic}" for diagnostic in parser.diagnostics]
+    if len(diagnostics) > 0:
+        return (diagnostics, b"")
+    own = [
+        (global_symbols.symbols[id].name, global_symbols.symbols[id].val)
+        for id in range(first_own, global_symbols.usable_id)
+    ]
+    code_generator = ASM(Folder().fold_all(parser.results), parser.symbol_tables)
+    code_generator.generate_all()
+    # Other files reach these with bl, so the linker has to see them.
+    lines = [f".global {name}" for name in exported] + code_generator.lines
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    open(output, "w+").write("\n".join(lines))
+    return ([], pickle.dumps(own, pickle.HIGHEST_PROTOCOL))
+
+
+class Build:
+    def __init__(
+        self, paths: list[str], output: str = DEFAULT_OUTPUT, workers: int | None = None
+    ) -> None:
+        self.paths = paths
+        self.output = output
+        self.workers = workers or os.cpu_count() or 1
+        self.diagnostics: list[str] = []
+        # Files the last run() built, and those of them whose globals
+        # came out different, which are the ones whose dependents have
+        # to be built again.
+        self.built: list[str] = []
+        self.changed: set[str] = set()
+
+    def output_path(self, path: str, extension: str = ".s") -> str:
+        name = os.path.splitext(os.path.relpath(path))[0].replace("..", "_")
+        return os.path.join(self.output, name + extension)
+
+    def load_manifest(self) -> dict:
+        try:
+            with open(os.path.join(self.output, MANIFEST)) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get("build") != build_hash():
+            return {}
+        return manifest.get("files", {})
+
+    def save_manifest(self, files: dict) -> None:
+        os.makedirs(self.output, exist_ok=True)
+        with open(os.path.join(self.output, MANIFEST), "w") as file:
+            json.dump({"build": build_hash(), "files": files}, file, indent=1)
+
+    def run(self) -> bool:
+        self.diagnostics = []
+        self.built = []
+        self.changed = set()
+        if self.workers == 1:
+            scans = list(map(scan_file, self.paths))
+        else:
+            with ProcessPoolExecutor(self.workers) as pool:
+                scans = list(pool.map(scan_file, self.paths))
+
+        declared_in: dict[str, str] = {}
+        for path, (_, declared, _, _) in zip(self.paths, scans):
+            for name in declared:
+                if name in declared_in and declared_in[name] != path:
+                    raise Exception(f'"{name}" is declared in both {declared_in[name]} and {path}')
+                declared_in[name] = path
+        lambdas = {name for _, _, names, _ in scans for name in names}
+        # path -> the names it uses from each file it depends on
+        uses: dict[str, dict[str, list[str]]] = {}
+        # path -> its lambdas other files call, data types have no symbol
+        exported: dict[str, list[str]] = {path: [] for path in self.paths}
+        for path, (_, _, _, used) in zip(self.paths, scans):
+            uses[path] = {}
+            for name in used:
+                if name in declared_in:
+                    uses[path].setdefault(declared_in[name], []).append(name)
+                    if name in lambdas:
+                        exported[declared_in[name]].append(name)
+
+        previous = self.load_manifest()
+        files: dict[str, dict] = {}
+        dirty: set[str] = set()
+        for path, (key, _, _, _) in zip(self.paths, scans):
+            exports = sorted(set(exported[path]))
+            files[path] = {"key": key, "uses": uses[path], "exports": exports}
+            entry = previous.get(path)
+            if (
+                entry is None
+                or entry["key"] != key
+                or entry["uses"] != uses[path]
+                or entry["exports"] != exports
+                or not os.path.exists(self.output_path(path))
+                or not os.path.exists(self.output_path(path, ".globals"))
+            ):
+                dirty.add(path)
+
+        sorter = TopologicalSorter({path: list(uses[path]) for path in self.paths})
+        try:
+            sorter.prepare()
+        except CycleError as e:
+            raise Exception(f"Files depend on each other: {' -> '.join(e.args[1])}")
+
+        built_globals: dict[str, bytes] = {}
+        pool = None if self.workers == 1 else ProcessPoolExecutor(self.workers)
+
+        def submit(path: str) -> Future | tuple[list[str], bytes]:
+            arguments = (
+                path,
+                self.output_path(path),
+                [self.globals_of(dependency, built_globals) for dependency in uses[path]],
+                [name for names in uses[path].values() for name in names],
+                files[path]["exports"],
+            )
+            if pool is None:
+                return build_file(*arguments)
+            return pool.submit(build_file, *arguments)
+
+        def finish(path: str, result: tuple[list[str], bytes]) -> None:
+            diagnostics, own = result
+            self.diagnostics.extend(diagnostics)
+            self.built.append(path)
+            if len(diagnostics) > 0:
+                files.pop(path)
+                return
+            built_globals[path] = own
+            globals_path = self.output_path(path, ".globals")
+            if not os.path.exists(globals_path) or open(globals_path, "rb").read() != own:
+                self.changed.add(path)
+                with open(globals_path, "wb") as file:
+                    file.write(own)
+            tracing.codegen.info(f"Built {path}", output=self.output_path(path))
+
+        try:
+            running: dict[Future, str] = {}
+            while sorter.is_active():
+                for path in sorter.get_ready():
+                    if any(dependency not in files for dependency in uses[path]):
+                        # A file it depends on failed.
+                        files.pop(path)
+                        sorter.done(path)
+                    elif path not in dirty and not any(
+                        dependency in self.changed for dependency in uses[path]
+                    ):
+                        sorter.done(path)
+                    elif pool is None:
+                        finish(path, submit(path))  # type: ignore
+                        sorter.done(path)
+                    else:
+                        running[submit(path)] = path  # type: ignore
+                if len(running) == 0:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = running.pop(future)
+                    finish(path, future.result())
+                    sorter.done(path)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.save_manifest(files)
+        return len(self.diagnostics) == 0
+
+    # The globals `path` declared, from this run or an earlier one.
+    def globals_of(self, path: str, built: dict[str, bytes]) -> bytes:
+        if path in built:
+            return built[path]
+        with open(self.output_path(path, ".globals"), "rb") as file:
+            return file.read()
+
+
+if __name__ == "__main__":
+    # python build.py a.dal b.dal ... [--out=build] [--workers=N]
+    # --trace and --trace-json work like they do for boot.py.
+    trace = option("--trace")
+    trace_json = option("--trace-json")
+    if trace is not None or trace_json is not None:
+        tracing.configure(trace or "all=debug", trace_json)
+    workers = option("--workers")
+    build = Build(
+        [arg for arg in sys.argv[1:] if not arg.startswith("--")],
+        option("--out") or DEFAULT_OUTPUT,
+        int(workers) if workers is not None else None,
+    )
+    succeeded = build.run()
+    for diagnostic in build.diagnostics:
+        print(diagnostic)
+    tracing.codegen.info(f"Built {len(build.built)} of {len(build.paths)} files")
+    tracing.close()
+    if not succeeded:
+        sys.exit(1)
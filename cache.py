@@ -0,0 +1,182 @@
+import gc
+import hashlib
+import os
+import pickle
+import struct
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator
+
+from ast_1 import Parser
+from ast_exprs import AstirExpr, SymbolTable, load_interned
+
+# On-disk cache of parser output. An entry is keyed by a hash of the
+# token stream, so edits to comments and whitespace still hit, and of
+# the compiler's own source, so changing the parser never loads output
+# it wouldn't produce. Each entry is one file:
+#
+#     MAGIC | FORMAT_VERSION (u16) | pickle of what the parse added
+#
+# "What the parse added" is everything a fresh Parser doesn't start with
+# (see ParseCache.state), which keeps the builtins, asm's handler
+# included, out of the file. Entries past max_bytes are evicted least
+# recently used first, a hit counts as a use.
+
+MAGIC = b"DALAST"
+FORMAT_VERSION = 1
+HEADER = MAGIC + struct.pack("<H", FORMAT_VERSION)
+SUFFIX = ".ast"
+DEFAULT_DIRECTORY = ".dalcache"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+COMPILER_SOURCES = ["common.py", "lexer.py", "numeric.py", "ast_exprs.py", "ast_1.py"]
+
+_compiler_hash: bytes | None = None
+
+
+def compiler_hash() -> bytes:
+    global _compiler_hash
+    if _compiler_hash is None:
+        digest = hashlib.sha256(HEADER)
+        root = os.path.dirname(os.path.abspath(__file__))
+        for name in COMPILER_SOURCES:
+            with open(os.path.join(root, name), "rb") as file:
+                digest.update(file.read())
+        _compiler_hash = digest.digest()
+    return _compiler_hash
+
+
+# Hash of what the tokens mean, not where they were, and of the
+# compiler. TableLexer hands out one Token per distinct text, so each
+# is only encoded once.
+def token_hash(tokens: Iterable[Any]) -> str:
+    encoded: dict[Any, bytes] = {}
+    parts: list[bytes] = [compiler_hash()]
+    for token in tokens:
+        part = encoded.get(token)
+        if part is None:
+            part = encoded[token] = (
+                f"{token.ty.value}\x1f{token.prim_ty}\x1f{token.val}\x1e".encode()
+            )
+        parts.append(part)
+    return hashlib.sha256(b"".join(parts)).hexdigest()
+
+
+# Pickling a parse makes or visits hundreds of thousands of objects and
+# none of them become garbage, so collecting in between only costs time.
+@contextmanager
+def paused_gc() -> Iterator[None]:
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class ParseCache:
+    def __init__(
+        self, directory: str = DEFAULT_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, tokens: Iterable[Any]) -> str:
+        return token_hash(tokens)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + SUFFIX)
+
+    # Puts the cached parse of `key` into `parser`, which has to be
+    # fresh. Returns False on a miss, a stale format or a broken entry,
+    # the last two are removed.
+    def load(self, key: str, parser: Parser) -> bool:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            return False
+        if not data.startswith(HEADER):
+            self.remove(path)
+            return False
+        with paused_gc():
+            try:
+                state = load_interned(memoryview(data)[len(HEADER) :], parser.symbol_tables)
+            except Exception:
+                self.remove(path)
+                return False
+            self.restore(parser, state)
+        os.utime(path)
+        return True
+
+    def store(self, key: str, parser: Parser) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        # Written next to the entry and renamed over it, so a reader
+        # never sees half a file.
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file, paused_gc():
+            file.write(HEADER)
+            pickle.dump(self.state(parser), file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        self.evict()
+
+    # Removes the least recently used entries until the rest fit in
+    # max_bytes.
+    def evict(self) -> None:
+        entries: list[tuple[float, int, str]] = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    def remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    # Everything `parser` has that a fresh Parser doesn't: its results,
+    # the symbol tables it made, what it put in the global table and
+    # the operators it declared or changed the fixity of.
+    def state(
+        self, parser: Parser
+    ) -> tuple[
+        list[AstirExpr],
+        list[SymbolTable],
+        list[tuple[str, AstirExpr]],
+        dict[str, dict[str, int]],
+        int,
+    ]:
+        fresh = Parser([])
+        global_symbols = parser.symbol_tables[0]
+        globals = [
+            (global_symbols.symbols[id].name, global_symbols.symbols[id].val)
+            for id in range(fresh.symbol_tables[0].usable_id, global_symbols.usable_id)
+        ]
+        tables = parser.symbol_tables.since(len(fresh.symbol_tables))
+        operators = {
+            op: fixity
+            for op, fixity in parser.operators.items()
+            if fresh.operators.get(op) != fixity
+        }
+        return (parser.results, tables, globals, operators, parser.tag)
+
+    def restore(self, parser: Parser, state) -> None:
+        results, tables, globals, operators, tag = state
+        parser.results.extend(results)
+        for table in tables:
+            parser.symbol_tables.add(table)
+        global_symbols = parser.symbol_tables[0]
+        for name, val in globals:
+            global_symbols.insert(name, val)
+        parser.operators.update(operators)
+        parser.tag += tag
+        parser.at = len(parser.input)
+        parser.using_st = 0
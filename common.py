@@ -1,6 +1,6 @@
 from abc import ABC
 from enum import Enum, auto
-from typing import Generic, TypeVar
+from typing import Any, Generator, Generic, TypeVar
 
 
 # https://stackoverflow.com/questions/287871/how-do-i-print-colored-text-to-the-terminal
@@ -23,6 +23,7 @@ class PrimitiveTypes(Enum):
     LIST = auto()
     FLOAT = auto()
     UNIT = auto()
+    FLOAT64 = auto()
 
 
 class TT(Enum):
@@ -39,20 +40,34 @@ class TT(Enum):
     OPEN_SQUARE = "["
     UNDERSCORE = "_"
     GREATER_THAN = ">"
-    LESS_THAN = ">"
+    LESS_THAN = "<"
     CURLY_OPEN = "{"
     CURLY_CLOSE = "}"
     EQ = "="
     PIPE = "|"
     CLOSE_SQUARE = "]"
     IDENT = "IDENT"
+    # Operator declared by the program, see lexer.OperatorTrie
+    OPERATOR = "OPERATOR"
     LITERAL = "LITERAL"
     COMMENT = "COMMENT"
     PRIME_FORM = "PRIME_FORM"
     DUMMY = "DUMMY"
 
 
-SYMBOLS = [TT.EQ, TT.LESS_THAN, TT.GREATER_THAN, TT.DASH, TT.FUNCTION_ARROW]
+SYMBOLS = [
+    TT.EQ,
+    TT.LESS_THAN,
+    TT.GREATER_THAN,
+    TT.DASH,
+    TT.PLUS,
+    TT.PIPE,
+    TT.FUNCTION_ARROW,
+    TT.OPERATOR,
+]
+
+OPENING_BRACKETS = [TT.OPEN_PAREN, TT.OPEN_SQUARE, TT.CURLY_OPEN]
+CLOSING_BRACKETS = [TT.CLOSE_PAREN, TT.CLOSE_SQUARE, TT.CURLY_CLOSE]
 
 operators = {
     "+": {
@@ -66,10 +81,76 @@ operators = {
         "associativity": 0,
     },
 }
+# Fixity given to operators a program declares, e.g. `[>>=]\ ...`,
+# until a different one is declared through Parser.declare_operator.
+default_fixity = {
+    "precedence": 1,
+    "associativity": 0,
+}
+
+
+# Compiler wide name table. Every distinct identifier gets a small
+# integer ID the first time it is seen (normally by the lexer), and
+# every later stage keys on that ID instead of rehashing the string.
+# names[id] is the one canonical str for the name.
+class Interner:
+    def __init__(self) -> None:
+        self.ids: dict[str, int] = {}
+        self.names: list[str] = []
+
+    def intern(self, name: str) -> int:
+        id = self.ids.get(name)
+        if id is None:
+            id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return id
+
+    def __getitem__(self, id: int) -> str:
+        return self.names[id]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+names = Interner()
 
 T = TypeVar("T")
 
 
+# Parser rules are written as generators. Instead of calling another
+# rule, a rule yields the generator of the rule it needs and is sent
+# back its result. The same rules then run either on Python's own
+# stack (run_nested) or on an explicit one (run_stacked), which is only
+# bounded by memory instead of the recursion limit.
+Rule = Generator[Any, Any, T]
+
+
+def run_nested(rule: Rule[T]) -> T:
+    value = None
+    while True:
+        try:
+            child = rule.send(value)
+        except StopIteration as returned:
+            return returned.value
+        value = run_nested(child)
+
+
+def run_stacked(rule: Rule[T]) -> T:
+    stack: list[Rule] = [rule]
+    value = None
+    while True:
+        try:
+            child = stack[-1].send(value)
+        except StopIteration as returned:
+            stack.pop()
+            if len(stack) == 0:
+                return returned.value
+            value = returned.value
+            continue
+        stack.append(child)
+        value = None
+
+
 class Cursor(ABC, Generic[T]):
     def __init__(self, input: list[T]) -> None:
         super().__init__()
@@ -83,3 +164,25 @@ class Cursor(ABC, Generic[T]):
         if self.at >= len(self.input):
             return None
         return self.input[self.at]
+
+
+# One problem found while compiling. token_index is where in the token
+# stream it was noticed, line and col are only known when the parser
+# was given a way to map tokens back to the source.
+class Diagnostic:
+    def __init__(
+        self,
+        message: str,
+        token_index: int,
+        line: int | None = None,
+        col: int | None = None,
+    ) -> None:
+        self.message = message
+        self.token_index = token_index
+        self.line = line
+        self.col = col
+
+    def __repr__(self) -> str:
+        if self.line is None:
+            return f"token {self.token_index}: {self.message}"
+        return f"{self.line}:{self.col}: {self.message}"
@@ -0,0 +1,212 @@
+from ast_exprs import (
+    Application,
+    Assignment,
+    AstirExpr,
+    BinaryOperation,
+    Lambda,
+    Literal,
+    Parenthesized,
+    PrimitiveType,
+    Reference,
+    primitive_type,
+)
+from common import PrimitiveTypes, Rule, run_stacked
+import tracing
+
+# Constant folding and simplification, run on the parser's results
+# before codegen. A chain of + and - is evaluated as a sum of terms, so
+# the integer literals in it add up to one, wherever they are:
+#
+#     x + 1 + 2 + y - y + 0   =>   x + 3
+#     2 + 3 - 5               =>   0
+#     2 - 5                   =>   0 - 3
+#
+# A negative constant is taken away rather than added, so it stays a
+# small literal instead of one that takes four instructions to load.
+#
+# A parameter taken away from itself cancels out. Calls are never
+# cancelled or moved past one another, they could do anything. A lambda
+# without parameters whose body folds to a literal is a constant, and
+# references to it later on are replaced by the literal. The parser
+# can't parse a lambda with a body yet (`f\ :: int → 1 + 2` stops at
+# the →), so that only happens on trees built by hand for now, see
+# tests/test_fold.py.
+#
+# Registers are 64 bits wide, so sums are taken modulo 2^64 and come
+# out the same as they would at runtime.
+
+WORD_MASK = 0xFFFFFFFFFFFFFFFF
+FOLDED_OPERATORS = ["+", "-"]
+
+
+def is_int(expr: AstirExpr) -> bool:
+    return (
+        isinstance(expr, Literal)
+        and isinstance(expr.ty, PrimitiveType)
+        and expr.ty.val == PrimitiveTypes.INT
+    )
+
+
+# The value of an integer literal, or of the `0 - literal` sum_rule
+# writes a negative constant as, None for anything else.
+def int_value(expr: AstirExpr) -> int | None:
+    if is_int(expr):
+        return expr.val  # type: ignore
+    elif (
+        isinstance(expr, BinaryOperation)
+        and expr.operator == "-"
+        and is_int(expr.left)
+        and expr.left.val == 0  # type: ignore
+        and is_int(expr.right)
+    ):
+        return -expr.right.val & WORD_MASK  # type: ignore
+    return None
+
+
+def count_operations(expr: AstirExpr) -> int:
+    count = 0
+    stack = [expr]
+    while len(stack) > 0:
+        current = stack.pop()
+        if isinstance(current, BinaryOperation):
+            count += 1
+            stack.append(current.left)
+            stack.append(current.right)
+        elif isinstance(current, Parenthesized) and current.inner is not None:
+            stack.append(current.inner)
+        elif isinstance(current, Application):
+            stack.extend(current.parameters)
+        elif isinstance(current, Assignment):
+            stack.append(current.right)
+        elif isinstance(current, Lambda):
+            stack.append(current.body)
+    return count
+
+
+class Folder:
+    def __init__(self) -> None:
+        # (scope, symbol ID) of each constant lambda -> its value, see
+        # int_value.
+        self.constants: dict[tuple[int, int], AstirExpr] = {}
+        # Binary operations taken out so far.
+        self.removed = 0
+
+    def fold_all(self, exprs: list[AstirExpr]) -> list[AstirExpr]:
+        before = sum(map(count_operations, exprs))
+        folded = [self.fold(expr) for expr in exprs]
+        after = sum(map(count_operations, folded))
+        self.removed += before - after
+        tracing.codegen.info(
+            "Folded constants", operations=before, removed=before - after
+        )
+        return folded
+
+    def fold(self, expr: AstirExpr) -> AstirExpr:
+        return run_stacked(self.fold_rule(expr))
+
+    # Gives back a folded copy, `expr` itself isn't changed, so what the
+    # parse cache stored stays as parsed.
+    def fold_rule(self, expr: AstirExpr) -> Rule[AstirExpr]:
+        if isinstance(expr, BinaryOperation):
+            if expr.operator in FOLDED_OPERATORS:
+                return (yield self.sum_rule(expr))
+            left = yield self.fold_rule(expr.left)
+            right = yield self.fold_rule(expr.right)
+            return BinaryOperation(expr.operator, left, right)
+        elif isinstance(expr, Parenthesized):
+            if expr.inner is None:
+                return expr
+            # Only there to group, which the tree already does.
+            return (yield self.fold_rule(expr.inner))
+        elif isinstance(expr, Reference):
+            constant = self.constants.get((expr.belongs_to, expr.symbol_id))
+            return expr if constant is None or not expr.copy_val else constant
+        elif isinstance(expr, Application):
+            parameters: list[AstirExpr] = []
+            for parameter in expr.parameters:
+                parameters.append((yield self.fold_rule(parameter)))
+            return Application(expr.lambda_ref, parameters)
+        elif isinstance(expr, Assignment) and isinstance(expr.right, Lambda):
+            fn = expr.right
+            body = yield self.fold_rule(fn.body)
+            folded = Lambda(fn.definition.parameters, body, fn.belongs_to, fn.symbol_id)
+            takes_nothing = all(
+                symbol.name == "ret" for symbol in fn.definition.parameters.symbols.values()
+            )
+            if takes_nothing and int_value(body) is not None:
+                self.constants[(fn.belongs_to, fn.symbol_id)] = body
+            return Assignment(expr.left, folded)
+        return expr
+
+    # Folds the whole chain of + and - that `expr` starts.
+    def sum_rule(self, expr: BinaryOperation) -> Rule[AstirExpr]:
+        # Every operand that isn't itself a + or -, with its sign.
+        terms: list[tuple[int, AstirExpr]] = []
+        pending: list[tuple[int, AstirExpr]] = [(1, expr)]
+        while len(pending) > 0:
+            sign, current = pending.pop()
+            if isinstance(current, Parenthesized) and current.inner is not None:
+                pending.append((sign, current.inner))
+            elif (
+                isinstance(current, BinaryOperation)
+                and current.operator in FOLDED_OPERATORS
+            ):
+                # Right first, so the left comes off the stack first and
+                # terms stay in the order they were written.
+                pending.append((sign if current.operator == "+" else -sign, current.right))
+                pending.append((sign, current.left))
+            else:
+                folded = yield self.fold_rule(current)
+                terms.append((sign, folded))
+
+        constant = 0
+        literal_ty = primitive_type(PrimitiveTypes.INT)
+        rest: list[tuple[int, AstirExpr]] = []
+        for sign, term in terms:
+            value = int_value(term)
+            if value is None:
+                rest.append((sign, term))
+                continue
+            constant += sign * value
+            if is_int(term):
+                literal_ty = term.ty  # type: ignore
+        constant &= WORD_MASK
+        negative = constant > WORD_MASK >> 1
+        rest = cancel(rest)
+
+        if len(rest) == 0 and not negative:
+            return Literal(literal_ty, constant)
+        elif len(rest) > 0 and rest[0][0] > 0:
+            result: AstirExpr = rest.pop(0)[1]
+        elif not negative:
+            result = Literal(literal_ty, constant)
+            constant = 0
+        else:
+            # Nothing to take the constant away from.
+            result = Literal(literal_ty, 0)
+        for sign, term in rest:
+            result = BinaryOperation("+" if sign > 0 else "-", result, term)
+        if negative:
+            result = BinaryOperation("-", result, Literal(literal_ty, -constant & WORD_MASK))
+        elif constant != 0:
+            result = BinaryOperation("+", result, Literal(literal_ty, constant))
+        return result
+
+
+# Takes out each pair of the same parameter added and subtracted.
+def cancel(terms: list[tuple[int, AstirExpr]]) -> list[tuple[int, AstirExpr]]:
+    # (scope, symbol ID, sign) -> indices of those terms not cancelled yet
+    open_terms: dict[tuple[int, int, int], list[int]] = {}
+    removed: set[int] = set()
+    for idx, (sign, term) in enumerate(terms):
+        # A reference with copy_val is a call to a lambda.
+        if not isinstance(term, Reference) or term.copy_val:
+            continue
+        key = (term.belongs_to, term.symbol_id)
+        opposite = open_terms.get((*key, -sign))
+        if opposite:
+            removed.add(opposite.pop())
+            removed.add(idx)
+        else:
+            open_terms.setdefault((*key, sign), []).append(idx)
+    return [term for idx, term in enumerate(terms) if idx not in removed]
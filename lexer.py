@@ -0,0 +1,827 @@
+import mmap
+import os
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left
+from itertools import repeat
+from typing import Generic, Iterable, Iterator, Sequence, TypeVar
+
+from common import TT, PrimitiveTypes, names
+from numeric import parse_numeric
+
+
+class Token:
+    __slots__ = ("ty", "val", "prim_ty", "name_id")
+
+    def __init__(
+        self,
+        ty: TT,
+        prim_ty: PrimitiveTypes | None = None,
+        val=None,
+        name_id: int | None = None,
+    ) -> None:
+        self.ty = ty
+        self.val = val
+        self.prim_ty = prim_ty
+        # Interned ID of the name, only set for identifiers.
+        self.name_id = name_id
+
+    # Name IDs only mean something in the process that interned them,
+    # so a pickled token carries the name and is re-interned on load.
+    def __getstate__(self):
+        name = None if self.name_id is None else names[self.name_id]
+        return (self.ty, self.prim_ty, self.val, name)
+
+    def __setstate__(self, state) -> None:
+        self.ty, self.prim_ty, self.val, name = state
+        self.name_id = None if name is None else names.intern(name)
+
+    def __repr__(self) -> str:
+        return f"{self.ty} ({self.val})"
+
+
+SINGLE_CHAR_TOKENS: dict[str, TT] = {
+    tt.value: tt for tt in TT if len(tt.value) == 1
+}
+
+# Characters user defined operators can be made of, "→" included.
+OPERATOR_CHARS = "=<>-+*!&|^%~?@$"
+_ARROW = TT.FUNCTION_ARROW.value
+BUILTIN_OPERATORS = [
+    c for c in OPERATOR_CHARS + _ARROW if c in SINGLE_CHAR_TOKENS
+]
+_OPERATOR = "(?:[" + re.escape(OPERATOR_CHARS) + "]|" + _ARROW + ")+"
+# Operators are declared by naming them in brackets, e.g. `[>>=]\ ...`.
+# Any bracketed operator counts, even inside a comment or string, which
+# keeps the set of operators a property of the text around each
+# occurrence and lets IncrementalLexer notice changes to it locally.
+DECLARATION_PATTERN = re.compile(r"\[(" + _OPERATOR + r")\]")
+SPAN_DECLARATION_PATTERN = re.compile(DECLARATION_PATTERN.pattern.encode())
+
+
+# Operators the lexer knows about, stored as a trie of nested dicts
+# keyed by character. A None key marks the end of an operator. The
+# lexer always takes the longest operator that matches, so once `>>=`
+# is declared "a >>= b" lexes to three tokens instead of five.
+class OperatorTrie:
+    def __init__(self, operators: Iterable[str] = BUILTIN_OPERATORS) -> None:
+        self.root: dict = {}
+        self.operators: set[str] = set()
+        for op in operators:
+            self.insert(op)
+
+    def insert(self, op: str) -> bool:
+        if op in self.operators:
+            return False
+        node = self.root
+        for c in op:
+            node = node.setdefault(c, {})
+        node[None] = True
+        self.operators.add(op)
+        return True
+
+    # Registers every operator declared in `input`, returns whether any
+    # of them was new.
+    def declare(self, input: str | bytes | mmap.mmap) -> bool:
+        if isinstance(input, str):
+            declared: list[str] = DECLARATION_PATTERN.findall(input)
+        else:
+            declared = [op.decode() for op in SPAN_DECLARATION_PATTERN.findall(input)]
+        added = False
+        for op in declared:
+            added |= self.insert(op)
+        return added
+
+    def longest_match(self, input: Sequence[str], at: int) -> str | None:
+        node = self.root
+        longest = None
+        end = at
+        while end < len(input):
+            child: dict | None = node.get(input[end])
+            if child is None:
+                break
+            node = child
+            end += 1
+            if None in node:
+                longest = end
+        return None if longest is None else "".join(input[at:longest])
+
+    # The trie as a regular expression. Every node that doesn't end an
+    # operator has to be followed by one of its children, every node
+    # that does makes the rest optional, so the regex engine's greedy
+    # matching finds the same longest match as walking the trie.
+    def pattern(self, node: dict | None = None) -> str:
+        node = self.root if node is None else node
+        branches = [
+            re.escape(c) + self.pattern(child)
+            for c, child in node.items()
+            if c is not None
+        ]
+        if len(branches) == 0:
+            return ""
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if None in node else group
+
+    def copy(self) -> "OperatorTrie":
+        return OperatorTrie(self.operators)
+
+    def __contains__(self, op: str) -> bool:
+        return op in self.operators
+
+
+# Splits the input into raw token texts in one pass. Alternatives are
+# ordered by how often they show up in real sources. Comments come out
+# as their own text (starting with "//") and are dropped by TokenTable,
+# operators are matched by longest match against the lexer's trie and
+# any other character falls through to the last alternative so nothing
+# is silently skipped.
+def token_pattern(operators: OperatorTrie) -> re.Pattern:
+    return re.compile(
+        r"""[ \n]*(
+            [tdm]'
+            |(?:0[xXbBoO][0-9a-fA-F_]+|(?:[0-9][0-9_]*(?:\.[0-9_]*)?|\.[0-9][0-9_]*)
+                (?:[eE][+-]?[0-9_]+)?(?:f32|f64)?)(?![\w.])
+            |[^\W_][\w.]*
+            |//[^\n]*\n?
+            |"(?:[^"\\]|\\.)*(?:"|\\?\Z)
+            |"""
+        + (operators.pattern() or "(?!)")
+        + r"""
+            |::
+            |\.[\w.]*
+            |[^ \n]
+        )""",
+        re.VERBOSE | re.DOTALL,
+    )
+
+
+STRING_BODY = re.compile(r'(?:[^"\\]|\\.)*', re.DOTALL)
+STRING_ESCAPE = re.compile(r"\\(.)", re.DOTALL)
+
+
+def token_from_text(text: str) -> Token | None:
+    c = text[0]
+    if c in SINGLE_CHAR_TOKENS and len(text) == 1:
+        return Token(SINGLE_CHAR_TOKENS[c])
+    elif c == "/":
+        return None if text.startswith("//") else Token(TT.DUMMY)
+    elif c == ":":
+        return Token(TT.DOUBLE_COLON)
+    elif c == '"':
+        string = text[1 : STRING_BODY.match(text, 1).end()]  # type: ignore
+        if "\\" in string:
+            string = STRING_ESCAPE.sub(r"\1", string)
+        return Token(TT.LITERAL, prim_ty=PrimitiveTypes.STR, val=string)
+    elif text.endswith("'") and len(text) == 2:
+        return Token(TT.PRIME_FORM, val=c)
+    elif c.isalnum() or c == ".":
+        if (number := parse_numeric(text)) is not None:
+            return Token(TT.LITERAL, val=number[1], prim_ty=number[0])
+        elif "." in text:
+            raise Exception(f'Invalid numeric literal: "{text}"')
+        name_id = names.intern(text)
+        return Token(TT.IDENT, val=names[name_id], name_id=name_id)
+    raise Exception(f"Unexpected character {c!r}")
+
+
+# Maps raw token text to its Token. Tokens are never mutated after
+# lexing, so every occurrence of the same text shares one Token and
+# only the first occurrence pays for building it.
+class TokenTable(dict[str, Token | None]):
+    def __init__(self, operators: OperatorTrie) -> None:
+        super().__init__()
+        self.operators = operators
+
+    def __missing__(self, text: str) -> Token | None:
+        if text in self.operators and text not in SINGLE_CHAR_TOKENS:
+            name_id = names.intern(text)
+            token: Token | None = Token(TT.OPERATOR, val=names[name_id], name_id=name_id)
+        else:
+            token = token_from_text(text)
+        self[text] = token
+        return token
+
+
+# Characters of input below which lex_parallel lexes sequentially when
+# left to pick the number of workers. Starting the pool and sending
+# the chunks back and forth costs about what lex_all takes on a couple
+# of hundred KiB, it only pays off when the chunks are several times that.
+PARALLEL_LEX_MIN_SIZE = 1 << 20
+
+
+T = TypeVar("T")
+
+
+# Splits the input with one compiled pattern, whose first group is the
+# text of a token, and resolves each piece through `table`, a dict that
+# makes the token for a text it hasn't seen (None to drop it, like a
+# comment). What the tokens are is all up to those two, TableLexer
+# below and v2's lexer both run on this.
+class PatternLexer(Generic[T]):
+    def __init__(self, input: str, pattern: re.Pattern, table: dict[str, T | None]) -> None:
+        self.input = input
+        self.results: list[T] = []
+        self.pattern = pattern
+        self.table = table
+        self.offsets: array | None = None
+
+    def lex_all(self) -> None:
+        texts = self.pattern.findall(self.input)
+        self.results.extend(filter(None, map(self.table.__getitem__, texts)))
+
+    # Same result as lex_all, but the input is cut into chunks at line
+    # boundaries and the chunks are lexed in a process pool. TableLexer
+    # collects operator declarations from the whole input up front, so
+    # every chunk splits operators the same way. A chunk is
+    # lexed as if it started in a clean state, which is only wrong when
+    # a string literal runs across the boundary; merge_chunks finds
+    # those and re-lexes sequentially until the streams line up again.
+    # Without a worker count it's one per core, and inputs too small to
+    # make up for starting the pool are lexed with lex_all.
+    def lex_parallel(self, workers: int | None = None) -> None:
+        if workers is None:
+            if len(self.input) < PARALLEL_LEX_MIN_SIZE:
+                return self.lex_all()
+            workers = os.cpu_count() or 1
+        bounds: list[tuple[int, int]] = []
+        start = 0
+        while start < len(self.input):
+            end = self.input.find("\n", start + len(self.input) // workers)
+            end = len(self.input) if end == -1 else end + 1
+            bounds.append((start, end))
+            start = end
+        if workers == 1 or len(bounds) <= 1:
+            return self.lex_all()
+        with ProcessPoolExecutor(workers) as pool:
+            chunks = list(
+                pool.map(
+                    lex_chunk,
+                    repeat(self.pattern),
+                    [self.input[start:end] for start, end in bounds],
+                )
+            )
+        self.results.extend(self.merge_chunks(bounds, chunks))
+
+    def merge_chunks(
+        self, bounds: list[tuple[int, int]], chunks: list[tuple[list[str], array]]
+    ) -> list[T]:
+        results: list[T] = []
+        # Offset sequential lexing has to pick up from, None while the
+        # chunks line up with each other.
+        pending: int | None = None
+        for idx, ((start, end), (texts, ids)) in enumerate(zip(bounds, chunks)):
+            try:
+                by_id = [self.table[text] for text in texts]
+            except Exception:
+                # Something in here does not lex, which is only an error
+                # if it is not inside a string from an earlier chunk.
+                # Lexing the chunk sequentially will tell.
+                if pending is None:
+                    pending = start
+                continue
+
+            first = 0
+            if pending is not None:
+                token_starts = (
+                    m.start(1)
+                    for m in self.pattern.finditer(self.input, start, end)
+                    if self.table[m[1]] is not None
+                )
+                next_start = next(token_starts, end)
+                for token, token_start, _ in self.scan(pending):
+                    if token_start >= end:
+                        # Swallowed the whole chunk (a long string).
+                        pending = token_start
+                        break
+                    while next_start < token_start:
+                        next_start = next(token_starts, end)
+                        first += 1
+                    if next_start == token_start:
+                        pending = None
+                        break
+                    results.append(token)
+                else:
+                    return results
+                if pending is not None:
+                    continue
+            tokens = list(filter(None, map(by_id.__getitem__, ids)))
+            results.extend(tokens[first:])
+
+            # Chunks end on a newline, so the only token that can run
+            # into the end of one is a string that carries on in the
+            # next chunk.
+            last = texts[ids[-1]] if len(ids) > 0 else ""
+            if (
+                idx + 1 < len(bounds)
+                and last.startswith('"')
+                and STRING_BODY.match(last, 1).end() == len(last)  # type: ignore
+                and self.input.endswith(last, start, end)
+            ):
+                results.pop()
+                pending = end - len(last)
+        if pending is not None:
+            results.extend(token for token, _, _ in self.scan(pending))
+        return results
+
+    # Same tokens as lex_all, but with the (start, end) offsets of
+    # each one in the input. Slower, so only used by callers that
+    # need positions.
+    def scan(self, at: int = 0) -> Iterator[tuple[T, int, int]]:
+        table = self.table
+        for m in self.pattern.finditer(self.input, at):
+            token = table[m[1]]
+            if token is not None:
+                yield token, m.start(1), m.end()
+
+    # Line and column (both from 1) of the index'th token, for
+    # diagnostics. An index past the end points at the end of the
+    # input. Offsets are only worked out the first time they're needed.
+    def line_col(self, index: int) -> tuple[int, int]:
+        if self.offsets is None:
+            self.offsets = array("q", (start for _, start, _ in self.scan()))
+        offset = self.offsets[index] if index < len(self.offsets) else len(self.input)
+        line_start = self.input.rfind("\n", 0, offset) + 1
+        return (self.input.count("\n", 0, offset) + 1, offset - line_start + 1)
+
+
+# Produces the same Token stream as ast_1.Lexer, but splits the input
+# with one compiled pattern and resolves each piece through a TokenTable
+# instead of stepping one character at a time through a Cursor.
+class TableLexer(PatternLexer[Token]):
+    def __init__(self, input: str, operators: OperatorTrie | None = None) -> None:
+        self.operators = OperatorTrie() if operators is None else operators.copy()
+        self.operators.declare(input)
+        super().__init__(input, token_pattern(self.operators), TokenTable(self.operators))
+
+    def lex_compact(self) -> "TokenBuffer":
+        buffer = TokenBuffer()
+        for token, start, _ in self.scan():
+            buffer.append(token, start)
+        return buffer
+
+
+# Process pool worker for TableLexer.lex_parallel. Splits one chunk into
+# raw token texts and sends them back as the list of distinct texts plus
+# an array of indexes into it, which pickles far faster than Tokens.
+# Everything here runs in C, classifying texts is left to the caller.
+def lex_chunk(pattern: re.Pattern, chunk: str) -> tuple[list[str], array]:
+    texts = pattern.findall(chunk)
+    distinct = list(dict.fromkeys(texts))
+    ids = dict(zip(distinct, range(len(distinct))))
+    return (distinct, array("I", map(ids.__getitem__, texts)))
+
+
+# Token kinds and primitive types are stored as one byte each, indexing
+# into these lists. Primitive type code 0 means "no primitive type".
+TT_CODES: list[TT] = list(TT)
+TT_TO_CODE: dict[TT, int] = {tt: code for code, tt in enumerate(TT_CODES)}
+PRIM_CODES: list[PrimitiveTypes | None] = [None, *PrimitiveTypes]
+PRIM_TO_CODE: dict[PrimitiveTypes | None, int] = {
+    prim: code for code, prim in enumerate(PRIM_CODES)
+}
+
+
+# What TokenBuffer hands out when indexed. Same fields as Token plus the
+# offset of the token in the source, without a per-instance __dict__.
+class TokenView:
+    __slots__ = ("ty", "prim_ty", "val", "name_id", "offset")
+
+    def __init__(
+        self,
+        ty: TT,
+        prim_ty: PrimitiveTypes | None,
+        val,
+        offset: int,
+        name_id: int | None = None,
+    ) -> None:
+        self.ty = ty
+        self.prim_ty = prim_ty
+        self.val = val
+        self.name_id = name_id
+        self.offset = offset
+
+    def __repr__(self) -> str:
+        return f"{self.ty} ({self.val})"
+
+
+# Struct-of-arrays token storage. Every token costs one byte of kind,
+# one byte of primitive type, an 8 byte offset and a 4 byte index into
+# the literal side table, which holds each distinct token value once.
+# Identifiers and operators don't go through the side table at all,
+# their index is the interned name ID.
+# Indexing returns a TokenView, so Cursor based parsers can walk a
+# TokenBuffer exactly like a list[Token].
+class TokenBuffer:
+    def __init__(self) -> None:
+        self.kinds = array("B")
+        self.prim_tys = array("B")
+        self.offsets = array("q")
+        self.literal_idx = array("i")
+        self.literals: list = []
+        self.literal_to_idx: dict = {}
+
+    def append(self, token: Token, offset: int) -> None:
+        self.kinds.append(TT_TO_CODE[token.ty])
+        self.prim_tys.append(PRIM_TO_CODE[token.prim_ty])
+        self.offsets.append(offset)
+        if token.name_id is not None:
+            self.literal_idx.append(token.name_id)
+            return
+        elif token.val is None:
+            self.literal_idx.append(-1)
+            return
+        # Keyed on the type as well so 1 and 1.0 (or True) never share
+        # a slot.
+        key = (type(token.val), token.val)
+        idx = self.literal_to_idx.get(key)
+        if idx is None:
+            idx = self.literal_to_idx[key] = len(self.literals)
+            self.literals.append(token.val)
+        self.literal_idx.append(idx)
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, idx: int) -> TokenView:
+        literal = self.literal_idx[idx]
+        ty = TT_CODES[self.kinds[idx]]
+        if ty == TT.IDENT or ty == TT.OPERATOR:
+            return TokenView(ty, None, names[literal], self.offsets[idx], literal)
+        return TokenView(
+            ty,
+            PRIM_CODES[self.prim_tys[idx]],
+            self.literals[literal] if literal != -1 else None,
+            self.offsets[idx],
+        )
+
+    def __iter__(self) -> Iterator[TokenView]:
+        for idx in range(len(self.kinds)):
+            yield self[idx]
+
+    def __repr__(self) -> str:
+        return f"{list(self)}"
+
+
+# Read-only view of a source file. The file is memory-mapped instead of
+# read into a str, so the only copy of the text is the page cache. Line
+# and column numbers are computed on demand from a newline offset index
+# that is only built the first time one is asked for.
+class SourceBuffer:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "rb")
+        self.data: mmap.mmap | bytes = (
+            mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if os.fstat(self.file.fileno()).st_size > 0
+            # mmap refuses to map empty files
+            else b""
+        )
+        self.newlines: array | None = None
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def text(self, start: int, end: int) -> str:
+        return self.data[start:end].decode("utf-8")
+
+    def line_col(self, offset: int) -> tuple[int, int]:
+        if self.newlines is None:
+            self.newlines = array("q")
+            at = self.data.find(b"\n")
+            while at != -1:
+                self.newlines.append(at)
+                at = self.data.find(b"\n", at + 1)
+        line = bisect_left(self.newlines, offset)
+        line_start = self.newlines[line - 1] + 1 if line > 0 else 0
+        # Columns count characters, not bytes.
+        return (line + 1, len(self.text(line_start, offset)) + 1)
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+
+SPAN_PRIME_FORM = 1
+SPAN_NUMBER = 2
+SPAN_WORD = 3
+SPAN_COMMENT = 4
+SPAN_STRING = 5
+SPAN_DOUBLE_COLON = 6
+SPAN_OPERATOR = 7
+SPAN_OTHER = 8
+
+# Byte level version of token_pattern. Every kind of token gets its own
+# group so m.lastindex tells us what was matched without slicing the
+# buffer. Bytes patterns only know ASCII, so any non-ASCII byte other
+# than the start of "→" is treated as an identifier character.
+_HIGH = rb"(?!" + re.escape(_ARROW.encode()) + rb")[\x80-\xff]"
+
+
+def span_pattern(operators: OperatorTrie) -> re.Pattern[bytes]:
+    return re.compile(
+        rb"[ \n]*(?:"
+        + rb"([tdm]')"
+        + rb"|((?:0[xXbBoO][0-9a-fA-F_]+|(?:[0-9][0-9_]*(?:\.[0-9_]*)?|\.[0-9][0-9_]*)"
+        + rb"(?:[eE][+-]?[0-9_]+)?(?:f32|f64)?))(?![\w.]|" + _HIGH + rb")"
+        + rb"|((?:[^\W_]|\.|" + _HIGH + rb")(?:[\w.]|" + _HIGH + rb")*)"
+        + rb"|(//[^\n]*\n?)"
+        + rb'|("(?:[^"\\]|\\.)*(?:"|\\?\Z))'
+        + rb"|(::)"
+        + rb"|(" + (operators.pattern() or "(?!)").encode() + rb")"
+        + rb"|([^ \n]))",
+        re.DOTALL,
+    )
+
+
+# Token that only knows its kind and where it sits in the source. The
+# value (and primitive type for literals) is decoded from the buffer the
+# first time it is asked for.
+class SpanToken:
+    __slots__ = ("source", "ty", "start", "end", "_val", "_number")
+
+    def __init__(self, source: SourceBuffer, ty: TT, start: int, end: int) -> None:
+        self.source = source
+        self.ty = ty
+        self.start = start
+        self.end = end
+        self._val = None
+        self._number: tuple[PrimitiveTypes, int] | None = None
+
+    @property
+    def prim_ty(self) -> PrimitiveTypes | None:
+        if self.ty != TT.LITERAL:
+            return None
+        elif self.source.data[self.start] == ord('"'):
+            return PrimitiveTypes.STR
+        return self.number()[0]
+
+    @property
+    def val(self):
+        if self._val is None:
+            self._val = self.decode()
+        return self._val
+
+    @property
+    def name_id(self) -> int | None:
+        if self.ty != TT.IDENT and self.ty != TT.OPERATOR:
+            return None
+        return names.intern(self.val)
+
+    def number(self) -> tuple[PrimitiveTypes, int]:
+        if self._number is None:
+            text = self.source.text(self.start, self.end)
+            number = parse_numeric(text)
+            if number is None:
+                raise Exception(f'Invalid numeric literal: "{text}"')
+            self._number = number
+        return self._number
+
+    def decode(self):
+        if self.ty == TT.PRIME_FORM:
+            return chr(self.source.data[self.start])
+        elif self.ty == TT.IDENT or self.ty == TT.OPERATOR:
+            return names[names.intern(self.source.text(self.start, self.end))]
+        elif self.ty != TT.LITERAL:
+            return None
+        elif self.source.data[self.start] == ord('"'):
+            return token_from_text(self.source.text(self.start, self.end)).val  # type: ignore
+        return self.number()[1]
+
+    def line_col(self) -> tuple[int, int]:
+        return self.source.line_col(self.start)
+
+    def __repr__(self) -> str:
+        return f"{self.ty} ({self.val})"
+
+
+# How many of the tokens SpanTokens handed out last it keeps, the parser
+# looks at the same few positions over and over with current() and peek().
+RECENT_SPAN_TOKENS = 8
+
+
+# List-like sequence of tokens stored as three flat arrays. Indexing
+# builds a SpanToken on the fly, so Cursor based parsers can walk it
+# exactly like a list[Token]. The last few are kept so asking for the
+# same index again gives back the same token, with its value already
+# decoded.
+class SpanTokens:
+    def __init__(self, source: SourceBuffer) -> None:
+        self.source = source
+        self.kinds = array("B")
+        self.starts = array("q")
+        self.ends = array("q")
+        # recent[idx % RECENT_SPAN_TOKENS] is the token for index
+        # recent_idx[idx % RECENT_SPAN_TOKENS], tokens are only ever
+        # appended so it never goes stale.
+        self.recent: list[SpanToken | None] = [None] * RECENT_SPAN_TOKENS
+        self.recent_idx = [-1] * RECENT_SPAN_TOKENS
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, idx: int) -> SpanToken:
+        if idx < 0:
+            idx += len(self.kinds)
+        slot = idx % RECENT_SPAN_TOKENS
+        token = self.recent[slot]
+        if token is None or self.recent_idx[slot] != idx:
+            token = SpanToken(
+                self.source, TT_CODES[self.kinds[idx]], self.starts[idx], self.ends[idx]
+            )
+            self.recent[slot] = token
+            self.recent_idx[slot] = idx
+        return token
+
+    def __iter__(self) -> Iterator[SpanToken]:
+        for idx in range(len(self.kinds)):
+            yield self[idx]
+
+    def __repr__(self) -> str:
+        return f"{list(self)}"
+
+
+# Lexes a memory-mapped SourceBuffer into SpanTokens. Nothing but the
+# kind and offsets of each token is kept, so peak memory is the arrays
+# (17 bytes per token) on top of the mapping itself.
+class SpanLexer:
+    def __init__(
+        self, source: SourceBuffer, operators: OperatorTrie | None = None
+    ) -> None:
+        self.source = source
+        self.results = SpanTokens(source)
+        self.operators = OperatorTrie() if operators is None else operators.copy()
+        self.operators.declare(source.data)
+        self.pattern = span_pattern(self.operators)
+
+    def lex_all(self) -> None:
+        data = self.source.data
+        kinds = self.results.kinds
+        starts = self.results.starts
+        ends = self.results.ends
+        ident = TT_TO_CODE[TT.IDENT]
+        literal = TT_TO_CODE[TT.LITERAL]
+        group_codes = {
+            SPAN_PRIME_FORM: TT_TO_CODE[TT.PRIME_FORM],
+            SPAN_NUMBER: literal,
+            SPAN_STRING: literal,
+            SPAN_DOUBLE_COLON: TT_TO_CODE[TT.DOUBLE_COLON],
+        }
+        operator_codes = {
+            op.encode(): TT_TO_CODE[SINGLE_CHAR_TOKENS.get(op, TT.OPERATOR)]
+            for op in self.operators.operators
+        }
+        other_codes = {
+            ord(c): TT_TO_CODE[tt] for c, tt in SINGLE_CHAR_TOKENS.items() if c.isascii()
+        }
+        other_codes[ord("/")] = TT_TO_CODE[TT.DUMMY]
+        at = 0
+        for m in self.pattern.finditer(data):
+            group = m.lastindex
+            at = m.start(group)  # type: ignore
+            end = m.end()
+            if group == SPAN_WORD:
+                code = literal if data.find(b".", at, end) != -1 else ident
+            elif group == SPAN_COMMENT:
+                continue
+            elif group == SPAN_OPERATOR:
+                code = operator_codes[data[at:end]]
+            elif group == SPAN_OTHER:
+                code = other_codes.get(data[at], -1)
+                if code == -1:
+                    line, col = self.source.line_col(at)
+                    raise Exception(
+                        f"Unexpected character at {self.source.path}:{line}:{col}"
+                    )
+            else:
+                code = group_codes[group]  # type: ignore
+            kinds.append(code)
+            starts.append(at)
+            ends.append(end)
+
+    # Same as TableLexer.line_col.
+    def line_col(self, index: int) -> tuple[int, int]:
+        starts = self.results.starts
+        offset = starts[index] if index < len(starts) else len(self.source)
+        return self.source.line_col(offset)
+
+
+# Keeps the token stream of a buffer that is being edited and re-lexes
+# only the region an edit touches. Tokens are held in a gap buffer:
+# `head` holds the tokens in front of the last edit with absolute
+# offsets, `tail` holds the tokens after it in reverse order, with
+# offsets relative to the end of the input. An edit never has to
+# renumber the tail, and moving the gap between edits only costs the
+# distance between them, so a keystroke costs roughly the size of the
+# damaged region rather than the size of the file.
+class IncrementalLexer:
+    def __init__(self, input: str) -> None:
+        self.lexer = TableLexer(input)
+        self.head: list[tuple[Token, int, int]] = list(self.lexer.scan())
+        self.tail: list[tuple[Token, int, int]] = []
+
+    @property
+    def input(self) -> str:
+        return self.lexer.input
+
+    @property
+    def results(self) -> list[Token]:
+        return [token for token, _, _ in self.spans()]
+
+    def spans(self) -> Iterator[tuple[Token, int, int]]:
+        yield from self.head
+        size = len(self.input)
+        for token, start, end in reversed(self.tail):
+            yield token, start + size, end + size
+
+    # Replaces `deleted` characters at `offset` with `inserted`. Returns
+    # (index of the first changed token, tokens removed, tokens added)
+    # so callers can patch anything they keep alongside the tokens.
+    def edit(self, offset: int, deleted: int, inserted: str) -> tuple[int, int, int]:
+        size = len(self.input)
+        if not (0 <= offset and offset + deleted <= size):
+            raise Exception(f"Edit ({offset}, {deleted}) is outside of the input")
+
+        # Any token ending at or after the edit may change, even one that
+        # ends right at it (typing "d" after "foo" makes "food"). So may
+        # one starting less than the longest operator before it, which
+        # can become the start of a longer one (with `>>>` declared,
+        # typing ">" after ">>" turns its two `>` tokens into `>>>`).
+        # Lexing restarts right after the last token before those, which
+        # is always a clean state, strings and comments included.
+        reach = offset - max(map(len, self.lexer.operators.operators), default=1)
+        head, tail = self.head, self.tail
+        while len(head) > 0 and (head[-1][2] >= offset or head[-1][1] > reach):
+            token, start, end = head.pop()
+            tail.append((token, start - size, end - size))
+        while len(tail) > 0 and tail[-1][2] + size < offset and tail[-1][1] + size <= reach:
+            token, start, end = tail.pop()
+            head.append((token, start + size, end + size))
+        first_changed = len(head)
+        restart = head[-1][2] if len(head) > 0 else 0
+
+        previous = self.input
+        self.lexer.input = previous[:offset] + inserted + previous[offset + deleted :]
+        if self.touches_declaration(previous, offset, deleted, inserted):
+            return self.relex_declarations(previous)
+        size = len(self.input)
+        edit_end = offset + len(inserted)
+        removed = 0
+        added = 0
+        try:
+            for token, start, end in self.lexer.scan(restart):
+                # Old tokens the new ones have moved past are gone.
+                while len(tail) > 0 and tail[-1][1] + size < start:
+                    tail.pop()
+                    removed += 1
+                # Past the edit, a new token starting where an old one did
+                # means the rest of the old stream is still valid.
+                if start >= edit_end and len(tail) > 0 and tail[-1][1] + size == start:
+                    break
+                head.append((token, start, end))
+                added += 1
+            else:
+                removed += len(tail)
+                tail.clear()
+        except Exception:
+            # The edit does not lex, keep the previous input and tokens.
+            self.lexer.input = previous
+            self.head = list(self.lexer.scan())
+            self.tail = []
+            raise
+        return (first_changed, removed, added)
+
+    # Whether the lines an edit touches held or now hold an operator
+    # declaration. Declarations can change how any part of the input
+    # lexes, so those edits are not incremental.
+    def touches_declaration(
+        self, previous: str, offset: int, deleted: int, inserted: str
+    ) -> bool:
+        for input, end in (
+            (previous, offset + deleted),
+            (self.input, offset + len(inserted)),
+        ):
+            start = input.rfind("\n", 0, offset) + 1
+            end = input.find("\n", end)
+            for op in DECLARATION_PATTERN.findall(
+                input, start, len(input) if end == -1 else end
+            ):
+                if op not in BUILTIN_OPERATORS:
+                    return True
+        return False
+
+    # Re-lexes the whole input from scratch, with the operators it
+    # declares now.
+    def relex_declarations(self, previous: str) -> tuple[int, int, int]:
+        removed = len(self.head) + len(self.tail)
+        try:
+            lexer = TableLexer(self.input)
+            spans = list(lexer.scan())
+        except Exception:
+            self.lexer.input = previous
+            raise
+        self.lexer = lexer
+        self.head = spans
+        self.tail = []
+        return (0, removed, len(spans))
@@ -0,0 +1,92 @@
+import math
+import re
+import struct
+from fractions import Fraction
+
+from common import PrimitiveTypes
+
+# Underscores are only allowed between two digits, e.g. 1_000_000.
+_DEC = r"[0-9](?:_?[0-9])*"
+NUMBER = re.compile(
+    rf"""
+    0[xX](?P<hex>[0-9a-fA-F](?:_?[0-9a-fA-F])*)
+    |0[bB](?P<bin>[01](?:_?[01])*)
+    |0[oO](?P<oct>[0-7](?:_?[0-7])*)
+    |(?P<float>
+        (?:{_DEC}\.(?:{_DEC})?|\.{_DEC}|{_DEC}(?=[eE]))
+        (?:[eE][+-]?{_DEC})?
+    )(?P<suffix>f32|f64)?
+    |(?P<int>{_DEC})
+    """,
+    re.VERBOSE,
+)
+
+
+FLOAT32_MIN_NORMAL = 2.0**-126
+
+
+# float(text), which rounds anything past the largest double to inf. A
+# literal that big is an error at either size, like one too big for 32
+# bits is in pack_float32.
+def float_value(text: str, bits: int) -> float:
+    value = float(text)
+    if math.isinf(value):
+        raise Exception(f'Float literal "{text}" does not fit in {bits} bits')
+    return value
+
+
+def pack_float32(text: str) -> int:
+    value = float_value(text, 32)
+    try:
+        bits = struct.unpack("<I", struct.pack("<f", value))[0]
+    except OverflowError:
+        raise Exception(f'Float literal "{text}" does not fit in 32 bits')
+    # float(text) is correctly rounded to 64 bits, rounding that again
+    # to 32 bits is only wrong when the double landed exactly halfway
+    # between two float32s. For normal float32s that means the 29 low
+    # mantissa bits of the double are exactly 1000...0, anything else
+    # (the overwhelming majority) is already exact.
+    if (
+        value >= FLOAT32_MIN_NORMAL
+        and struct.unpack("<Q", struct.pack("<d", value))[0] & 0x1FFFFFFF
+        != 0x10000000
+    ):
+        return bits
+    # Settle the few real midpoints (and subnormals) exactly.
+    f32 = struct.unpack("<f", struct.pack("<I", bits))[0]
+    for neighbour_bits in (bits - 1, bits + 1):
+        if not 0 <= neighbour_bits <= 0xFFFFFFFF:
+            continue
+        neighbour = struct.unpack("<f", struct.pack("<I", neighbour_bits))[0]
+        if value != (f32 + neighbour) / 2:
+            continue
+        exact = Fraction(text.replace("_", ""))
+        midpoint = Fraction(value)
+        if exact != midpoint and (exact > midpoint) == (neighbour > f32):
+            bits = neighbour_bits
+    return bits
+
+
+def pack_float64(text: str) -> int:
+    return struct.unpack("<Q", struct.pack("<d", float_value(text, 64)))[0]
+
+
+# Parses a numeric literal into its primitive type and value. Integers
+# come back as ints, floats as their raw IEEE-754 bit pattern (32 bits
+# unless suffixed with f64) so codegen can load them directly. Returns
+# None when the text is not a numeric literal at all.
+def parse_numeric(text: str) -> tuple[PrimitiveTypes, int] | None:
+    match = NUMBER.fullmatch(text)
+    if match is None:
+        return None
+    if (digits := match["int"]) is not None:
+        return (PrimitiveTypes.INT, int(digits))
+    elif (digits := match["hex"]) is not None:
+        return (PrimitiveTypes.INT, int(digits, 16))
+    elif (digits := match["bin"]) is not None:
+        return (PrimitiveTypes.INT, int(digits, 2))
+    elif (digits := match["oct"]) is not None:
+        return (PrimitiveTypes.INT, int(digits, 8))
+    elif match["suffix"] == "f64":
+        return (PrimitiveTypes.FLOAT64, pack_float64(match["float"]))
+    return (PrimitiveTypes.FLOAT, pack_float32(match["float"]))
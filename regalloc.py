@@ -0,0 +1,353 @@
+from bisect import bisect_right, insort
+
+import tracing
+
+# Register allocation for one lambda at a time. ASM lowers a lambda's
+# body to Code: instructions over virtual registers, as many as it
+# likes, each written once. allocate() gives every virtual register a
+# real one or a stack slot by linear scan (Poletto and Sarkar): the
+# live intervals are walked in order of where they start and each takes
+# a free register, when there's none the interval that ends last is
+# spilled, which might be the new one. emit() then writes the AArch64
+# for it, with the prologue and epilogue the registers it used need.
+#
+# Registers follow AAPCS64. x0-x7 hold arguments and the result and,
+# with x8-x15, are free for the callee to overwrite (caller-saved), so a
+# value that has to survive a bl is only ever given one of x19-x28
+# (callee-saved), which the lambda itself saves and restores in turn.
+# x16 and x17 are kept for loading spilled values, x18 is the
+# platform's, x29 and x30 are the frame pointer and return address.
+
+WORD = 8
+# Tried in this order, x9-x15 first so x0-x7 are left alone for as long
+# as possible, a call needs those for its arguments.
+CALLER_SAVED = [9, 10, 11, 12, 13, 14, 15, 0, 1, 2, 3, 4, 5, 6, 7, 8]
+CALLEE_SAVED = [19, 20, 21, 22, 23, 24, 25, 26, 27, 28]
+SCRATCH = (16, 17)
+ARGUMENT_REGISTERS = 8
+# Largest immediate add and sub take, they can also shift it left by 12.
+MAX_IMMEDIATE = 4095
+# Largest offset ldr and str take from a base register, a multiple of 8.
+MAX_OFFSET = MAX_IMMEDIATE * WORD
+
+
+def load_immediate(register: int, value: int) -> list[str]:
+    # mov only takes 16 bit immediates, build wider values
+    # (and float bit patterns) 16 bits at a time.
+    value &= 0xFFFFFFFFFFFFFFFF
+    lines: list[str] = []
+    for shift in range(0, 64, 16):
+        chunk = (value >> shift) & 0xFFFF
+        if chunk == 0:
+            continue
+        op = "movk" if len(lines) > 0 else "movz"
+        lines.append(f"{op} x{register}, #{hex(chunk)}, lsl #{shift}")
+    if len(lines) == 0:
+        return [f"mov x{register}, #0"]
+    return lines
+
+
+# `op` (add or sub) of `value` to `source` into `dest`, either of which
+# may be sp. Up to 24 bits go in as at most two immediates, the top 12
+# shifted, anything wider is loaded into `scratch` first.
+def add_immediate(op: str, dest: str, source: str, value: int, scratch: int) -> list[str]:
+    if value <= MAX_IMMEDIATE:
+        return [f"{op} {dest}, {source}, #{value}"]
+    elif value < 1 << 24:
+        lines = [f"{op} {dest}, {source}, #{value >> 12}, lsl #12"]
+        if value & MAX_IMMEDIATE != 0:
+            lines.append(f"{op} {dest}, {dest}, #{value & MAX_IMMEDIATE}")
+        return lines
+    return load_immediate(scratch, value) + [f"{op} {dest}, {source}, x{scratch}"]
+
+
+# One instruction over virtual registers. `op` is one of
+#
+#     param  dest = argument number `value`, only at the start
+#     imm    dest = value
+#     add    dest = args[0] + args[1], or + value when there's one arg
+#     sub    the same with -
+#     call   dest = result of bl `value` with args as its arguments
+#     ret    returns args[0]
+class Instruction:
+    __slots__ = ("op", "dest", "args", "value")
+
+    def __init__(self, op: str, dest: int | None, args: list[int], value=None) -> None:
+        self.op = op
+        self.dest = dest
+        self.args = args
+        self.value = value
+
+    def __repr__(self) -> str:
+        dest = "" if self.dest is None else f"v{self.dest} = "
+        args = ", ".join(f"v{arg}" for arg in self.args)
+        value = "" if self.value is None else f" {self.value}"
+        return f"{dest}{self.op}{value} {args}"
+
+
+class Code:
+    def __init__(self) -> None:
+        self.instructions: list[Instruction] = []
+        self.registers = 0
+
+    def add(self, op: str, args: list[int] = [], value=None, dest: bool = True) -> int:
+        register = self.registers if dest else None
+        if dest:
+            self.registers += 1
+        self.instructions.append(Instruction(op, register, args, value))
+        return -1 if register is None else register
+
+
+# Where each virtual register went: ("x", number) or ("slot", index).
+class Allocation:
+    def __init__(self) -> None:
+        self.locations: dict[int, tuple[str, int]] = {}
+        self.callee_saved: list[int] = []
+        self.slots = 0
+        self.spills = 0
+        self.has_calls = False
+
+
+# [start, end] of every virtual register, the instruction that writes
+# it to the last one that reads it. A register that's never read still
+# lives where it's written.
+def live_intervals(code: Code) -> dict[int, list[int]]:
+    intervals: dict[int, list[int]] = {}
+    for at, instruction in enumerate(code.instructions):
+        for arg in instruction.args:
+            intervals[arg][1] = at
+        if instruction.dest is not None:
+            intervals[instruction.dest] = [at, at]
+    return intervals
+
+
+def allocate(code: Code) -> Allocation:
+    allocation = Allocation()
+    intervals = live_intervals(code)
+    calls = [at for at, ins in enumerate(code.instructions) if ins.op == "call"]
+    allocation.has_calls = len(calls) > 0
+    # Alive on both sides of a call, so it has to be in a callee-saved
+    # register or on the stack.
+    crosses = {
+        register
+        for register, (start, end) in intervals.items()
+        if bisect_right(calls, start) < len(calls)
+        and calls[bisect_right(calls, start)] < end
+    }
+    params = {
+        ins.dest: ins.value for ins in code.instructions if ins.op == "param"
+    }
+
+    free_caller = list(CALLER_SAVED)
+    free_callee = list(CALLEE_SAVED)
+    # (end, virtual register) of everything holding a register now
+    active: list[tuple[int, int]] = []
+    used_callee: set[int] = set()
+
+    def release(register: int) -> None:
+        if register in CALLEE_SAVED:
+            free_callee.append(register)
+        else:
+            free_caller.append(register)
+
+    def spill(register: int) -> None:
+        allocation.locations[register] = ("slot", allocation.slots)
+        allocation.slots += 1
+        allocation.spills += 1
+
+    for register in sorted(intervals, key=lambda register: intervals[register][0]):
+        start, end = intervals[register]
+        # What's last read by the instruction that writes this one can
+        # give it its register, it's read before it's written.
+        while len(active) > 0 and active[0][0] <= start:
+            _, expired = active.pop(0)
+            release(allocation.locations[expired][1])
+
+        crossing = register in crosses
+        chosen: int | None = None
+        # Arguments stay where they came in, unless a call needs it.
+        hint = params.get(register)
+        if not crossing and hint is not None and hint in free_caller:
+            chosen = hint
+            free_caller.remove(hint)
+        elif not crossing and len(free_caller) > 0:
+            chosen = min(free_caller, key=CALLER_SAVED.index)
+            free_caller.remove(chosen)
+        elif len(free_callee) > 0:
+            chosen = min(free_callee)
+            free_callee.remove(chosen)
+        else:
+            # Take the register of whatever lives longest, if that's
+            # longer than this one and the register is one this can use.
+            candidates = [
+                (other_end, other)
+                for other_end, other in active
+                if not crossing or allocation.locations[other][1] in CALLEE_SAVED
+            ]
+            if len(candidates) > 0 and max(candidates)[0] > end:
+                _, victim = max(candidates)
+                chosen = allocation.locations[victim][1]
+                active.remove((intervals[victim][1], victim))
+                spill(victim)
+            else:
+                spill(register)
+                continue
+
+        if chosen in CALLEE_SAVED:
+            used_callee.add(chosen)
+        allocation.locations[register] = ("x", chosen)
+        insort(active, (end, register))
+
+    allocation.callee_saved = sorted(used_callee)
+    return allocation
+
+
+# Moves each (destination, source) register at once, as if all were
+# read before any was written, with x16 to break cycles.
+def parallel_move(moves: list[tuple[int, int]]) -> list[str]:
+    lines: list[str] = []
+    pending = [(dest, source) for dest, source in moves if dest != source]
+    while len(pending) > 0:
+        sources = {source for _, source in pending}
+        ready = next((move for move in pending if move[0] not in sources), None)
+        if ready is None:
+            dest, source = pending[0]
+            lines.append(f"mov x{SCRATCH[0]}, x{source}")
+            pending[0] = (dest, SCRATCH[0])
+            continue
+        pending.remove(ready)
+        lines.append(f"mov x{ready[0]}, x{ready[1]}")
+    return lines
+
+
+# AArch64 for `code` given where allocate() put everything. The frame
+# holds x29 and x30 when there's a call, then the callee-saved registers
+# used, then the spill slots.
+def emit(code: Code, allocation: Allocation) -> list[str]:
+    saved = ([29, 30] if allocation.has_calls else []) + allocation.callee_saved
+    slot_base = len(saved) * WORD
+    frame = slot_base + allocation.slots * WORD
+    frame = (frame + 15) // 16 * 16
+    locations = allocation.locations
+
+    # `op` (ldr or str) of `register` and spill slot `index`. Slots past
+    # what ldr and str reach from sp are addressed from `base` instead,
+    # which is set to sp plus all but the low 12 bits of the offset.
+    def slot(op: str, register: int, index: int, base: int) -> list[str]:
+        offset = slot_base + index * WORD
+        if offset <= MAX_OFFSET:
+            return [f"{op} x{register}, [sp, #{offset}]"]
+        lines = add_immediate("add", f"x{base}", "sp", offset & ~MAX_IMMEDIATE, base)
+        lines.append(f"{op} x{register}, [x{base}, #{offset & MAX_IMMEDIATE}]")
+        return lines
+
+    # Register name to read `register` from, loading it into `scratch`
+    # first when it was spilled.
+    def read(register: int, scratch: int, lines: list[str]) -> str:
+        kind, where = locations[register]
+        if kind == "x":
+            return f"x{where}"
+        lines.extend(slot("ldr", scratch, where, scratch))
+        return f"x{scratch}"
+
+    # Register name to write `register` to, and what stores it after.
+    def write(register: int) -> tuple[str, list[str]]:
+        kind, where = locations[register]
+        if kind == "x":
+            return (f"x{where}", [])
+        return (f"x{SCRATCH[0]}", slot("str", SCRATCH[0], where, SCRATCH[1]))
+
+    # The saved registers are at the bottom of the frame, at most twelve
+    # of them, well within what stp and ldp reach from sp.
+    lines: list[str] = []
+    if frame > 0:
+        lines.extend(add_immediate("sub", "sp", "sp", frame, SCRATCH[0]))
+        for idx in range(0, len(saved) - 1, 2):
+            lines.append(f"stp x{saved[idx]}, x{saved[idx + 1]}, [sp, #{idx * WORD}]")
+        if len(saved) % 2 == 1:
+            lines.append(f"str x{saved[-1]}, [sp, #{(len(saved) - 1) * WORD}]")
+        if allocation.has_calls:
+            # x29 points at the frame record it was just saved in.
+            lines.append("mov x29, sp")
+    epilogue: list[str] = []
+    if frame > 0:
+        for idx in range(0, len(saved) - 1, 2):
+            epilogue.append(f"ldp x{saved[idx]}, x{saved[idx + 1]}, [sp, #{idx * WORD}]")
+        if len(saved) % 2 == 1:
+            epilogue.append(f"ldr x{saved[-1]}, [sp, #{(len(saved) - 1) * WORD}]")
+        epilogue.extend(add_immediate("add", "sp", "sp", frame, SCRATCH[0]))
+
+    # Arguments moving out of x0-x7 into where they were given go first
+    # and all at once, none of them is the destination of another.
+    entry: list[tuple[int, int]] = []
+    for instruction in code.instructions:
+        if instruction.op != "param" or instruction.dest not in locations:
+            continue
+        kind, where = locations[instruction.dest]
+        if kind == "slot":
+            lines.extend(slot("str", instruction.value, where, SCRATCH[0]))
+        else:
+            entry.append((where, instruction.value))
+    lines.extend(parallel_move(entry))
+
+    for instruction in code.instructions:
+        op = instruction.op
+        if op == "param":
+            continue
+        elif op == "imm":
+            dest, store = write(instruction.dest)  # type: ignore
+            lines.extend(load_immediate(int(dest[1:]), instruction.value))
+            lines.extend(store)
+        elif op in ("add", "sub"):
+            left = read(instruction.args[0], SCRATCH[0], lines)
+            if len(instruction.args) == 1:
+                right = f"#{instruction.value}"
+            else:
+                right = read(instruction.args[1], SCRATCH[1], lines)
+            dest, store = write(instruction.dest)  # type: ignore
+            lines.append(f"{op} {dest}, {left}, {right}")
+            lines.extend(store)
+        elif op == "call":
+            if len(instruction.args) > ARGUMENT_REGISTERS:
+                raise Exception(
+                    f"{instruction.value} takes more than {ARGUMENT_REGISTERS} arguments"
+                )
+            moves: list[tuple[int, int]] = []
+            loads: list[str] = []
+            for idx, arg in enumerate(instruction.args):
+                kind, where = locations[arg]
+                if kind == "x":
+                    moves.append((idx, where))
+                else:
+                    loads.extend(slot("ldr", idx, where, idx))
+            lines.extend(parallel_move(moves))
+            lines.extend(loads)
+            lines.append(f"bl {instruction.value}")
+            kind, where = locations[instruction.dest]  # type: ignore
+            if kind == "slot":
+                lines.extend(slot("str", 0, where, SCRATCH[0]))
+            elif where != 0:
+                lines.append(f"mov x{where}, x0")
+        elif op == "ret":
+            kind, where = locations[instruction.args[0]]
+            if kind == "slot":
+                lines.extend(slot("ldr", 0, where, 0))
+            elif where != 0:
+                lines.append(f"mov x0, x{where}")
+            lines.extend(epilogue)
+            lines.append("ret")
+        else:
+            raise Exception(f"Unknown instruction {instruction}")
+    return lines
+
+
+def generate(name: str, code: Code) -> tuple[list[str], Allocation]:
+    allocation = allocate(code)
+    lines = emit(code, allocation)
+    tracing.codegen.debug(
+        lambda: f"{name}: {code.instructions}",
+        registers=code.registers,
+        spills=allocation.spills,
+        callee_saved=len(allocation.callee_saved),
+    )
+    return (lines, allocation)
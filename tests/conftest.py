@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The compiler's modules live at the top of the repository and import
+# each other by name, as boot.py does. v2's do the same from v2/, none
+# of their names are taken at the top.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "v2"))
@@ -0,0 +1,23 @@
+# Rewrites tests/lexer_expected.json from ast_1.Lexer, which needs
+# Python 3.12. Only for when the cases in test_lexer.py change, run
+# from the repository root:
+#
+#     python3.12 tests/record_lexer_expected.py
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ast_1 import Lexer  # noqa: E402
+from test_lexer import EXPECTED, encoded, expected_cases, lexed  # noqa: E402
+
+if __name__ == "__main__":
+    with open(EXPECTED, "w", encoding="utf-8") as file:
+        file.write("{\n")
+        lines = [
+            f"{json.dumps(name)}: {json.dumps(encoded(lexed(Lexer, source)), ensure_ascii=False)}"
+            for name, source in expected_cases().items()
+        ]
+        file.write(",\n".join(lines))
+        file.write("\n}\n")
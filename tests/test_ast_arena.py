@@ -0,0 +1,64 @@
+from ast_arena import KINDS, ArenaVisitor, AstArena
+from ast_exprs import Literal, Parenthesized
+
+PARENTHESIZED = KINDS.index(Parenthesized)
+LITERAL = KINDS.index(Literal)
+
+
+# Lists of lists, `depth` deep, each level also holding a literal.
+def nested(depth: int) -> AstArena:
+    arena = AstArena()
+    node = arena.node(LITERAL, 0, [])
+    for level in range(1, depth):
+        node = arena.node(PARENTHESIZED, None, [arena.node(LITERAL, level, []), node])
+    arena.roots.append(node)
+    arena.roots.append(arena.node(LITERAL, -1, []))
+    return arena
+
+
+class Recorder(ArenaVisitor):
+    def __init__(self, arena: AstArena) -> None:
+        super().__init__(arena)
+        self.seen: list[int] = []
+
+    def generic_visit(self, node: int) -> None:
+        self.seen.append(node)
+        super().generic_visit(node)
+
+
+def test_visits_deep_trees_in_walk_order() -> None:
+    arena = nested(5000)
+    visitor = Recorder(arena)
+    visitor.visit_all()
+    assert visitor.seen == [node for node, _ in arena.walk()]
+
+
+class Literals(Recorder):
+    def __init__(self, arena: AstArena) -> None:
+        super().__init__(arena)
+        self.values: list[tuple[int, int]] = []
+
+    def visit_Literal(self, node: int) -> None:
+        self.values.append((self.arena.get_payload(node), len(self.seen)))
+
+    # Visits the nested list before the literal next to it, which
+    # has to be done by the time visit() returns.
+    def visit_Parenthesized(self, node: int) -> None:
+        value, inner = self.arena.children(node)
+        self.visit(inner)
+        self.values.append((-2, len(self.seen)))
+        self.visit(value)
+
+
+def test_nested_visit_finishes_before_returning() -> None:
+    arena = nested(3)
+    visitor = Literals(arena)
+    visitor.visit_all()
+    assert visitor.values == [(0, 0), (-2, 0), (1, 0), (-2, 0), (2, 0), (-1, 0)]
+
+
+def test_generic_visit_outside_visit() -> None:
+    arena = nested(4)
+    visitor = Recorder(arena)
+    visitor.generic_visit(arena.roots[0])
+    assert visitor.seen == [node for node, _ in arena.walk(arena.roots[0])]
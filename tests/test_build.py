@@ -0,0 +1,19 @@
+import json
+import os
+
+from build import MANIFEST, Build
+
+
+def test_only_lambdas_are_global(tmp_path) -> None:
+    (tmp_path / "a.dal").write_text("d'T :: A | B int\nf\\ T, int :: T\n")
+    (tmp_path / "b.dal").write_text("g\\ T :: int\nf A 1\n")
+    output = str(tmp_path / "build")
+    build = Build([str(tmp_path / "a.dal"), str(tmp_path / "b.dal")], output, workers=1)
+    assert build.run(), build.diagnostics
+
+    lines = open(build.output_path(str(tmp_path / "a.dal"))).read().splitlines()
+    assert ".global f" in lines
+    assert ".global T" not in lines
+    files = json.load(open(os.path.join(output, MANIFEST)))["files"]
+    assert files[str(tmp_path / "a.dal")]["exports"] == ["f"]
+    assert files[str(tmp_path / "b.dal")]["uses"] == {str(tmp_path / "a.dal"): ["T", "f"]}
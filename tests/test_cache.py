@@ -0,0 +1,103 @@
+import os
+import re
+import struct
+
+import cache
+from ast_1 import Parser
+from cache import ParseCache
+from lexer import TableLexer
+
+SOURCE = "".join(
+    f"d'P{i} :: int float str | Q{i} | R{i} int\n"
+    f"f{i}\\ P{i}, int, (\\ :: int) :: P{i}\n"
+    f'asm ["mov x0, #{i}", "ret"]\n'
+    f"{i} + 2 - 3 + {i}\n"
+    f"[<+{'>' * (i % 3)}]\\ int, int :: int\n"
+    for i in range(20)
+)
+
+
+def tokens(source: str = SOURCE) -> list:
+    lexer = TableLexer(source)
+    lexer.lex_all()
+    return lexer.results
+
+
+def parse(source: str = SOURCE) -> Parser:
+    parser = Parser(tokens(source))
+    parser.parse_all()
+    return parser
+
+
+# Objects print with their address, which differs between the two.
+def shown(value) -> str:
+    return re.sub(r" at 0x[0-9a-f]+", "", repr(value))
+
+
+def test_round_trip(tmp_path) -> None:
+    parsed = parse()
+    parse_cache = ParseCache(str(tmp_path))
+    key = parse_cache.key(parsed.input)
+    assert not parse_cache.load(key, Parser(tokens()))
+    parse_cache.store(key, parsed)
+
+    # Comments and whitespace don't change the key.
+    edited = tokens("// a comment\n" + SOURCE.replace("\n", "  \n"))
+    assert parse_cache.key(edited) == key
+    loaded = Parser(edited)
+    assert parse_cache.load(key, loaded)
+    assert shown(loaded.results) == shown(parsed.results)
+    assert shown(loaded.symbol_tables) == shown(parsed.symbol_tables)
+    assert loaded.operators == parsed.operators
+    assert loaded.tag == parsed.tag
+    assert loaded.at == len(loaded.input)
+
+
+def test_other_compiler_misses(tmp_path, monkeypatch) -> None:
+    parsed = parse()
+    parse_cache = ParseCache(str(tmp_path))
+    key = parse_cache.key(parsed.input)
+    parse_cache.store(key, parsed)
+    monkeypatch.setattr(cache, "_compiler_hash", b"another compiler")
+    other_key = parse_cache.key(parsed.input)
+    assert other_key != key
+    assert not parse_cache.load(other_key, Parser(tokens()))
+
+
+def test_other_format_version_is_removed(tmp_path, monkeypatch) -> None:
+    parsed = parse()
+    parse_cache = ParseCache(str(tmp_path))
+    key = parse_cache.key(parsed.input)
+    parse_cache.store(key, parsed)
+    header = cache.MAGIC + struct.pack("<H", cache.FORMAT_VERSION + 1)
+    monkeypatch.setattr(cache, "HEADER", header)
+    assert not parse_cache.load(key, Parser(tokens()))
+    assert not os.path.exists(parse_cache.path(key))
+
+
+def test_broken_entry_is_removed(tmp_path) -> None:
+    parsed = parse()
+    parse_cache = ParseCache(str(tmp_path))
+    key = parse_cache.key(parsed.input)
+    parse_cache.store(key, parsed)
+    with open(parse_cache.path(key), "r+b") as file:
+        file.truncate(len(cache.HEADER) + 10)
+    assert not parse_cache.load(key, Parser(tokens()))
+    assert not os.path.exists(parse_cache.path(key))
+
+
+def test_least_recently_used_is_evicted(tmp_path) -> None:
+    parse_cache = ParseCache(str(tmp_path))
+    sources = [SOURCE, SOURCE + "1 + 1\n", SOURCE + "2 + 2\n"]
+    keys = []
+    for age, source in enumerate(sources):
+        parsed = parse(source)
+        keys.append(parse_cache.key(parsed.input))
+        parse_cache.store(keys[-1], parsed)
+        os.utime(parse_cache.path(keys[-1]), (age, age))
+    # Loading the oldest counts as a use.
+    assert parse_cache.load(keys[0], Parser(tokens()))
+    size = os.path.getsize(parse_cache.path(keys[0]))
+    parse_cache.max_bytes = 2 * size + size // 2
+    parse_cache.evict()
+    assert [os.path.exists(parse_cache.path(key)) for key in keys] == [True, False, True]
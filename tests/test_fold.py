@@ -0,0 +1,151 @@
+import random
+
+from asm import ASM
+from ast_exprs import (
+    Assignment,
+    BinaryOperation,
+    Identifier,
+    Lambda,
+    Literal,
+    Parenthesized,
+    Reference,
+    ScopeArena,
+    primitive_type,
+)
+from common import PrimitiveTypes
+from fold import WORD_MASK, Folder
+
+INT = primitive_type(PrimitiveTypes.INT)
+
+
+# A lambda `f` taking a and b, and a constant lambda `k` returning
+# 2 - 5, as the parser would declare them.
+class Program:
+    def __init__(self) -> None:
+        self.arena = ScopeArena()
+        self.globals = self.arena.new()
+        self.k_table = self.arena.new(self.globals.id)
+        self.k_table.insert("ret", INT)
+        self.f_table = self.arena.new(self.globals.id)
+        self.a = self.f_table.insert("a", INT)
+        self.b = self.f_table.insert("b", INT)
+        self.f_table.insert("ret", INT)
+        self.k = Lambda(self.k_table, sub(lit(2), lit(5)), self.globals.id, 0)
+        self.globals.insert("k", self.k)
+
+    def ra(self) -> Reference:
+        return Reference("a", self.f_table.id, self.a.id)
+
+    def rb(self) -> Reference:
+        return Reference("b", self.f_table.id, self.b.id)
+
+    def rk(self) -> Reference:
+        return Reference("k", self.globals.id, 0, copy_val=True)
+
+    def with_f(self, body) -> list:
+        f = Lambda(self.f_table, body, self.globals.id, 1)
+        self.globals.insert("f", f)
+        return [Assignment(Identifier("k"), self.k), Assignment(Identifier("f"), f)]
+
+
+def lit(value: int) -> Literal:
+    return Literal(INT, value)
+
+
+def add(left, right) -> BinaryOperation:
+    return BinaryOperation("+", left, right)
+
+
+def sub(left, right) -> BinaryOperation:
+    return BinaryOperation("-", left, right)
+
+
+# The tree as text, references by name.
+def show(expr) -> str:
+    if isinstance(expr, Literal):
+        return str(expr.val)
+    elif isinstance(expr, Reference):
+        return expr.name
+    elif isinstance(expr, Parenthesized):
+        return f"({show(expr.inner)})"
+    return f"({show(expr.left)} {expr.operator} {show(expr.right)})"
+
+
+def evaluate(expr, env: dict[str, int]) -> int:
+    if isinstance(expr, Literal):
+        return expr.val & WORD_MASK
+    elif isinstance(expr, Reference):
+        return env[expr.name]
+    elif isinstance(expr, Parenthesized):
+        return evaluate(expr.inner, env)
+    left, right = evaluate(expr.left, env), evaluate(expr.right, env)
+    return (left + right if expr.operator == "+" else left - right) & WORD_MASK
+
+
+def test_sums() -> None:
+    p = Program()
+    folder = Folder()
+    x, y = p.ra(), p.rb()
+    assert show(folder.fold(add(sub(add(add(add(x, lit(1)), lit(2)), y), y), lit(0)))) == "(a + 3)"
+    assert show(folder.fold(sub(add(lit(2), lit(3)), lit(5)))) == "0"
+    assert show(folder.fold(add(lit(1), Parenthesized(INT, add(x, lit(2)))))) == "(a + 3)"
+
+
+# A negative constant is a small literal taken away, never one near
+# 2^64 that needs four instructions to load.
+def test_negative_constants_stay_small() -> None:
+    p = Program()
+    folder = Folder()
+    assert show(folder.fold(sub(lit(2), lit(5)))) == "(0 - 3)"
+    assert show(folder.fold(sub(lit(0), Parenthesized(INT, add(p.ra(), lit(3)))))) == "((0 - a) - 3)"
+    assert show(folder.fold(sub(lit(7), p.ra()))) == "(7 - a)"
+    assert show(folder.fold(sub(p.ra(), lit(5)))) == "(a - 5)"
+
+
+def test_cancel() -> None:
+    p = Program()
+    folder = Folder()
+    assert show(folder.fold(sub(p.ra(), p.ra()))) == "0"
+    assert show(folder.fold(sub(add(p.ra(), p.rb()), p.ra()))) == "b"
+    assert show(folder.fold(sub(add(p.ra(), p.ra()), p.ra()))) == "a"
+    # Calls could do anything, they're never cancelled.
+    assert show(folder.fold(sub(p.rk(), p.rk()))) == "(k - k)"
+
+
+def test_wraparound() -> None:
+    folder = Folder()
+    assert show(folder.fold(add(lit(WORD_MASK), lit(1)))) == "0"
+    assert show(folder.fold(add(lit(1 << 63), lit(1 << 63)))) == "0"
+    assert show(folder.fold(sub(lit(0), lit(WORD_MASK)))) == "1"
+
+
+def test_random_sums_keep_their_value() -> None:
+    p = Program()
+    rng = random.Random(7)
+
+    def generate(depth: int):
+        if depth == 0 or rng.random() < 0.3:
+            return rng.choice(
+                [lambda: lit(rng.choice([0, 1, 5, 1 << 63, WORD_MASK, rng.randrange(1 << 64)])), p.ra, p.rb]
+            )()
+        expr = rng.choice([add, sub])(generate(depth - 1), generate(depth - 1))
+        return Parenthesized(INT, expr) if rng.random() < 0.2 else expr
+
+    for _ in range(500):
+        expr = generate(6)
+        env = {"a": rng.randrange(1 << 64), "b": rng.randrange(1 << 64)}
+        assert evaluate(Folder().fold(expr), env) == evaluate(expr, env)
+
+
+# The parser can't parse a lambda with a body yet, so bindings only
+# come from trees like this one. k folds to a constant, and using it
+# in f puts the constant in its place.
+def test_constant_bindings() -> None:
+    p = Program()
+    folder = Folder()
+    program = folder.fold_all(p.with_f(add(p.ra(), p.rk())))
+    assert show(program[0].right.body) == "(0 - 3)"
+    assert show(program[1].right.body) == "(a - 3)"
+    code = ASM(program, p.arena)
+    code.generate_all()
+    assert not any(line.strip().startswith("movk") for line in code.lines)
@@ -0,0 +1,251 @@
+import json
+import os
+import random
+import sys
+
+import pytest
+
+from ast_1 import Lexer
+from lexer import IncrementalLexer, TableLexer, lex_chunk
+import lex as v2_lex
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# What ast_1.Lexer makes of PROGRAMS, EDGE_CASES and the generated
+# inputs in expected_cases(), written by tests/record_lexer_expected.py.
+EXPECTED = os.path.join(ROOT, "tests", "lexer_expected.json")
+PROGRAMS = ["boot.dal", "simple.dal", "v2/test.v2.dal"]
+EDGE_CASES = ['"unterminated \\', 'a"b', "x // c", "", "\n\n"]
+EXPECTED_SEEDS = 20
+EXPECTED_PIECES = 300
+
+# ast_1.Lexer checks `c in TT` on plain strings, which only Python 3.12's
+# enums allow. Elsewhere TableLexer is checked against what it made.
+needs_old_lexer = pytest.mark.skipif(
+    sys.version_info < (3, 12), reason="ast_1.Lexer needs Python 3.12"
+)
+
+PIECES = [
+    "foo", "bar_baz", "x1", "d'", "t'", "m'", "::", ":", "→", "+", "-",
+    "(", ")", "[", "]", "{", "}", "=", "|", ">", "_", "\\", ",", "12",
+    "3.25", ".5", '"str"', '"es\\"c\\\\a\\npe"', "// comment here\n", "\n",
+    " ", "/", "ünï", "١٢", "[>>=]", ">>=", ">>=>>", "a>>=b", "<", "<<",
+    "=>", "[<*>]", "<*>", "[→→]", "→→→", "-->",
+]
+
+
+# Random source made of tokens, operator declarations and the odd
+# things the old lexer has to agree on, comments, escapes and numbers.
+def generate(pieces: int, seed: int) -> str:
+    rng = random.Random(seed)
+    return "".join(
+        rng.choice(PIECES) + rng.choice([" ", " ", "\n"]) for _ in range(pieces)
+    )
+
+
+# What each lexer produced, or the error it stopped with.
+def lexed(lexer_type, source: str):
+    lexer = lexer_type(source)
+    try:
+        lexer.lex_all()
+    except Exception as e:
+        return ("error", type(e))
+    return [(token.ty, token.prim_ty, token.val) for token in lexer.results]
+
+
+def read(name: str) -> str:
+    with open(os.path.join(ROOT, name), encoding="utf-8") as file:
+        return file.read()
+
+
+# name -> source of every case in EXPECTED.
+def expected_cases() -> dict[str, str]:
+    cases = {name: read(name) for name in PROGRAMS}
+    for seed in range(EXPECTED_SEEDS):
+        cases[f"seed {seed}"] = generate(EXPECTED_PIECES, seed)
+    for source in EDGE_CASES:
+        cases[f"edge {source!r}"] = source
+    return cases
+
+
+# lexed() as JSON can have it: enums by name, errors by type name.
+def encoded(result) -> list | str:
+    if isinstance(result, tuple):
+        return result[1].__name__
+    return [
+        [ty.name, None if prim_ty is None else prim_ty.name, val]
+        for ty, prim_ty, val in result
+    ]
+
+
+def load_expected() -> dict:
+    with open(EXPECTED, encoding="utf-8") as file:
+        return json.load(file)
+
+
+@pytest.mark.parametrize("name", list(expected_cases()))
+def test_matches_expected(name: str) -> None:
+    source = expected_cases()[name]
+    assert encoded(lexed(TableLexer, source)) == load_expected()[name]
+
+
+# The file is still what ast_1.Lexer makes.
+@needs_old_lexer
+def test_expected_is_old_lexer_output() -> None:
+    expected = load_expected()
+    for name, source in expected_cases().items():
+        assert encoded(lexed(Lexer, source)) == expected[name], name
+
+
+@needs_old_lexer
+@pytest.mark.parametrize("name", PROGRAMS)
+def test_parity_on_programs(name: str) -> None:
+    source = read(name)
+    assert lexed(TableLexer, source) == lexed(Lexer, source)
+
+
+@needs_old_lexer
+@pytest.mark.parametrize("seed", range(20))
+def test_parity_on_generated_input(seed: int) -> None:
+    source = generate(2000, seed)
+    assert lexed(TableLexer, source) == lexed(Lexer, source)
+
+
+@needs_old_lexer
+@pytest.mark.parametrize("source", EDGE_CASES)
+def test_parity_on_edge_cases(source: str) -> None:
+    assert lexed(TableLexer, source) == lexed(Lexer, source)
+
+
+# v2's lexer runs on the same PatternLexer with its own pattern and
+# tokens, and has to keep agreeing with its character at a time Lexer.
+V2_PIECES = [
+    "foo", "bar_baz", "x1", "d'", "t'", "m'", "::", ":", "→", "+", "-",
+    "(", ")", "[", "]", "{", "}", "=", "|", ">", "<", "_", "\\", ",",
+    "12", "3.25", '"str"', '"es\\"c"', "// comment here\n", "\n", " ",
+]
+
+
+def generate_v2(pieces: int, seed: int) -> str:
+    rng = random.Random(seed)
+    return "".join(
+        rng.choice(V2_PIECES) + rng.choice([" ", " ", "\n"]) for _ in range(pieces)
+    )
+
+
+@needs_old_lexer
+@pytest.mark.parametrize("seed", range(5))
+def test_v2_parity(seed: int) -> None:
+    source = read("v2/test.v2.dal") if seed == 0 else generate_v2(2000, seed)
+    assert lexed(v2_lex.TableLexer, source) == lexed(v2_lex.Lexer, source)
+
+
+def test_v2_positions_and_parallel() -> None:
+    source = read("v2/test.v2.dal")
+    lexer = v2_lex.TableLexer(source)
+    lexer.lex_all()
+    assert lexer.results[0].ty is v2_lex.TT.PRIME_FORM
+    assert lexer.line_col(0) == (2, 1)
+    source = generate_v2(5000, 7)
+    expected = lexed(v2_lex.TableLexer, source)
+    for workers in (2, 3):
+        parallel = v2_lex.TableLexer(source)
+        parallel.lex_parallel(workers)
+        assert [(t.ty, t.prim_ty, t.val) for t in parallel.results] == expected
+
+
+# Text IncrementalLexer edits insert: strings and comments that open or
+# close across the edit, operator declarations and a character that
+# doesn't lex at all.
+EDITS = PIECES + ['"', '"\n', "//", "\n", "[<+>]\\", "<+>", "#", "\\\\", ""]
+
+
+def spans(pairs) -> list:
+    return [(token.ty, token.prim_ty, token.val, start, end) for token, start, end in pairs]
+
+
+# After every random edit, tokens and spans are what lexing the edited
+# input from scratch gives, and edit()'s return value says how to patch
+# the old stream into the new one.
+@pytest.mark.parametrize("seed", range(10))
+def test_incremental_matches_full_relex(seed: int) -> None:
+    rng = random.Random(seed)
+    source = read("boot.dal") if seed == 0 else generate(200, seed)
+    incremental = IncrementalLexer(source)
+    for _ in range(300):
+        before = incremental.input
+        old = spans(incremental.spans())
+        offset = rng.randrange(len(before) + 1)
+        deleted = min(rng.choice([0, 0, 1, 2, 5, 20]), len(before) - offset)
+        inserted = rng.choice(EDITS)
+        edited = before[:offset] + inserted + before[offset + deleted :]
+        try:
+            expected = spans(TableLexer(edited).scan())
+        except Exception:
+            with pytest.raises(Exception):
+                incremental.edit(offset, deleted, inserted)
+            assert incremental.input == before
+            assert spans(incremental.spans()) == old
+            continue
+        first, removed, added = incremental.edit(offset, deleted, inserted)
+        assert incremental.input == edited
+        assert spans(incremental.spans()) == expected
+        assert [token for token, _, _ in incremental.spans()] == incremental.results
+        tokens = [span[:3] for span in expected]
+        patched = [span[:3] for span in old[:first]] + tokens[first : first + added]
+        assert patched + [span[:3] for span in old[first + removed :]] == tokens
+
+
+# Generated input with strings and comments running over several lines,
+# so chunk boundaries, which are always after a newline, fall inside
+# them.
+SPANNING = PIECES + [
+    '"two\nlines"', '"\n\n"', '"// not a comment\n"', '// "not a string\n',
+    '"a\n[<+>]\\ \nb"', '"es\\"c\n\\\\"',
+]
+
+
+def generate_spanning(pieces: int, seed: int) -> str:
+    rng = random.Random(seed)
+    return "".join(
+        rng.choice(SPANNING) + rng.choice([" ", "\n"]) for _ in range(pieces)
+    )
+
+
+def fields(tokens) -> list:
+    return [(token.ty, token.prim_ty, token.val) for token in tokens]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_lex_parallel_matches_lex_all(seed: int) -> None:
+    source = generate_spanning(5000, seed) + '"runs to the end\n\n'
+    expected = lexed(TableLexer, source)
+    for workers in (2, 3, 4, 7):
+        lexer = TableLexer(source)
+        lexer.lex_parallel(workers)
+        assert fields(lexer.results) == expected, workers
+
+
+# merge_chunks with a chunk starting on every line, which lex_parallel
+# only does for inputs as short as its worker count.
+@pytest.mark.parametrize(
+    "source",
+    [
+        generate_spanning(300, 10),
+        '"\n\n\n"\nx\n',
+        '"a\n#\nb"\n',
+        '// "\n"\nx\n"\n',
+        'a\n"b\nc\nd\n',
+        "a\n#\nb\n",
+    ],
+)
+def test_merge_chunks_at_every_line(source: str) -> None:
+    expected = lexed(TableLexer, source)
+    starts = [0] + [at + 1 for at, c in enumerate(source) if c == "\n" and at + 1 < len(source)]
+    bounds = list(zip(starts, starts[1:] + [len(source)]))
+    lexer = TableLexer(source)
+    chunks = [lex_chunk(lexer.pattern, source[start:end]) for start, end in bounds]
+    try:
+        merged = fields(lexer.merge_chunks(bounds, chunks))
+    except Exception as e:
+        merged = ("error", type(e))
+    assert merged == expected
@@ -0,0 +1,129 @@
+from itertools import product
+
+from exprs import DataTypeDefinition
+from lex import TableLexer
+from matching import Binder, Constructor, MatchCompiler, index_lambdas, select
+from mkast import Parser
+from mono import variants_of
+
+TYPES = "d'A :: A1 | A2 Int\nd'B :: B1 | B2 | B3\n"
+
+
+def compile(source: str):
+    lexer = TableLexer(source)
+    lexer.lex_all()
+    parser = Parser(lexer.results, locate=lexer.line_col)
+    parser.parse_all()
+    assert parser.diagnostics == []
+    compiler = MatchCompiler(
+        (expr for expr in parser.results if isinstance(expr, DataTypeDefinition)),
+        locate=lexer.line_col,
+    )
+    groups = index_lambdas(parser.results)
+    trees = {name: compiler.compile(group) for name, group in groups.items()}
+    return compiler, groups, trees
+
+
+def messages(compiler: MatchCompiler) -> list[str]:
+    return [diagnostic.message for diagnostic in compiler.diagnostics]
+
+
+# Without a declared type the first constructor used decides it, in
+# either order, and the clause with another type's constructor is
+# reported and left out rather than indexing the wrong cases.
+def test_mixed_types_without_declaration() -> None:
+    compiler, _, trees = compile(TYPES + "f\\A1 → ()\nf\\B3 → ()\n")
+    assert repr(trees["f"]) == "Switch((0,), A, [Leaf(0, {}), Fail])"
+    assert "B3 is a constructor of B, not A" in messages(compiler)
+
+    compiler, _, trees = compile(TYPES + "f\\B3 → ()\nf\\A1 → ()\n")
+    assert repr(trees["f"]) == "Switch((0,), B, [Fail, Fail, Leaf(0, {})])"
+    assert "A1 is a constructor of A, not B" in messages(compiler)
+
+
+# The same for a field whose type is a type parameter.
+def test_mixed_types_in_generic_field() -> None:
+    compiler, _, trees = compile(
+        "d'Box a :: Box a\n" + TYPES + "f\\Box A1 → ()\nf\\Box B3 → ()\nf\\Box x → ()\n"
+    )
+    assert select(trees["f"], [(0, [(0, [])])]) == (0, {})
+    assert select(trees["f"], [(0, [(1, [5])])]) == (2, {"x": (1, [5])})
+    assert messages(compiler) == ["B3 is a constructor of B, not A"]
+
+
+# A constructor of another type isn't a binder named after it, which
+# would catch everything and hide the clauses after it.
+def test_wrong_type_constructor() -> None:
+    compiler, _, trees = compile(TYPES + "f\\A :: ()\nf\\B1 → ()\nf\\A1 → ()\nf\\A2 x → ()\n")
+    assert messages(compiler) == ["B1 is a constructor of B, not A"]
+    assert select(trees["f"], [(0, [])]) == (1, {})
+    assert select(trees["f"], [(1, [7])]) == (2, {"x": 7})
+
+
+def test_unused_and_missing_clauses() -> None:
+    compiler, _, _ = compile(TYPES + "f\\B :: ()\nf\\x → ()\nf\\B1 → ()\n")
+    assert messages(compiler) == [
+        "Clause 2 of f is never used, the clauses before it match everything it does"
+    ]
+    compiler, _, _ = compile(TYPES + "f\\B :: ()\nf\\B1 → ()\n")
+    assert messages(compiler) == [
+        "Not every case of f has a clause, nothing matches B2, B3"
+    ]
+
+
+# Every value of `definition` nesting at most `depth` constructors deep,
+# as select() takes them.
+def values(compiler: MatchCompiler, definition: DataTypeDefinition, depth: int) -> list:
+    if depth == 0:
+        return []
+    made = []
+    for tag, (_, fields) in enumerate(variants_of(definition)):
+        choices = []
+        for field in fields:
+            field_type = compiler.type_of(field)
+            choices.append([0] if field_type is None else values(compiler, field_type, depth - 1))
+        made.extend((tag, list(args)) for args in product(*choices))
+    return made
+
+
+# The first clause whose patterns all match, the way the clauses read.
+def first_match(compiler: MatchCompiler, group, arguments: list):
+    types = [compiler.type_of(ty) for ty in group.definition.parameter_types]
+    for index, clause in enumerate(group.clauses):
+        bindings: dict[str, object] = {}
+        patterns = [compiler.pattern(p, ty) for p, ty in zip(clause.patterns, types)]
+        if all(matches(p, value, bindings) for p, value in zip(patterns, arguments)):
+            return (index, bindings)
+    return None
+
+
+def matches(pattern, value, bindings: dict[str, object]) -> bool:
+    if isinstance(pattern, Binder):
+        if pattern.name is not None:
+            bindings[pattern.name] = value
+        return True
+    assert isinstance(pattern, Constructor)
+    tag, fields = value
+    return tag == pattern.tag and all(
+        matches(arg, field, bindings) for arg, field in zip(pattern.args, fields)
+    )
+
+
+def test_select_agrees_with_first_match() -> None:
+    compiler, groups, trees = compile(
+        "d'E :: Lit Int | Neg E | Add E E\n"
+        "f\\E, E :: ()\n"
+        "f\\Neg (Neg a), b → ()\n"
+        "f\\Add (Lit n) r, Lit m → ()\n"
+        "f\\a, Neg (Add x y) → ()\n"
+        "f\\Add l r, b → ()\n"
+        "f\\Lit n, Lit m → ()\n"
+    )
+    group = groups["f"]
+    expr_type = compiler.definitions["E"]
+    every = values(compiler, expr_type, 3)
+    assert len(every) == 13
+    for arguments in product(every, repeat=2):
+        assert select(trees["f"], list(arguments)) == first_match(
+            compiler, group, list(arguments)
+        ), arguments
@@ -0,0 +1,62 @@
+from exprs import DataTypeDefinition
+from lex import TableLexer
+from mkast import Parser
+from mono import BOXED, WORD, Monomorphizer
+from shared import PrimitiveTypes
+
+SOURCE = (
+    "d'List a :: Nil | Cons a (List a)\n"
+    "d'Pair a b :: (Pair a b)\n"
+    "d'Nest a :: Leaf | Node a (Nest (Pair a a))\n"
+)
+
+
+def monomorphizer(**kwargs) -> Monomorphizer:
+    lexer = TableLexer(SOURCE)
+    lexer.lex_all()
+    parser = Parser(lexer.results)
+    parser.parse_all()
+    return Monomorphizer(
+        (expr for expr in parser.results if isinstance(expr, DataTypeDefinition)),
+        **kwargs,
+    )
+
+
+def test_instances_are_interned_and_laid_out_once() -> None:
+    mono = monomorphizer()
+    list_type = mono.definitions["List"]
+    int_type = mono.type_instance(PrimitiveTypes.INT)
+    list_int = mono.type_instance(list_type, [int_type])
+    assert mono.type_instance(list_type, [int_type]) is list_int
+    assert mono.type_instance(list_type, [mono.type_instance(PrimitiveTypes.STR)]) is not list_int
+
+    layout = mono.instantiate(list_int)
+    assert [variant.name for variant in layout.variants] == ["Nil", "Cons"]
+    # Tag, the Int inline, then the pointer to the rest.
+    cons = layout.variants[1]
+    assert [field.offset for field in cons.fields] == [WORD, 2 * WORD]
+    assert layout.size == 3 * WORD
+    assert mono.instantiate(list_int) is layout
+    assert mono.hits == 1
+
+
+def test_instances_are_per_monomorphizer() -> None:
+    first, second = monomorphizer(), monomorphizer()
+    assert first.type_instance(PrimitiveTypes.INT) is not second.type_instance(PrimitiveTypes.INT)
+    assert first.type_instance(first.definitions["List"], [BOXED]) is not BOXED
+
+
+# Nest makes a new instance with every level, the limit stops it and
+# the rest share the boxed layout.
+def test_polymorphic_recursion_falls_back_to_boxed() -> None:
+    mono = monomorphizer(limit=8)
+    nest = mono.type_instance(
+        mono.definitions["Nest"], [mono.type_instance(PrimitiveTypes.INT)]
+    )
+    layout = mono.instantiate(nest)
+    assert not layout.boxed
+    assert mono.counts[mono.definitions["Nest"]] == 8
+    assert any(layout.boxed for layout in mono.layouts.values())
+    uniform = mono.uniform(mono.definitions["Nest"])
+    assert mono.layouts[uniform].boxed
+    assert all(field.size == WORD for variant in mono.layouts[uniform].variants for field in variant.fields)
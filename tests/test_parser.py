@@ -0,0 +1,63 @@
+import pytest
+
+from ast_1 import Parser
+from benchmarks.parse_chains import CHAINS
+from lexer import TableLexer
+
+
+# Parser that fails as soon as it moves back in the input and counts
+# the rules it runs.
+class ForwardParser(Parser):
+    def __init__(self, *args, **kwargs) -> None:
+        self.rules = 0
+        super().__init__(*args, **kwargs)
+
+    @property
+    def at(self) -> int:
+        return self._at
+
+    @at.setter
+    def at(self, value: int) -> None:
+        assert value >= getattr(self, "_at", 0), f"rewound from {self._at} to {value}"
+        self._at = value
+
+    def parse_rule(self, *args, **kwargs):
+        self.rules += 1
+        return super().parse_rule(*args, **kwargs)
+
+
+def parse(source: str) -> ForwardParser:
+    lexer = TableLexer(source)
+    lexer.lex_all()
+    parser = ForwardParser(lexer.results)
+    parser.parse_all()
+    return parser
+
+
+# The inputs that used to make the parser go back and parse again.
+@pytest.mark.parametrize("name", CHAINS)
+def test_rules_grow_linearly(name: str) -> None:
+    small = parse(CHAINS[name](500))
+    large = parse(CHAINS[name](4000))
+    assert large.rules <= 8 * small.rules + 8
+    assert large.rules <= 4 * len(large.input)
+
+
+# Equal type instances are one object within a parse, and a parse
+# doesn't hand out (or keep alive) another one's.
+def test_type_instances_are_interned_per_parse() -> None:
+    source = "t'Box a {\n    f\\ Box int, Box a, Box int :: Box a\n}\n"
+
+    def instances(parser: Parser) -> list:
+        return list(parser.symbol_tables.type_instances.values())
+
+    parsers = []
+    for _ in range(2):
+        lexer = TableLexer(source)
+        lexer.lex_all()
+        parser = Parser(lexer.results, recover=True)
+        parser.parse_all()
+        parsers.append(parser)
+    first, second = map(instances, parsers)
+    assert len(first) == len(second) == 2
+    assert not any(ty is other for ty in first for other in second)
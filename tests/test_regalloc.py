@@ -0,0 +1,43 @@
+import re
+
+import pytest
+
+from regalloc import MAX_IMMEDIATE, MAX_OFFSET, Code, allocate, emit
+
+
+# `count` immediates all live at once, then added up, so almost every
+# one of them is spilled. With `call` the sum goes through a bl first.
+def emit_live_immediates(count: int, call: bool = False) -> list[str]:
+    code = Code()
+    registers = [code.add("imm", value=value) for value in range(count)]
+    total = registers[0]
+    for register in registers[1:]:
+        total = code.add("add", [total, register])
+    if call:
+        total = code.add("call", [total], value="f")
+    code.add("ret", [total], dest=False)
+    return emit(code, allocate(code))
+
+
+@pytest.mark.parametrize("count", [10, 700, 5000])
+def test_frame_and_slots_are_encodable(count: int) -> None:
+    lines = emit_live_immediates(count)
+    for line in lines:
+        for offset in re.findall(r"\[(?:sp|x\d+), #(\d+)\]", line):
+            assert int(offset) <= MAX_OFFSET and int(offset) % 8 == 0, line
+        if match := re.fullmatch(r"(?:add|sub) \w+, \w+, #(\d+)(, lsl #12)?", line):
+            assert int(match[1]) <= MAX_IMMEDIATE, line
+    # Whatever the prologue takes off sp the epilogue puts back.
+    frame = 0
+    for line in lines:
+        if match := re.fullmatch(r"(add|sub) sp, sp, #(\d+)(, lsl #12)?", line):
+            amount = int(match[2]) << (12 if match[3] else 0)
+            frame += amount if match[1] == "sub" else -amount
+    assert frame == 0
+
+
+def test_frame_pointer_set_when_calling() -> None:
+    lines = emit_live_immediates(700, call=True)
+    stp = lines.index("stp x29, x30, [sp, #0]")
+    assert "mov x29, sp" in lines[stp + 1 : stp + 8]
+    assert "mov x29, sp" not in emit_live_immediates(700)
@@ -0,0 +1,68 @@
+import pickle
+
+from ast_1 import Parser
+from ast_exprs import ScopeArena, TypeInstance, load_interned, primitive_type
+from cache import ParseCache
+from common import PrimitiveTypes
+from lexer import TableLexer
+
+# Type class members are the only place the parser makes TypeInstances.
+# The closing brace doesn't parse yet, hence recover.
+SOURCE = "t'Box a {\n    f\\ Box int, Box a :: Box int\n    g\\ Box int :: Box a\n}\n"
+
+
+def parse() -> Parser:
+    lexer = TableLexer(SOURCE)
+    lexer.lex_all()
+    parser = Parser(lexer.results, recover=True)
+    parser.parse_all()
+    return parser
+
+
+def instances(parser: Parser) -> list[TypeInstance]:
+    return [
+        symbol.val
+        for table in parser.symbol_tables
+        if table is not None
+        for symbol in table.symbols.values()
+        if isinstance(symbol.val, TypeInstance)
+    ]
+
+
+def interned_in(scopes: ScopeArena, instance: TypeInstance) -> bool:
+    return (
+        scopes.type_instance(
+            instance.name, instance.ty_belongs_to, instance.type_id, instance.filled_in_generics
+        )
+        is instance
+    )
+
+
+def test_load_interned_uses_the_scopes_instances() -> None:
+    made = ScopeArena()
+    int_type = primitive_type(PrimitiveTypes.INT)
+    data = pickle.dumps([made.type_instance("Box", 1, 0, [int_type])] * 2)
+
+    scopes = ScopeArena()
+    box_int = scopes.type_instance("Box", 1, 0, [int_type])
+    assert load_interned(data, scopes) == [box_int, box_int]
+
+    nested = made.type_instance("Box", 1, 0, [made.type_instance("Box", 1, 0, [int_type])])
+    loaded = load_interned(pickle.dumps(nested), scopes)
+    assert loaded.filled_in_generics[0] is box_int
+    assert interned_in(scopes, loaded)
+
+
+def test_cached_instances_are_interned(tmp_path) -> None:
+    parsed = parse()
+    assert len(instances(parsed)) >= 5
+    cache = ParseCache(str(tmp_path))
+    key = cache.key(parsed.input)
+    cache.store(key, parsed)
+
+    loaded = Parser([])
+    assert cache.load(key, loaded)
+    found = instances(loaded)
+    assert len(found) == len(instances(parsed))
+    assert all(interned_in(loaded.symbol_tables, instance) for instance in found)
+    assert len({id(instance) for instance in found}) == 2
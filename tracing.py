@@ -0,0 +1,128 @@
+import json
+import sys
+import time
+from typing import Any, Callable, TextIO
+
+# Tracing for the compiler phases. Every phase has its own Channel that
+# is off unless configure() turns it on, and a message is only built
+# once a channel knows it's going to write it, so a disabled trace costs
+# one comparison. Pass a lambda for anything that's expensive to format:
+#
+#     tracing.parse.debug(lambda: f"Parsed {result}", at=self.at)
+#
+# Hot loops can skip even the call with `if tracing.parse.level <= DEBUG:`.
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error"}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+Message = str | Callable[[], Any]
+
+
+class Channel:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        # Lowest level that gets written, OFF writes nothing.
+        self.level = OFF
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def log(self, level: int, message: Message, **fields: Any) -> None:
+        if level < self.level:
+            return
+        if callable(message):
+            message = message()
+        for sink in sinks:
+            sink.write(self.name, level, str(message), fields)
+
+    def debug(self, message: Message, **fields: Any) -> None:
+        if DEBUG >= self.level:
+            self.log(DEBUG, message, **fields)
+
+    def info(self, message: Message, **fields: Any) -> None:
+        if INFO >= self.level:
+            self.log(INFO, message, **fields)
+
+    def warning(self, message: Message, **fields: Any) -> None:
+        if WARNING >= self.level:
+            self.log(WARNING, message, **fields)
+
+    def error(self, message: Message, **fields: Any) -> None:
+        if ERROR >= self.level:
+            self.log(ERROR, message, **fields)
+
+
+# Writes `[channel] message key=value ...` lines, to stderr by default.
+class TextSink:
+    def __init__(self, out: TextIO | None = None) -> None:
+        self.out = out
+
+    def write(self, channel: str, level: int, message: str, fields: dict) -> None:
+        extra = "".join(f" {k}={v}" for k, v in fields.items())
+        print(f"[{channel}] {message}{extra}", file=self.out or sys.stderr)
+
+    def close(self) -> None:
+        pass
+
+
+# Writes one JSON object per record, fields included, for analysis
+# afterwards. `t` is seconds since the sink was opened.
+class JSONLinesSink:
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "w")
+        self.start = time.perf_counter()
+
+    def write(self, channel: str, level: int, message: str, fields: dict) -> None:
+        record = {
+            "t": round(time.perf_counter() - self.start, 6),
+            "channel": channel,
+            "level": LEVEL_NAMES.get(level, level),
+            "message": message,
+        }
+        record.update(fields)
+        self.file.write(json.dumps(record, default=str) + "\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+lex = Channel("lex")
+parse = Channel("parse")
+codegen = Channel("codegen")
+channels = {channel.name: channel for channel in (lex, parse, codegen)}
+sinks: list[TextSink | JSONLinesSink] = []
+
+
+# Turns channels on from a spec like "parse=debug,codegen" (a bare name
+# means info, "all" means every channel) and sets where records go:
+# stderr unless json_path is given, in which case they're written there
+# as JSON lines.
+def configure(spec: str, json_path: str | None = None) -> None:
+    close()
+    for channel in channels.values():
+        channel.level = OFF
+    for part in filter(None, spec.split(",")):
+        name, _, level_name = part.partition("=")
+        level = LEVELS.get(level_name or "info")
+        if level is None:
+            raise Exception(f'Unknown trace level "{level_name}"')
+        if name == "all":
+            for channel in channels.values():
+                channel.level = level
+        elif name in channels:
+            channels[name].level = level
+        else:
+            raise Exception(f'Unknown trace channel "{name}"')
+    sinks.append(TextSink() if json_path is None else JSONLinesSink(json_path))
+
+
+def close() -> None:
+    for sink in sinks:
+        sink.close()
+    sinks.clear()
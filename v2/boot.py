@@ -1,20 +1,68 @@
-from lex import Lexer
+import os
+import sys
+
+# v2 uses the tracing, lexer and common modules from the directory above
+# rather than copies of them. Appended, so v2's own modules still win
+# over same-named ones there.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lex import TableLexer
 from mkast import Parser
+from exprs import DataTypeDefinition
+from matching import MatchCompiler, index_lambdas
+from mono import Monomorphizer
+import tracing
 
-def run():
+def run(recover: bool = False):
     file = open("test.v2.dal").read()
-    lexer = Lexer(file)
+    lexer = TableLexer(file)
     lexer.lex_all()
-    print(f"{lexer.results}\n\n")
-    parser = Parser(lexer.results)
+    tracing.lex.info(lambda: f"{lexer.results}", tokens=len(lexer.results))
+    parser = Parser(lexer.results, recover=recover, locate=lexer.line_col)
     parser.parse_all()
+    for diagnostic in parser.diagnostics:
+        print(f"test.v2.dal:{diagnostic}")
 
-    # print(f"{parser.results}\n\n")
+    tracing.parse.info(lambda: f"{parser.results}", declarations=len(parser.results))
+    monomorphizer = Monomorphizer(
+        expr for expr in parser.results if isinstance(expr, DataTypeDefinition)
+    )
+    layouts = monomorphizer.instantiate_all(parser.results)
+    tracing.codegen.info(
+        lambda: f"{layouts}",
+        instances=len(monomorphizer.layouts),
+        hits=monomorphizer.hits,
+    )
+    matches = MatchCompiler(
+        (expr for expr in parser.results if isinstance(expr, DataTypeDefinition)),
+        locate=lexer.line_col,
+    )
+    trees = {
+        name: matches.compile(group)
+        for name, group in index_lambdas(parser.results).items()
+    }
+    for diagnostic in matches.diagnostics:
+        print(f"test.v2.dal:{diagnostic}")
+    tracing.parse.info(lambda: f"{trees}", lambdas=len(trees))
     # code_generator = ASM(parser.results, parser.symbol_tables)
     # code_generator.generate_all()
     # print(f"{code_generator.lines}")
     # open("boot.s", "w+").write("\n".join(code_generator.lines))
 
 
+# Value of a `--name=value` argument, None when it wasn't passed.
+def option(name: str) -> str | None:
+    for arg in sys.argv:
+        if arg.startswith(name + "="):
+            return arg[len(name) + 1 :]
+    return None
+
+
 if __name__ == "__main__":
-    run()
+    # Same tracing flags as ../boot.py
+    trace = option("--trace")
+    trace_json = option("--trace-json")
+    if trace is not None or trace_json is not None:
+        tracing.configure(trace or "all=debug", trace_json)
+    run(recover="--recover" in sys.argv)
+    tracing.close()
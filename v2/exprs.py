@@ -6,10 +6,14 @@ from shared import PrimitiveTypes
 
 
 class TaggedType(ABC):
-    pass
+    __slots__ = ()
 
 
+# Nodes are made in the hundreds of thousands, so every class lists its
+# fields in __slots__ instead of carrying a __dict__.
 class AstirExpr(ABC):
+    __slots__ = ("ty",)
+
     def __init__(self, ty: Union["TypeInstance", None]) -> None:
         if not isinstance(self, TaggedType) and ty is None:
             raise Exception(
@@ -22,6 +26,8 @@ class AstirExpr(ABC):
 
 
 class Symbol:
+    __slots__ = ("name", "inside", "belongs_to_table", "id")
+
     def __init__(
         self, name: str, inside: AstirExpr, belongs_to_table: int, id: int
     ) -> None:
@@ -66,6 +72,8 @@ class SymbolTable:
 
 
 class Identifier(AstirExpr, TaggedType):
+    __slots__ = ("value",)
+
     def __init__(self, value: str):
         super().__init__(None)
         self.value = value
@@ -75,6 +83,8 @@ class Identifier(AstirExpr, TaggedType):
 
 
 class DataTypeDefinition(AstirExpr, TaggedType):
+    __slots__ = ("name", "elements", "generic_params")
+
     def __init__(
         self,
         name: str,
@@ -93,6 +103,8 @@ class DataTypeDefinition(AstirExpr, TaggedType):
 
 
 class Unit(AstirExpr):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(PrimitiveTypes.UNIT)
 
@@ -101,19 +113,47 @@ class Unit(AstirExpr):
 
 
 class LambdaDefinition(AstirExpr, TaggedType):
+    __slots__ = ("name", "parameter_types", "generic_params")
+
     def __init__(
         self,
         name: str,
-        parameter_types: list["TypeInstance"],
+        # As parsed, e.g. `Identifier(DummyExpr)` or, for a named one,
+        # `Parenthesized([Identifier(x), Identifier(int)])`.
+        parameter_types: list[AstirExpr],
         generic_params: list[Identifier],
     ):
         super().__init__(None)
         self.name: str = name
-        self.parameter_types: list["TypeInstance"] = parameter_types
+        self.parameter_types: list[AstirExpr] = parameter_types
         self.generic_params = generic_params
 
+    def __repr__(self):
+        return f"LambdaDefinition(Name={self.name}, Parameters={self.parameter_types})"
+
+
+# One `name\pattern, ... → body` declaration. A lambda can have several,
+# each taking apart its arguments differently (see matching.py). The
+# body isn't parsed yet, it's kept as the [start, end) token span.
+class LambdaClause(AstirExpr):
+    __slots__ = ("name", "patterns", "at", "body")
+
+    def __init__(
+        self, name: str, patterns: list[AstirExpr], at: int, body: tuple[int, int]
+    ):
+        super().__init__(PrimitiveTypes.UNIT)
+        self.name = name
+        self.patterns = patterns
+        self.at = at
+        self.body = body
+
+    def __repr__(self):
+        return f"LambdaClause(Name={self.name}, Patterns={self.patterns})"
+
 
 class Lambda(AstirExpr):
+    __slots__ = ("name", "parameters")
+
     def __init__(
         self, resolved_ty: AstirExpr, ty: "TypeInstance", parameters: SymbolTable
     ):
@@ -125,6 +165,8 @@ class Lambda(AstirExpr):
 
 
 class TypeInstance(AstirExpr, TaggedType):
+    __slots__ = ("resolved_type", "filled_in_generics")
+
     def __init__(
         self,
         resolved_type: DataTypeDefinition | PrimitiveTypes,
@@ -137,13 +179,20 @@ class TypeInstance(AstirExpr, TaggedType):
 
 
 class Dummy(AstirExpr):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(PrimitiveTypes.UNIT)
 
 class Parenthesized(AstirExpr, TaggedType):
+    __slots__ = ("values",)
+
     def __init__(self, values: list[AstirExpr]):
         super().__init__(None)
         self.values = values
+
+    def __repr__(self):
+        return f"Parenthesized(Values={self.values})"
 # class Type:
 #     def __init__(self, inside: PrimitiveTypes | AstirExpr):
 #         if isinstance(inside, AstirExpr) and not isinstance(inside, TaggedType):
@@ -1,5 +1,7 @@
+import re
 from typing import Callable
 from shared import Cursor, PrimitiveTypes, TT, operators
+from lexer import STRING_BODY, STRING_ESCAPE, PatternLexer
 
 class Token:
     def __init__(self, ty: TT, prim_ty: PrimitiveTypes | None = None, val=None) -> None:
@@ -11,6 +13,56 @@ class Token:
         return f"{self.ty} ({self.val})"
 
 
+def float_to_ieee754(ident: str) -> str:
+    try:
+        number = float(ident)
+        sign = 0 if number >= 0 else 1
+
+        number = abs(number)
+        integer = int(number)
+        fractional = number - integer
+        integer_bin = bin(integer).replace("0b", "") if integer != 0 else "0"
+
+        frac_bin: list[str] = []  # List to store the fractional binary digits
+        while (
+            fractional and len(frac_bin) < 23 + 3
+        ):  # Stop after 23+3 bits to avoid overflow
+            fractional *= 2  # Multiply by 2 to shift digits left
+            bit = int(fractional)  # Extract the integer part (0 or 1)
+            frac_bin.append(str(bit))  # Append the bit to the list
+            fractional -= bit  # Remove the integer part from the fractional value
+        frac_bin2: str = "".join(frac_bin)
+        combined_bin = integer_bin + "." + frac_bin2
+
+        if "1" in combined_bin:  # Ensure there is at least one significant bit
+            first_one = combined_bin.index("1")  # Find the position of the first '1'
+            if "." in combined_bin and first_one > combined_bin.index("."):
+                first_one -= 1  # Adjust for the position of the binary point
+            exponent = (
+                len(integer_bin) - 1 - first_one
+            )  # Calculate the exponent from normalization
+            mantissa = (integer_bin + frac_bin2)[
+                first_one + 1 : first_one + 24
+            ]  # Extract mantissa bits
+        else:  # Special case for zero-like numbers
+            exponent = 0
+            mantissa = "0" * 23  # Mantissa is all zeros
+
+        # Step 4: Encode the exponent (add bias of 127)
+        exponent += 127  # Apply the bias to the exponent
+        exponent_bin = bin(exponent).replace("0b", "").zfill(8)  # Convert to 8-bit binary
+
+        # Step 5: Pad the mantissa to 23 bits
+        mantissa = mantissa.ljust(23, "0")  # Ensure the mantissa has exactly 23 bits
+
+        # Combine the components into a 32-bit IEEE 754 representation
+        return f"{sign}{exponent_bin}{mantissa}"
+    except ValueError:
+        raise Exception(
+            f'Something went wrong handling decimal: "{ident}"? check how many dots...'
+        )
+
+
 def get_op(possible_op: Token | None) -> tuple[str, dict[str, int]] | None:
     if (
         possible_op is None
@@ -107,74 +159,82 @@ class Lexer(Cursor):
             ident = self.collect_until(identifier_check, True, start_str=c)
 
             if "." in ident:
-                try:
-                    number = float(ident)
-                    sign = 0 if number >= 0 else 1
-
-                    number = abs(number)
-                    integer = int(number)
-                    fractional = number - integer
-                    integer_bin = (
-                        bin(integer).replace("0b", "") if integer != 0 else "0"
-                    )
-
-                    frac_bin: list[str] = (
-                        []
-                    )  # List to store the fractional binary digits
-                    while (
-                        fractional and len(frac_bin) < 23 + 3
-                    ):  # Stop after 23+3 bits to avoid overflow
-                        fractional *= 2  # Multiply by 2 to shift digits left
-                        bit = int(fractional)  # Extract the integer part (0 or 1)
-                        frac_bin.append(str(bit))  # Append the bit to the list
-                        fractional -= (
-                            bit  # Remove the integer part from the fractional value
-                        )
-                    frac_bin2: str = "".join(frac_bin)
-                    combined_bin = integer_bin + "." + frac_bin2
-
-                    if (
-                        "1" in combined_bin
-                    ):  # Ensure there is at least one significant bit
-                        first_one = combined_bin.index(
-                            "1"
-                        )  # Find the position of the first '1'
-                        if "." in combined_bin and first_one > combined_bin.index("."):
-                            first_one -= (
-                                1  # Adjust for the position of the binary point
-                            )
-                        exponent = (
-                            len(integer_bin) - 1 - first_one
-                        )  # Calculate the exponent from normalization
-                        mantissa = (integer_bin + frac_bin2)[
-                            first_one + 1 : first_one + 24
-                        ]  # Extract mantissa bits
-                    else:  # Special case for zero-like numbers
-                        exponent = 0
-                        mantissa = "0" * 23  # Mantissa is all zeros
-
-                    # Step 4: Encode the exponent (add bias of 127)
-                    exponent += 127  # Apply the bias to the exponent
-                    exponent_bin = (
-                        bin(exponent).replace("0b", "").zfill(8)
-                    )  # Convert to 8-bit binary
-
-                    # Step 5: Pad the mantissa to 23 bits
-                    mantissa = mantissa.ljust(
-                        23, "0"
-                    )  # Ensure the mantissa has exactly 23 bits
-
-                    # Combine the components into a 32-bit IEEE 754 representation
-                    ieee754 = f"{sign}{exponent_bin}{mantissa}"
-                    return Token(TT.LITERAL, val=ieee754, prim_ty=PrimitiveTypes.FLOAT)
-                except ValueError:
-                    raise Exception(
-                        f'Something went wrong handling decimal: "{ident}"? check how many dots...'
-                    )
+                return Token(
+                    TT.LITERAL,
+                    val=float_to_ieee754(ident),
+                    prim_ty=PrimitiveTypes.FLOAT,
+                )
             # TODO: TEMPORARY!!
             elif ident.isdigit():
                 return Token(TT.LITERAL, val=int(ident), prim_ty=PrimitiveTypes.INT)
             return Token(TT.IDENT, val=ident)
         else:
             return Token(TT(c))
-        return Token(TT.DUMMY)
\ No newline at end of file
+        return Token(TT.DUMMY)
+
+
+SINGLE_CHAR_TOKENS: dict[str, TT] = {
+    tt.value: tt for tt in TT if len(tt.value) == 1
+}
+
+# Splits the input into raw token texts in one pass. Alternatives are
+# ordered by how often they show up in real sources. Comments come out
+# as their own text (starting with "//") and are dropped by TokenTable,
+# any other character falls through to the last alternative so nothing
+# is silently skipped.
+TOKEN_PATTERN = re.compile(
+    r"""[ \n]*(
+        [tdm]'
+        |[^\W_][\w.]*
+        |//[^\n]*\n?
+        |"(?:[^"\\]|\\.)*(?:"|\\?\Z)
+        |::
+        |\.[\w.]*
+        |[^ \n]
+    )""",
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def token_from_text(text: str) -> Token | None:
+    c = text[0]
+    if c in SINGLE_CHAR_TOKENS and len(text) == 1:
+        return Token(SINGLE_CHAR_TOKENS[c])
+    elif c == "/":
+        return None if text.startswith("//") else Token(TT.DUMMY)
+    elif c == ":":
+        return Token(TT.DOUBLE_COLON)
+    elif c == '"':
+        string = text[1 : STRING_BODY.match(text, 1).end()]  # type: ignore
+        if "\\" in string:
+            string = STRING_ESCAPE.sub(r"\1", string)
+        return Token(TT.LITERAL, prim_ty=PrimitiveTypes.STR, val=string)
+    elif text.endswith("'") and len(text) == 2:
+        return Token(TT.PRIME_FORM, val=c)
+    elif c.isalnum() or c == ".":
+        if "." in text:
+            return Token(
+                TT.LITERAL,
+                val=float_to_ieee754(text),
+                prim_ty=PrimitiveTypes.FLOAT,
+            )
+        # TODO: TEMPORARY!!
+        elif text.isdigit():
+            return Token(TT.LITERAL, val=int(text), prim_ty=PrimitiveTypes.INT)
+        return Token(TT.IDENT, val=text)
+    raise Exception(f"Unexpected character {c!r}")
+
+
+# Maps raw token text to its Token, see ../lexer.py's TokenTable.
+class TokenTable(dict[str, Token | None]):
+    def __missing__(self, text: str) -> Token | None:
+        token = self[text] = token_from_text(text)
+        return token
+
+
+# Produces the same Token stream as Lexer. Splitting the input and
+# everything after it is ../lexer.py's PatternLexer, only the pattern
+# and what a text becomes are v2's own.
+class TableLexer(PatternLexer[Token]):
+    def __init__(self, input: str) -> None:
+        super().__init__(input, TOKEN_PATTERN, TokenTable())
@@ -0,0 +1,356 @@
+from typing import Callable, Iterable
+
+from exprs import (
+    AstirExpr,
+    DataTypeDefinition,
+    Identifier,
+    LambdaClause,
+    LambdaDefinition,
+    Parenthesized,
+    Unit,
+)
+from mono import variants_of
+from common import Diagnostic, Rule, run_stacked
+import tracing
+
+# Compiles the clauses of a pattern matching lambda, e.g.
+#
+#     lambda_that_pattern_matches\DummyExpr :: ()
+#     lambda_that_pattern_matches\Identifier inside_str → ()
+#     lambda_that_pattern_matches\ExprWithAnotherInside name inside_expr → ()
+#
+# into a decision tree. Every Switch reads one constructor tag and
+# jumps straight to the case for it through a list indexed by the tag,
+# so picking a clause costs one step per argument that's taken apart,
+# however many constructors or clauses there are. Clauses are tried in
+# the order they were written, one that can never be picked because the
+# ones before it already match everything it does is reported, and so
+# are constructors no clause matches.
+
+# Where a value is, the index of the argument followed by the index of
+# the field at each constructor on the way down to it.
+Path = tuple[int, ...]
+
+
+class Binder:
+    __slots__ = ("name",)
+
+    # None for `_`, which matches without binding anything.
+    def __init__(self, name: str | None) -> None:
+        self.name = name
+
+
+class Constructor:
+    __slots__ = ("definition", "tag", "args")
+
+    def __init__(
+        self, definition: DataTypeDefinition, tag: int, args: list["Pattern"]
+    ) -> None:
+        self.definition = definition
+        self.tag = tag
+        self.args = args
+
+
+Pattern = Binder | Constructor
+
+
+class Leaf:
+    __slots__ = ("clause", "bindings")
+
+    def __init__(self, clause: int, bindings: dict[str, Path]) -> None:
+        self.clause = clause
+        self.bindings = bindings
+
+    def __repr__(self) -> str:
+        return f"Leaf({self.clause}, {self.bindings})"
+
+
+class Fail:
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "Fail"
+
+
+class Switch:
+    __slots__ = ("path", "definition", "cases")
+
+    def __init__(
+        self, path: Path, definition: DataTypeDefinition, cases: list["Tree"]
+    ) -> None:
+        self.path = path
+        self.definition = definition
+        # cases[tag] is what to do when the value at `path` was made
+        # with the constructor of that tag.
+        self.cases = cases
+
+    def __repr__(self) -> str:
+        return f"Switch({self.path}, {self.definition.name}, {self.cases})"
+
+
+Tree = Leaf | Fail | Switch
+
+
+# A lambda's parameter types and its clauses, in the order written.
+class LambdaGroup:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.definition: LambdaDefinition | None = None
+        self.clauses: list[LambdaClause] = []
+
+
+# Groups the definitions and clauses in `exprs` by lambda name in one
+# pass, lambdas come out in the order they're first mentioned.
+def index_lambdas(exprs: Iterable[AstirExpr]) -> dict[str, LambdaGroup]:
+    groups: dict[str, LambdaGroup] = {}
+    for expr in exprs:
+        if isinstance(expr, LambdaDefinition):
+            group = groups.get(expr.name)
+            if group is None:
+                group = groups[expr.name] = LambdaGroup(expr.name)
+            if group.definition is not None:
+                raise Exception(f"{expr.name} has its parameter types declared twice")
+            group.definition = expr
+        elif isinstance(expr, LambdaClause):
+            group = groups.get(expr.name)
+            if group is None:
+                group = groups[expr.name] = LambdaGroup(expr.name)
+            group.clauses.append(expr)
+    return groups
+
+
+# The name a parsed pattern or type starts with, and what follows it.
+def head_of(expr: AstirExpr) -> tuple[AstirExpr, list[AstirExpr]]:
+    while isinstance(expr, Parenthesized) and len(expr.values) == 1:
+        expr = expr.values[0]
+    if isinstance(expr, Parenthesized):
+        return (expr.values[0], expr.values[1:])
+    return (expr, [])
+
+
+class MatchCompiler:
+    def __init__(
+        self,
+        definitions: Iterable[DataTypeDefinition],
+        locate: Callable[[int], tuple[int, int]] | None = None,
+    ) -> None:
+        self.definitions = {definition.name: definition for definition in definitions}
+        self.locate = locate
+        # constructor name -> (its data type, tag, field types)
+        self.constructors: dict[str, tuple[DataTypeDefinition, int, list[AstirExpr]]] = {}
+        for definition in self.definitions.values():
+            for tag, (name, fields) in enumerate(variants_of(definition)):
+                self.constructors[name] = (definition, tag, fields)
+        self.diagnostics: list[Diagnostic] = []
+
+    def report(self, message: str, at: int) -> None:
+        line, col = self.locate(at) if self.locate is not None else (None, None)
+        self.diagnostics.append(Diagnostic(message, at, line, col))
+
+    # The data type a parameter or field type names, None when it isn't
+    # one whose values can be taken apart.
+    def type_of(self, expr: AstirExpr | None) -> DataTypeDefinition | None:
+        if expr is None:
+            return None
+        head, rest = head_of(expr)
+        if isinstance(head, Identifier) and head.value in self.definitions:
+            return self.definitions[head.value]
+        # A named parameter, `x DummyExpr`.
+        if len(rest) > 0:
+            head, _ = head_of(rest[-1])
+        if isinstance(head, Identifier):
+            return self.definitions.get(head.value)
+        return None
+
+    # `expr` as a pattern for a value of type `expected`, when that's
+    # known. Without one, a constructor name decides it. A constructor
+    # of another data type is an error rather than a binder named after
+    # it.
+    def pattern(self, expr: AstirExpr, expected: DataTypeDefinition | None) -> Pattern:
+        head, args = head_of(expr)
+        if isinstance(head, Unit) and len(args) == 0:
+            return Binder(None)
+        if not isinstance(head, Identifier):
+            raise Exception(f"Unexpected {head} in a pattern")
+        constructor = self.constructors.get(head.value)
+        if (
+            constructor is not None
+            and expected is not None
+            and constructor[0] is not expected
+        ):
+            raise Exception(
+                f"{head.value} is a constructor of {constructor[0].name}, not {expected.name}"
+            )
+        if constructor is None:
+            if len(args) > 0:
+                expected_name = "it" if expected is None else expected.name
+                raise Exception(f"{head.value} isn't a constructor of {expected_name}")
+            return Binder(None if head.value == "_" else head.value)
+        definition, tag, fields = constructor
+        if len(args) != len(fields):
+            raise Exception(
+                f"{head.value} has {len(fields)} fields, the pattern takes apart {len(args)}"
+            )
+        return Constructor(
+            definition,
+            tag,
+            [self.pattern(arg, self.type_of(field)) for arg, field in zip(args, fields)],
+        )
+
+    # The decision tree for `group`, or None when it has no clauses.
+    # Problems with it go to self.diagnostics.
+    def compile(self, group: LambdaGroup) -> Tree | None:
+        if len(group.clauses) == 0:
+            return None
+        arity = len(group.clauses[0].patterns)
+        types: list[DataTypeDefinition | None] = [None] * arity
+        if group.definition is not None:
+            if len(group.definition.parameter_types) != arity:
+                self.report(
+                    f"{group.name} takes {len(group.definition.parameter_types)} parameters, "
+                    f"its clause has {arity}",
+                    group.clauses[0].at,
+                )
+                return None
+            types = [self.type_of(ty) for ty in group.definition.parameter_types]
+        # A parameter whose type isn't known takes it from the first
+        # constructor used for it, a clause using one of another data
+        # type there is reported and left out.
+        for column, ty in enumerate(types):
+            if ty is not None:
+                continue
+            for clause in group.clauses:
+                if len(clause.patterns) != arity:
+                    continue
+                head, _ = head_of(clause.patterns[column])
+                if isinstance(head, Identifier) and head.value in self.constructors:
+                    types[column] = self.constructors[head.value][0]
+                    break
+        rows: list[tuple[list[Pattern], int, dict[str, Path]]] = []
+        for index, clause in enumerate(group.clauses):
+            if len(clause.patterns) != arity:
+                self.report(
+                    f"Clauses of {group.name} take {arity} parameters, this one {len(clause.patterns)}",
+                    clause.at,
+                )
+                continue
+            try:
+                patterns = [self.pattern(p, ty) for p, ty in zip(clause.patterns, types)]
+            except Exception as e:
+                self.report(str(e), clause.at)
+                continue
+            rows.append((patterns, index, {}))
+
+        reached: set[int] = set()
+        missing: list[str] = []
+        wrong: dict[int, str] = {}
+        tree = run_stacked(
+            self.tree_rule(rows, [(i,) for i in range(arity)], reached, missing, wrong)
+        )
+        for index, message in sorted(wrong.items()):
+            self.report(message, group.clauses[index].at)
+        for index, clause in enumerate(group.clauses):
+            if index in wrong:
+                continue
+            if index not in reached and any(row[1] == index for row in rows):
+                self.report(
+                    f"Clause {index + 1} of {group.name} is never used, "
+                    "the clauses before it match everything it does",
+                    clause.at,
+                )
+        if len(missing) > 0:
+            self.report(
+                f"Not every case of {group.name} has a clause, nothing matches {', '.join(sorted(set(missing)))}",
+                group.clauses[0].at,
+            )
+        tracing.parse.debug(lambda: f"{group.name}: {tree}", clauses=len(group.clauses))
+        return tree
+
+    # Takes apart the first column the first row has a constructor in,
+    # which splits the rows into one set per constructor, each row only
+    # going to the cases its pattern there allows. Order within a set
+    # is kept, so the first row whose patterns are all binders is the
+    # clause that's picked. The column's data type is that of the first
+    # row's constructor, a row with one of another type there (in a
+    # field whose type is a type parameter, say) goes in `wrong`
+    # instead.
+    def tree_rule(
+        self,
+        rows: list[tuple[list[Pattern], int, dict[str, Path]]],
+        paths: list[Path],
+        reached: set[int],
+        missing: list[str],
+        wrong: dict[int, str],
+    ) -> Rule[Tree]:
+        if len(rows) == 0:
+            return Fail()
+        patterns, clause, bindings = rows[0]
+        column = next(
+            (i for i, pattern in enumerate(patterns) if isinstance(pattern, Constructor)),
+            None,
+        )
+        if column is None:
+            reached.add(clause)
+            bindings = dict(bindings)
+            for pattern, path in zip(patterns, paths):
+                if isinstance(pattern, Binder) and pattern.name is not None:
+                    bindings[pattern.name] = path
+            return Leaf(clause, bindings)
+
+        definition = patterns[column].definition  # type: ignore
+        path = paths[column]
+        constructors = variants_of(definition)
+        cases: list[list[tuple[list[Pattern], int, dict[str, Path]]]] = [
+            [] for _ in constructors
+        ]
+        for patterns, clause, bindings in rows:
+            pattern = patterns[column]
+            before, after = patterns[:column], patterns[column + 1 :]
+            if isinstance(pattern, Constructor) and pattern.definition is not definition:
+                name = variants_of(pattern.definition)[pattern.tag][0]
+                wrong[clause] = (
+                    f"{name} is a constructor of {pattern.definition.name}, not {definition.name}"
+                )
+                continue
+            if isinstance(pattern, Constructor):
+                cases[pattern.tag].append((before + pattern.args + after, clause, bindings))
+                continue
+            if pattern.name is not None:
+                bindings = {**bindings, pattern.name: path}
+            for tag, (_, fields) in enumerate(constructors):
+                cases[tag].append(
+                    (before + [Binder(None)] * len(fields) + after, clause, bindings)
+                )
+
+        trees: list[Tree] = []
+        for tag, (name, fields) in enumerate(constructors):
+            sub_paths = (
+                paths[:column] + [path + (i,) for i in range(len(fields))] + paths[column + 1 :]
+            )
+            if len(cases[tag]) == 0:
+                missing.append(name)
+            trees.append(
+                (yield self.tree_rule(cases[tag], sub_paths, reached, missing, wrong))
+            )
+        return Switch(path, definition, trees)
+
+
+# Clauses picked by `tree` for `arguments`, values being
+# (tag, [field values]) tuples, and what the binders are bound to.
+# What generated code will do, kept here to check trees against.
+def select(tree: Tree, arguments: list) -> tuple[int, dict[str, object]] | None:
+    while isinstance(tree, Switch):
+        tree = tree.cases[value_at(arguments, tree.path)[0]]
+    if isinstance(tree, Fail):
+        return None
+    return (
+        tree.clause,
+        {name: value_at(arguments, path) for name, path in tree.bindings.items()},
+    )
+
+
+def value_at(arguments: list, path: Path):
+    value = arguments[path[0]]
+    for field in path[1:]:
+        value = value[1][field]
+    return value
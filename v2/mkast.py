@@ -1,9 +1,14 @@
-from shared import TT, PrimitiveTypes
+from typing import Callable
+
+from shared import CLOSING_BRACKETS, OPENING_BRACKETS, TT, PrimitiveTypes
 from shared import Cursor
+from common import Diagnostic, Rule, run_nested, run_stacked
 from exprs import (
     AstirExpr,
     DataTypeDefinition,
     Identifier,
+    LambdaClause,
+    LambdaDefinition,
     Parenthesized,
     SymbolTable,
     Symbol,
@@ -12,6 +17,7 @@ from exprs import (
     Unit,
 )
 from lex import Token
+import tracing
 
 
 class Lexer(Cursor):
@@ -19,8 +25,26 @@ class Lexer(Cursor):
 
 
 class Parser(Cursor):
-    def __init__(self, input: list[Token]):
+    # By default the parse rules run on a heap allocated stack (see
+    # shared.run_stacked) so nesting depth isn't limited by Python's
+    # recursion limit. explicit_stack=False runs them recursively, which
+    # costs the same but gives tracebacks through every enclosing rule.
+    # With recover=True a declaration that fails to parse is recorded in
+    # self.diagnostics and skipped instead of stopping the whole parse,
+    # `locate` maps a token index to its (line, col) for those.
+    def __init__(
+        self,
+        input: list[Token],
+        explicit_stack: bool = True,
+        recover: bool = False,
+        locate: Callable[[int], tuple[int, int]] | None = None,
+    ):
         super().__init__(input)
+        self.run = run_stacked if explicit_stack else run_nested
+        self.recover = recover
+        self.locate = locate
+        self.diagnostics: list[Diagnostic] = []
+        self.results: list[AstirExpr] = []
         global_symbols: SymbolTable = SymbolTable(0)
         global_symbols.insert("Str", DataTypeDefinition("Str", None, []))
 
@@ -31,34 +55,77 @@ class Parser(Cursor):
         symbol_table_id = (
             self.current_symbol_table if symbol_table_id is None else symbol_table_id
         )
-        if symbol_table_id not in self.all_symbol_tables:
-            return None
-        selected_symbol_table = self.all_symbol_tables[symbol_table_id]
-        lookup = selected_symbol_table.lookup(name)
-        if (
-            lookup is None or name not in selected_symbol_table.name_to_symbol
-        ) and selected_symbol_table.parent is not None:
-            return self.lookup(name, selected_symbol_table.parent)
-        else:
-            return lookup
+        while symbol_table_id is not None and symbol_table_id in self.all_symbol_tables:
+            selected_symbol_table = self.all_symbol_tables[symbol_table_id]
+            lookup = selected_symbol_table.lookup(name)
+            if lookup is not None:
+                return lookup
+            symbol_table_id = selected_symbol_table.parent
+        return None
 
     def parse_all(self):
         while self.at < len(self.input):
-            parsed = self.parse()
-            if parsed is None:
-                raise Exception("CANNOT PARSE NONE!")
-            print(f"{parsed}")
+            start = self.at
+            try:
+                parsed = self.parse()
+                if parsed is None:
+                    raise Exception("CANNOT PARSE NONE!")
+            except Exception as e:
+                if not self.recover:
+                    raise
+                self.report(str(e))
+                self.skip_declaration(start)
+                self.current_symbol_table = 0
+                continue
+            self.results.append(parsed)
+
+    def report(self, message: str) -> None:
+        line, col = self.locate(self.at) if self.locate is not None else (None, None)
+        self.diagnostics.append(Diagnostic(message, self.at, line, col))
+
+    # Moves past the declaration that starts at `start` to the beginning
+    # of the next top level one: a prime form or `name\` that isn't
+    # nested inside brackets.
+    def skip_declaration(self, start: int) -> None:
+        depth = 0
+        self.at = start
+        while (current := self.current()) is not None:
+            if self.at > start and depth <= 0 and self.declaration_starts(self.at):
+                return
+            if current.ty in OPENING_BRACKETS:
+                depth += 1
+            elif current.ty in CLOSING_BRACKETS:
+                depth -= 1
+            self.advance()
+
+    def declaration_starts(self, at: int) -> bool:
+        if at >= len(self.input):
+            return False
+        token = self.input[at]
+        return token.ty == TT.PRIME_FORM or (
+            token.ty == TT.IDENT
+            and at + 1 < len(self.input)
+            and self.input[at + 1].ty == TT.BACKSLASH
+        )
 
     def parse(self) -> AstirExpr | None:
+        return self.run(self.parse_rule())
+
+    def parse_rule(self) -> Rule[AstirExpr | None]:
         current = self.current()
         result: AstirExpr | None = None
         if current is None:
             return None
+        elif current.ty == TT.IDENT and current.val is not None and self.declaration_starts(self.at):
+            result = yield self.lambda_rule()
+        elif current.ty == TT.UNDERSCORE:
+            self.advance()
+            result = Identifier("_")
         elif current.ty == TT.IDENT and current.val is not None:
             self.advance()
             ident_lookup = self.lookup(current.val)
             if ident_lookup is not None:
-                print(ident_lookup)
+                tracing.parse.debug(lambda: f"{ident_lookup}", at=self.at)
             result = Identifier(current.val)
         elif current.ty == TT.OPEN_PAREN:
             self.advance()
@@ -69,7 +136,7 @@ class Parser(Cursor):
                 and current is not None
                 and current.ty != TT.CLOSE_PAREN
             ):
-                element = self.parse()
+                element = yield self.parse_rule()
                 if element is None:
                     raise Exception("Did not expect None value as element to () type")
                 inside_of_parens.append(element)
@@ -81,7 +148,7 @@ class Parser(Cursor):
         elif current.ty == TT.PRIME_FORM and current.val is not None:
             self.advance()
             if current.val == "d":
-                type_definition_name = self.parse()
+                type_definition_name = yield self.parse_rule()
                 if not isinstance(type_definition_name, Identifier):
                     raise Exception(
                         "Expected an identifier as the name for a type defintion."
@@ -92,7 +159,7 @@ class Parser(Cursor):
                     and current is not None
                     and current.ty != TT.DOUBLE_COLON
                 ):
-                    parsed_generic = self.parse()
+                    parsed_generic = yield self.parse_rule()
                     if not isinstance(parsed_generic, (Identifier)):
                         raise Exception(
                             "Unexpected expression in generic parameter list."
@@ -108,6 +175,7 @@ class Parser(Cursor):
                     (current := self.current())
                     and current is not None
                     and current.ty != TT.DOUBLE_COLON
+                    and not self.declaration_starts(self.at)
                 ):
                     if current.ty == TT.PIPE:
                         if len(val_stack) > 1:
@@ -117,7 +185,7 @@ class Parser(Cursor):
                         val_stack = []
                         self.advance()
                         continue
-                    value = self.parse()
+                    value = yield self.parse_rule()
                     if not isinstance(value, (Unit, Identifier, TypeInstance, Dummy, Parenthesized)):
                         raise Exception(
                             f"Unexpected value: {value} in data type definition"
@@ -130,3 +198,42 @@ class Parser(Cursor):
                 )
 
         return result
+
+    # `name\Type, ... :: Return` declares a lambda's parameter types,
+    # `name\pattern, ... → body` is one of its clauses. Each parameter is
+    # what's between the commas, more than one expression is wrapped in
+    # a Parenthesized. Return types and bodies are skipped for now.
+    def lambda_rule(self) -> Rule[AstirExpr]:
+        start = self.at
+        name = self.input[start].val
+        self.at += 2
+        parameters: list[list[AstirExpr]] = [[]]
+        while (
+            (current := self.current())
+            and current is not None
+            and current.ty not in (TT.DOUBLE_COLON, TT.FUNCTION_ARROW)
+            and not self.declaration_starts(self.at)
+        ):
+            if current.ty == TT.COMMA:
+                parameters.append([])
+                self.advance()
+                continue
+            parameter = yield self.parse_rule()
+            if parameter is None:
+                raise Exception(f"Unexpected {current} in the parameters of {name}")
+            parameters[-1].append(parameter)
+        if len(parameters) > 1 and any(len(parameter) == 0 for parameter in parameters):
+            raise Exception(f"Empty parameter in {name}")
+        values = [
+            parameter[0] if len(parameter) == 1 else Parenthesized(parameter)
+            for parameter in parameters
+            if len(parameter) > 0
+        ]
+        separator = self.current()
+        if separator is None or separator.ty not in (TT.DOUBLE_COLON, TT.FUNCTION_ARROW):
+            raise Exception(f"Expected :: or → after the parameters of {name}")
+        at = self.at
+        self.skip_declaration(at)
+        if separator.ty == TT.DOUBLE_COLON:
+            return LambdaDefinition(name, values, [])
+        return LambdaClause(name, values, start, (at + 1, self.at))
@@ -0,0 +1,368 @@
+from typing import Iterable
+
+from exprs import (
+    AstirExpr,
+    DataTypeDefinition,
+    Identifier,
+    LambdaDefinition,
+    Parenthesized,
+    TypeInstance,
+    Unit,
+)
+from shared import PrimitiveTypes
+import tracing
+
+# Monomorphization: every generic data type and lambda is instantiated
+# once per distinct tuple of type arguments, e.g. `List Int` and
+# `List Str` each get their own layout with the element stored inline.
+# Type instances are interned (see Monomorphizer.type_instance), so an
+# instantiation is looked up by the instance itself.
+#
+# Polymorphic recursion (`d'Nest a :: Nil | Cons a (Nest (Pair a a))`)
+# would make new instances forever and nested arguments multiply, so a
+# definition gets at most `limit` specialized instances and arguments
+# nest at most `depth` deep. Past either, the instance falls back to
+# the boxed layout, where every type argument is one pointer sized
+# word, shared by all such instances of the definition.
+
+WORD = 8
+DEFAULT_LIMIT = 64
+DEFAULT_DEPTH = 8
+
+PRIMITIVE_NAMES = {
+    "Int": PrimitiveTypes.INT,
+    "Float": PrimitiveTypes.FLOAT,
+    "Str": PrimitiveTypes.STR,
+    "List": PrimitiveTypes.LIST,
+}
+# Bytes a value of the type takes up inline, strings and lists are a
+# pointer to their contents.
+PRIMITIVE_SIZES = {
+    PrimitiveTypes.INT: WORD,
+    PrimitiveTypes.FLOAT: WORD,
+    PrimitiveTypes.STR: WORD,
+    PrimitiveTypes.LIST: WORD,
+    PrimitiveTypes.UNIT: 0,
+}
+
+# Stands in for any type argument of a boxed instance.
+BOXED_DEFINITION = DataTypeDefinition("Boxed", None, [])
+BOXED = TypeInstance(BOXED_DEFINITION, [])
+
+
+class Field:
+    __slots__ = ("ty", "offset", "size", "boxed")
+
+    def __init__(self, ty: TypeInstance, offset: int, size: int, boxed: bool) -> None:
+        self.ty = ty
+        self.offset = offset
+        self.size = size
+        # Stored as a pointer to a value of `ty` rather than the value.
+        self.boxed = boxed
+
+    def __repr__(self) -> str:
+        return f"Field(+{self.offset}, {self.size}{', boxed' if self.boxed else ''})"
+
+
+class Variant:
+    __slots__ = ("name", "tag", "fields", "size")
+
+    def __init__(self, name: str, tag: int, fields: list[Field], size: int) -> None:
+        self.name = name
+        self.tag = tag
+        self.fields = fields
+        self.size = size
+
+    def __repr__(self) -> str:
+        return f"Variant({self.name}, TAG={self.tag}, FIELDS={self.fields})"
+
+
+# Concrete layout of one instance of a data type. With more than one
+# variant the first word is the tag and the fields follow it.
+class Layout:
+    def __init__(
+        self, ty: TypeInstance, variants: list[Variant], size: int, boxed: bool
+    ) -> None:
+        self.ty = ty
+        self.variants = variants
+        self.size = size
+        self.boxed = boxed
+
+    def __repr__(self) -> str:
+        name = self.ty.resolved_type.name  # type: ignore
+        return f"Layout({name}, SIZE={self.size}{', boxed' if self.boxed else ''}, VARIANTS={self.variants})"
+
+
+# A generic lambda with its type parameters filled in.
+class SpecializedLambda:
+    def __init__(
+        self,
+        definition: LambdaDefinition,
+        bindings: dict[str, TypeInstance],
+        parameter_types: list[TypeInstance],
+        boxed: bool,
+    ) -> None:
+        self.definition = definition
+        self.bindings = bindings
+        self.parameter_types = parameter_types
+        self.boxed = boxed
+
+    def __repr__(self) -> str:
+        return f"SpecializedLambda({self.definition.name}, {self.bindings}{', boxed' if self.boxed else ''})"
+
+
+class Monomorphizer:
+    def __init__(
+        self,
+        definitions: Iterable[DataTypeDefinition],
+        limit: int = DEFAULT_LIMIT,
+        depth: int = DEFAULT_DEPTH,
+    ) -> None:
+        self.definitions = {definition.name: definition for definition in definitions}
+        self.limit = limit
+        self.depth = depth
+        # The instantiation caches, interned instance -> its layout and
+        # (lambda, *type arguments) -> its specialization.
+        self.layouts: dict[TypeInstance, Layout] = {}
+        self.lambdas: dict[tuple, SpecializedLambda] = {}
+        # Specialized instances made so far per definition or lambda.
+        self.counts: dict[AstirExpr, int] = {}
+        self.depths: dict[TypeInstance, int] = {}
+        self.hits = 0
+        self.misses = 0
+        # The interned instances, see type_instance. BOXED is the one
+        # instance every Monomorphizer shares.
+        self.instances: dict[tuple, TypeInstance] = {(id(BOXED_DEFINITION),): BOXED}
+
+    # Types are never changed once made, so each structurally different
+    # one is only made once per Monomorphizer (see
+    # ../ast_exprs.ScopeArena.type_instance). Generics are interned
+    # before the instance using them, so they're compared by identity,
+    # and so is the definition they resolve to.
+    def type_instance(
+        self,
+        resolved_type: DataTypeDefinition | PrimitiveTypes,
+        filled_in_generics: list[TypeInstance] | None = None,
+    ) -> TypeInstance:
+        generics = filled_in_generics or []
+        key = (id(resolved_type), *map(id, generics))
+        interned = self.instances.get(key)
+        if interned is None:
+            interned = self.instances[key] = TypeInstance(resolved_type, generics)
+        return interned
+
+    # The interned instance a type expression as the parser leaves it
+    # (`Int`, `a`, `(List a)`, ...) stands for, with the type parameters
+    # in `bindings` filled in.
+    def resolve(
+        self, expr: AstirExpr, bindings: dict[str, TypeInstance] = {}
+    ) -> TypeInstance:
+        if isinstance(expr, TypeInstance):
+            generics = expr.filled_in_generics or []
+            if isinstance(expr.resolved_type, Identifier):
+                return self.resolve(expr.resolved_type, bindings)
+            return self.type_instance(
+                expr.resolved_type, [self.resolve(generic, bindings) for generic in generics]
+            )
+        elif isinstance(expr, Unit):
+            return self.type_instance(PrimitiveTypes.UNIT)
+        elif isinstance(expr, Identifier):
+            return self.apply(expr.value, [], bindings)
+        elif isinstance(expr, Parenthesized) and len(expr.values) > 0:
+            head = expr.values[0]
+            if len(expr.values) == 1:
+                return self.resolve(head, bindings)
+            if not isinstance(head, Identifier):
+                raise Exception(f"Expected a type name, got {head}")
+            return self.apply(
+                head.value,
+                [self.resolve(value, bindings) for value in expr.values[1:]],
+                bindings,
+            )
+        raise Exception(f"Not a type: {expr}")
+
+    def apply(
+        self, name: str, arguments: list[TypeInstance], bindings: dict[str, TypeInstance]
+    ) -> TypeInstance:
+        if name in bindings and len(arguments) == 0:
+            return bindings[name]
+        elif name in PRIMITIVE_NAMES and len(arguments) == 0:
+            return self.type_instance(PRIMITIVE_NAMES[name])
+        definition = self.definitions.get(name)
+        if definition is None:
+            raise Exception(f'Unknown type "{name}"')
+        elif len(arguments) != len(definition.generic_params):
+            raise Exception(
+                f"{name} takes {len(definition.generic_params)} type arguments, got {len(arguments)}"
+            )
+        return self.type_instance(definition, arguments)
+
+    # Layout of `ty` and of every data type its fields use. Worklist
+    # instead of recursion, so a recursive type is only laid out once.
+    def instantiate(self, ty: TypeInstance) -> Layout:
+        layout = self.layouts.get(ty)
+        if layout is not None:
+            self.hits += 1
+            return layout
+        pending = [ty]
+        while len(pending) > 0:
+            current = pending.pop()
+            if current in self.layouts:
+                continue
+            self.misses += 1
+            pending.extend(self.lay_out(current))
+        return self.layouts[ty]
+
+    # Lays out `ty` and gives back the instances its fields need.
+    def lay_out(self, ty: TypeInstance) -> list[TypeInstance]:
+        definition = ty.resolved_type
+        if not isinstance(definition, DataTypeDefinition):
+            raise Exception(f"Only data types have layouts, not {definition}")
+        arguments = ty.filled_in_generics or []
+        uniform = self.uniform(definition)
+        # Instances that already hold BOXED come from a boxed layout and
+        # don't count towards the limit.
+        if (
+            len(arguments) > 0
+            and not any(argument is BOXED for argument in arguments)
+            and self.over_limit(definition, arguments)
+        ):
+            tracing.codegen.debug(
+                lambda: f"{definition.name} falls back to the boxed layout",
+                instances=self.counts[definition],
+            )
+            if uniform not in self.layouts:
+                needed = self.lay_out(uniform)
+            else:
+                needed = []
+            self.layouts[ty] = self.layouts[uniform]
+            return needed
+
+        bindings = {
+            param.value: argument
+            for param, argument in zip(definition.generic_params, arguments)
+        }
+        variants: list[Variant] = []
+        needed: list[TypeInstance] = []
+        constructors = variants_of(definition)
+        tagged = len(constructors) > 1
+        for tag, (constructor, field_types) in enumerate(constructors):
+            offset = WORD if tagged else 0
+            fields: list[Field] = []
+            for value in field_types:
+                field_ty = self.resolve(value, bindings)
+                size, field_boxed = self.field_size(field_ty)
+                fields.append(Field(field_ty, offset, size, field_boxed))
+                offset += size
+                if isinstance(field_ty.resolved_type, DataTypeDefinition) and field_ty is not BOXED:
+                    needed.append(field_ty)
+            variants.append(Variant(constructor, tag, fields, offset))
+        size = max((variant.size for variant in variants), default=0)
+        self.layouts[ty] = Layout(ty, variants, size, len(arguments) > 0 and ty is uniform)
+        return needed
+
+    # Data types are always behind a pointer, so a field's size never
+    # depends on another layout.
+    def field_size(self, ty: TypeInstance) -> tuple[int, bool]:
+        if ty is BOXED:
+            return (WORD, True)
+        elif isinstance(ty.resolved_type, PrimitiveTypes):
+            return (PRIMITIVE_SIZES[ty.resolved_type], False)
+        return (WORD, False)
+
+    def uniform(self, definition: DataTypeDefinition) -> TypeInstance:
+        return self.type_instance(definition, [BOXED] * len(definition.generic_params))
+
+    # Counts a new specialization of `definition` and says whether it's
+    # one too many, or its arguments nest too deep.
+    def over_limit(self, definition: AstirExpr, arguments: list[TypeInstance]) -> bool:
+        if max(map(self.nesting, arguments)) > self.depth:
+            self.counts.setdefault(definition, 0)
+            return True
+        count = self.counts.get(definition, 0)
+        if count >= self.limit:
+            return True
+        self.counts[definition] = count + 1
+        return False
+
+    # How deep type arguments nest, `Int` is 0 and `List (List Int)` is 2.
+    # Remembered per instance, `Pair (Pair a a) (Pair a a)` shares its
+    # arguments, walking them every time would double with each level.
+    def nesting(self, ty: TypeInstance) -> int:
+        depth = self.depths.get(ty)
+        if depth is None:
+            generics = ty.filled_in_generics or []
+            depth = self.depths[ty] = (
+                1 + max(map(self.nesting, generics)) if len(generics) > 0 else 0
+            )
+        return depth
+
+    # `definition` with its type parameters set to `arguments`, and the
+    # layouts of its parameter types.
+    def specialize(
+        self, definition: LambdaDefinition, arguments: list[TypeInstance]
+    ) -> SpecializedLambda:
+        key = (definition, *arguments)
+        specialized = self.lambdas.get(key)
+        if specialized is not None:
+            self.hits += 1
+            return specialized
+        self.misses += 1
+        boxed = len(arguments) > 0 and self.over_limit(definition, arguments)
+        if boxed:
+            uniform_key = (definition, *[BOXED] * len(arguments))
+            specialized = self.lambdas.get(uniform_key)
+            if specialized is None:
+                specialized = self.lambdas[uniform_key] = self.make_specialized(
+                    definition, [BOXED] * len(arguments), True
+                )
+        else:
+            specialized = self.make_specialized(definition, arguments, False)
+        self.lambdas[key] = specialized
+        return specialized
+
+    def make_specialized(
+        self, definition: LambdaDefinition, arguments: list[TypeInstance], boxed: bool
+    ) -> SpecializedLambda:
+        if len(arguments) != len(definition.generic_params):
+            raise Exception(
+                f"{definition.name} takes {len(definition.generic_params)} type arguments, got {len(arguments)}"
+            )
+        bindings = {
+            param.value: argument
+            for param, argument in zip(definition.generic_params, arguments)
+        }
+        parameter_types = [self.resolve(ty, bindings) for ty in definition.parameter_types]
+        for ty in parameter_types:
+            if isinstance(ty.resolved_type, DataTypeDefinition) and ty is not BOXED:
+                self.instantiate(ty)
+        return SpecializedLambda(definition, bindings, parameter_types, boxed)
+
+    # Instantiates every data type in `exprs` that takes no type
+    # parameters, which pulls in each generic instance they use.
+    def instantiate_all(self, exprs: Iterable[AstirExpr]) -> list[Layout]:
+        return [
+            self.instantiate(self.type_instance(expr))
+            for expr in exprs
+            if isinstance(expr, DataTypeDefinition) and len(expr.generic_params) == 0
+        ]
+
+
+# The constructors of `definition` in tag order, each with the types of
+# its fields as parsed.
+def variants_of(definition: DataTypeDefinition) -> list[tuple[str, list[AstirExpr]]]:
+    elements = definition.elements
+    if elements is None:
+        elements = []
+    elif not isinstance(elements, list):
+        elements = [elements]
+    constructors: list[tuple[str, list[AstirExpr]]] = []
+    for element in elements:
+        # `(Pair a b)` comes out wrapped once more than `Pair a b`.
+        while isinstance(element, Parenthesized) and len(element.values) == 1:
+            element = element.values[0]
+        values = element.values if isinstance(element, Parenthesized) else [element]
+        if len(values) == 0 or not isinstance(values[0], Identifier):
+            raise Exception(f"Expected a constructor name in {definition.name}")
+        constructors.append((values[0].value, values[1:]))
+    return constructors
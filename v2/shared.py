@@ -25,7 +25,7 @@ class TT(Enum):
     OPEN_SQUARE = "["
     UNDERSCORE = "_"
     GREATER_THAN = ">"
-    LESS_THAN = ">"
+    LESS_THAN = "<"
     CURLY_OPEN = "{"
     CURLY_CLOSE = "}"
     EQ = "="
@@ -40,6 +40,9 @@ class TT(Enum):
 
 SYMBOLS = [TT.EQ, TT.LESS_THAN, TT.GREATER_THAN, TT.DASH, TT.FUNCTION_ARROW]
 
+OPENING_BRACKETS = [TT.OPEN_PAREN, TT.OPEN_SQUARE, TT.CURLY_OPEN]
+CLOSING_BRACKETS = [TT.CLOSE_PAREN, TT.CLOSE_SQUARE, TT.CURLY_CLOSE]
+
 operators = {
     "+": {
         "precedence": 1,